@@ -0,0 +1,116 @@
+"""
+Benchmarks of the database layer, run against a real database with
+`python -m app.benchmarks`.
+"""
+
+import json
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from contextlib import nullcontext
+from statistics import quantiles
+
+from fertiscan import get_full_inspection_json
+from fertiscan import update_inspection as db_update_inspection
+from fertiscan.db.metadata.inspection import build_inspection_import
+from fertiscan.db.queries.inspection import new_inspection_with_label_info
+
+from app.config import Settings, create_pool
+from app.controllers.files import read_folder, read_folders
+from app.controllers.users import sign_in
+from app.db import count_round_trips
+from app.models.inspections import Inspection, InspectionUpdate
+from app.models.label_data import LabelData
+from app.models.users import User
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """The median and 99th percentile of latencies, in milliseconds."""
+    cuts = quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+async def time_calls(call: Callable[[], Awaitable], iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def prepared_lookups(
+    settings: Settings, username: str, iterations: int = 1000
+) -> dict[str, dict[str, dict[str, float]]]:
+    """
+    Times the hot lookups of `username`, the username lookup behind sign-in
+    and the folder reads, on a pool that never prepares statements and then
+    on one using the prepare threshold of `settings`.
+
+    Returns:
+        dict: The p50 and p99 of each lookup, under "unprepared" and
+            "prepared".
+    """
+    results = {}
+    thresholds = {"unprepared": None, "prepared": settings.db_prepare_threshold or 0}
+    for label, threshold in thresholds.items():
+        config = settings.model_copy(update={"db_prepare_threshold": threshold})
+        with create_pool(config, open=True) as cp:
+            user = await sign_in(cp, User(username=username))
+            lookups = {
+                "sign_in": lambda: sign_in(cp, User(username=username)),
+                "read_folders": lambda: read_folders(cp, user.id),
+            }
+            if folders := await read_folders(cp, user.id):
+                folder_id = folders[0].id
+                lookups["read_folder"] = lambda: read_folder(cp, user.id, folder_id)
+            results[label] = {
+                name: summarize(await time_calls(call, iterations))
+                for name, call in lookups.items()
+            }
+    return results
+
+
+async def write_round_trips(
+    settings: Settings, username: str, label_data: LabelData
+) -> dict[str, dict[str, int]]:
+    """
+    Counts the round-trips of the inspection writes, creating an inspection
+    from `label_data` for `username` and then updating it, run one statement
+    at a time and then in pipeline mode. Both runs are rolled back. The writes
+    are only worth pipelining if the pipelined count is lower.
+
+    Returns:
+        dict: The round-trips of "create_inspection" and "update_inspection",
+            under "sequential" and "pipelined".
+    """
+    results = defaultdict(dict)
+    with create_pool(settings, open=True) as cp:
+        user = await sign_in(cp, User(username=username))
+        for label, pipelined in {"sequential": False, "pipelined": True}.items():
+            with cp.connection() as conn, conn.cursor() as cursor:
+                formatted_analysis = build_inspection_import(
+                    label_data.model_dump(mode="json"),
+                    user.id,
+                    label_data.picture_set_id,
+                )
+                with count_round_trips(conn) as round_trips:
+                    with conn.pipeline() if pipelined else nullcontext():
+                        inspection = new_inspection_with_label_info(
+                            cursor, user.id, formatted_analysis
+                        )
+                results["create_inspection"][label] = round_trips.count
+
+                id = Inspection.model_validate(inspection).inspection_id
+                document = json.loads(
+                    await get_full_inspection_json(cursor, id, user.id)
+                )
+                update = InspectionUpdate.model_validate(document).model_dump(
+                    mode="json"
+                )
+                with count_round_trips(conn) as round_trips:
+                    with conn.pipeline() if pipelined else nullcontext():
+                        await db_update_inspection(cursor, id, user.id, update)
+                results["update_inspection"][label] = round_trips.count
+                conn.rollback()
+    return dict(results)
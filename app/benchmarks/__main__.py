@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from app.benchmarks import prepared_lookups, write_round_trips
+from app.config import Settings
+from app.models.label_data import LabelData
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks")
+    parser.add_argument("command", choices=["prepared", "round-trips"])
+    parser.add_argument("--username", required=True, help="user to look up")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument(
+        "--label-data",
+        type=Path,
+        help="JSON label data to create inspections from, for round-trips",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "round-trips":
+        if args.label_data is None:
+            parser.error("round-trips requires --label-data")
+        label_data = LabelData.model_validate_json(args.label_data.read_text())
+        results = asyncio.run(write_round_trips(Settings(), args.username, label_data))
+    else:
+        results = asyncio.run(
+            prepared_lookups(Settings(), args.username, args.iterations)
+        )
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
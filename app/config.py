@@ -1,5 +1,6 @@
 from contextlib import asynccontextmanager
 from http import HTTPStatus
+from typing import Literal
 
 from dotenv import load_dotenv
 from fastapi import APIRouter, FastAPI, Request
@@ -16,12 +17,24 @@ from fastapi.responses import JSONResponse
 # from opentelemetry.sdk.trace import TracerProvider
 # from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from psycopg.conninfo import make_conninfo
+from psycopg.errors import QueryCanceled
 from psycopg_pool import ConnectionPool
 from pydantic import Field, computed_field
 from pydantic_settings import BaseSettings
 from pipeline import Settings as PipelineSettings
 
-from app.exceptions import log_error
+from app.cache import TTLCache
+from app.exceptions import DeadlineExceededError, log_error
+from app.instrumentation import InstrumentedCursor, query_metrics
+from app.invalidation import InvalidationBus
+from app.ratelimit import (
+    PostgresRateLimiter,
+    TokenBucketLimiter,
+    rate_limit_table_exists,
+)
+from app.snapshots import snapshot_table_exists
+from app.storage import BlobStorage
+from app.tokens import TokenSigner
 
 load_dotenv(".env.secrets")
 load_dotenv(".env.config")
@@ -49,6 +62,43 @@ class Settings(BaseSettings):
     # upload_folder: str = "uploads"
     allowed_origins: list[str]
     otel_exporter_otlp_endpoint: str = Field(alias="otel_exporter_otlp_endpoint")
+    inspection_cache_size: int = 1024
+    inspection_cache_ttl: float = 300.0
+    folder_cache_size: int = 1024
+    folder_cache_ttl: float = 300.0
+    user_cache_size: int = 10_000
+    user_cache_ttl: float = 300.0
+    token_keys: list[str] = []
+    token_ttl: float = 900.0
+    # Burst capacity and refill rate, per second, of each user's budget.
+    rate_limits: dict[str, tuple[float, float]] = {
+        "analyze": (10, 1 / 6),
+        "upload": (20, 1.0),
+        "read": (200, 20.0),
+    }
+    rate_limit_backend: Literal["memory", "postgres"] = "memory"
+    storage_provision_attempts: int = 5
+    blob_pool_size: int = 10
+    upload_concurrency: int = 4
+    cache_invalidation_channel: str = "fertiscan_cache_invalidation"
+    db_replica_host: str | None = None
+    db_replica_port: int | None = None
+    read_your_writes_window: float = 5.0
+    db_prepare_threshold: int | None = 5
+    db_prepared_max: int = 100
+    request_timeout: float = 30.0
+    max_request_timeout: float = 300.0
+    route_timeouts: dict[str, float] = {
+        "analyze_document": 120.0,
+        "bulk_delete_inspections": 120.0,
+        "bulk_verify_inspections": 120.0,
+    }
+    slow_query_threshold: float | None = 0.5
+    inspection_batch_max: int = 50
+    inspection_bulk_max: int = 1000
+    export_itersize: int = 1000
+    # Requires `python -m app.snapshots create` first: see app.snapshots.
+    inspection_snapshots: bool = False
 
     @computed_field
     @property
@@ -71,11 +121,44 @@ class Settings(BaseSettings):
             dbname=self.db_name,
         )
 
+    @computed_field
+    @property
+    def db_replica_conn_info(self) -> str | None:
+        if not self.db_replica_host:
+            return None
+        return make_conninfo(
+            user=self.db_user,
+            password=self.db_password,
+            host=self.db_replica_host,
+            port=self.db_replica_port or self.db_port,
+            dbname=self.db_name,
+        )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # settings: Settings = app.settings
+    app.storage = BlobStorage(
+        app.settings.azure_storage_connection_string, app.settings.blob_pool_size
+    )
     app.pool.open()
+    if app.settings.inspection_snapshots:
+        with app.pool.connection() as conn:
+            if not snapshot_table_exists(conn):
+                raise RuntimeError(
+                    "inspection_snapshot is missing: run `python -m app.snapshots"
+                    " create` or disable INSPECTION_SNAPSHOTS"
+                )
+    if app.settings.rate_limit_backend == "postgres":
+        with app.pool.connection() as conn:
+            if not rate_limit_table_exists(conn):
+                raise RuntimeError(
+                    "rate_limit_bucket is missing: run `python -m app.ratelimit"
+                    " create` or set RATE_LIMIT_BACKEND=memory"
+                )
+    if app.replica_pool is not None:
+        app.replica_pool.open()
+    app.bus.start()
     # resource = Resource.create(
     #     {
     #         "service.name": "fertiscan-backend",
@@ -105,11 +188,44 @@ async def lifespan(app: FastAPI):
     # handler = LoggingHandler(logger_provider=logger_provider)
     # logger.addHandler(handler)
     yield
+    app.bus.stop()
+    if app.replica_pool is not None:
+        app.replica_pool.close()
     app.pool.close()
+    await app.storage.close()
     # logger_provider.shutdown()
     # tracer_provider.shutdown()
 
 
+def create_pool(
+    settings: Settings,
+    conninfo: str | None = None,
+    read_only: bool = False,
+    open: bool = False,
+) -> ConnectionPool:
+    """
+    Creates a pool of connections to the fertiscan schema of the primary, or
+    of the database at `conninfo`.
+    """
+    options = f"-c search_path={settings.fertiscan_schema},public"
+    if read_only:
+        options += " -c default_transaction_read_only=on"
+
+    def configure(conn):
+        # Statements run this many times on a connection are prepared
+        # server-side, so hot lookups skip parsing and planning.
+        conn.prepare_threshold = settings.db_prepare_threshold
+        conn.prepared_max = settings.db_prepared_max
+        conn.cursor_factory = InstrumentedCursor
+
+    return ConnectionPool(
+        open=open,
+        conninfo=conninfo or settings.db_conn_info,
+        kwargs={"options": options},
+        configure=configure,
+    )
+
+
 def create_app(settings: Settings, router: APIRouter, lifespan=None):
     app = FastAPI(
         lifespan=lifespan, docs_url=settings.swagger_path, root_path=settings.base_path
@@ -124,12 +240,65 @@ def create_app(settings: Settings, router: APIRouter, lifespan=None):
         allow_headers=["*"],
     )
 
-    pool = ConnectionPool(
-        open=False,
-        conninfo=settings.db_conn_info,
-        kwargs={"options": f"-c search_path={settings.fertiscan_schema},public"},
+    query_metrics.slow_query_threshold = settings.slow_query_threshold
+
+    app.pool = create_pool(settings)
+    # Created in lifespan, along with the connections it keeps open.
+    app.storage = None
+
+    app.replica_pool = None
+    if settings.db_replica_conn_info:
+        app.replica_pool = create_pool(
+            settings, settings.db_replica_conn_info, read_only=True
+        )
+
+    # Users who wrote recently read from the primary until the replica has
+    # had time to catch up.
+    app.recent_writers = TTLCache(
+        "recent_writers", maxsize=10_000, ttl=settings.read_your_writes_window
+    )
+
+    app.caches = {
+        "inspections": TTLCache(
+            "inspections",
+            maxsize=settings.inspection_cache_size,
+            ttl=settings.inspection_cache_ttl,
+        ),
+        "folders": TTLCache(
+            "folders",
+            maxsize=settings.folder_cache_size,
+            ttl=settings.folder_cache_ttl,
+        ),
+        "users": TTLCache(
+            "users",
+            maxsize=settings.user_cache_size,
+            ttl=settings.user_cache_ttl,
+        ),
+    }
+
+    if settings.rate_limit_backend == "postgres":
+        app.rate_limiter = PostgresRateLimiter(app.pool, settings.rate_limits)
+    else:
+        app.rate_limiter = TokenBucketLimiter(settings.rate_limits)
+
+    # Without keys, users authenticate with Basic credentials only.
+    app.tokens = None
+    if settings.token_keys:
+        app.tokens = TokenSigner(settings.token_keys, settings.token_ttl)
+
+    app.bus = InvalidationBus(
+        settings.db_conn_info, settings.cache_invalidation_channel
     )
-    app.pool = pool
+    for cache in app.caches.values():
+        app.bus.register(cache)
+
+    def mark_recent_writer(_: str, key):
+        # Per-user cache keys start with the owner's id: a write seen from
+        # another replica makes its owner sticky to the primary here too.
+        if isinstance(key, tuple):
+            app.recent_writers.set(key[0], True)
+
+    app.bus.subscribe(mark_recent_writer)
 
     app.pipeline_settings = PipelineSettings(
         document_api_endpoint=settings.api_endpoint,
@@ -153,6 +322,15 @@ def create_app(settings: Settings, router: APIRouter, lifespan=None):
 
     app.include_router(router)
 
+    @app.exception_handler(DeadlineExceededError)
+    @app.exception_handler(QueryCanceled)
+    async def deadline_exception_handler(_: Request, e: Exception):
+        log_error(e)
+        return JSONResponse(
+            status_code=HTTPStatus.GATEWAY_TIMEOUT,
+            content={"detail": "Request deadline exceeded"},
+        )
+
     @app.exception_handler(Exception)
     async def global_exception_handler(_: Request, e: Exception):
         log_error(e)
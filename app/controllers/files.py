@@ -1,46 +1,159 @@
-from uuid import UUID
+import asyncio
+import json
+from datetime import datetime
+from http import HTTPStatus
+from uuid import UUID, uuid4
 
-from azure.storage.blob import ContainerClient
-from datastore import (
-    create_picture_set,
-    delete_picture_set_permanently,
-    upload_pictures,
-)
-from datastore.blob.azure_storage_api import (
-    GetBlobError,
-    build_blob_name,
-    build_container_name,
-    get_blob,
+import filetype
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
 )
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import ContainerClient, StorageStreamDownloader
+from datastore import create_picture_set, delete_picture_set_permanently
+from datastore.blob.azure_storage_api import build_blob_name
+from datastore.db.queries import picture
 from datastore.db.queries.picture import PictureSetNotFoundError
 from psycopg.rows import dict_row
 from psycopg.sql import SQL
 from psycopg_pool import ConnectionPool
 
-from app.exceptions import FileNotFoundError
+from app.cache import TTLCache
+from app.db import RequestConnection, batched_writes, prepared_statements
+from app.etags import etag_matches
+from app.exceptions import (
+    FileNotFoundError,
+    FileNotModifiedError,
+    RangeNotSatisfiableError,
+    log_error,
+)
+from app.instrumentation import labelled
 from app.models.files import Folder
+from app.storage import BlobStorage, run_in_thread
+
+# What the blob service reports for blobs stored without a content type.
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# Containers known to exist, so uploads only try to create them once.
+provisioned_containers = TTLCache("containers", maxsize=10_000, ttl=3600.0)
+
+
+async def ensure_container(container_client: ContainerClient):
+    """Creates a user's container unless it already exists. Idempotent."""
+    name = container_client.container_name
+    if provisioned_containers.get(name):
+        return
+    try:
+        await container_client.create_container()
+    except ResourceExistsError:
+        pass
+    provisioned_containers.set(name, True)
 
 
+def picture_metadata(folder_name: str | UUID, picture_id: UUID) -> dict:
+    """The `picture` column of a stored picture, as the datastore writes it."""
+    return {
+        "link": f"{folder_name}/{picture_id}",
+        "description": "Uploaded through the API",
+    }
+
+
+def guess_content_type(data: bytes) -> str:
+    """Detects a file's MIME type from its first bytes."""
+    kind = filetype.guess(data)
+    return kind.mime if kind else DEFAULT_CONTENT_TYPE
+
+
+async def upload_files(
+    container_client: ContainerClient,
+    folder_id: UUID,
+    file_ids: list[UUID],
+    files: list[bytes],
+    concurrency: int = 4,
+):
+    """
+    Uploads files to a folder under their ids concurrently, at most
+    `concurrency` at a time, each with its content type.
+
+    If any upload fails, or the upload is cancelled, the files already
+    uploaded are deleted and the first error is raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    started = []
+
+    async def upload(file_id: UUID, data: bytes):
+        async with semaphore:
+            started.append(file_id)
+            await container_client.upload_blob(
+                build_blob_name(str(folder_id), str(file_id)),
+                data,
+                content_settings=ContentSettings(content_type=guess_content_type(data)),
+            )
+
+    try:
+        results = await asyncio.gather(
+            *(upload(file_id, data) for file_id, data in zip(file_ids, files)),
+            return_exceptions=True,
+        )
+    except asyncio.CancelledError:
+        # gather has cancelled the uploads still running; any may have landed.
+        await delete_files(container_client, folder_id, started)
+        raise
+    if errors := [r for r in results if isinstance(r, BaseException)]:
+        await delete_files(
+            container_client,
+            folder_id,
+            [file_id for file_id, result in zip(file_ids, results) if result is None],
+        )
+        raise errors[0]
+
+
+async def delete_files(
+    container_client: ContainerClient, folder_id: UUID, file_ids: list[UUID]
+):
+    """Deletes files from a folder, ignoring the ones that can't be deleted."""
+    await asyncio.gather(
+        *(
+            container_client.delete_blob(build_blob_name(str(folder_id), str(file_id)))
+            for file_id in file_ids
+        ),
+        return_exceptions=True,
+    )
+
+
+@labelled("read_folders")
 async def read_folders(cp: ConnectionPool, user_id: UUID | str):
     if not isinstance(user_id, UUID):
         user_id = UUID(user_id)
 
     with cp.connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
         query = SQL("SELECT * FROM picture_set WHERE owner_id = %s")
-        cursor.execute(query, (user_id,))
+        prepared_statements.execute(cursor, "read_folders", query, (user_id,))
         folders = cursor.fetchall()
         folders = [Folder.model_validate(f) for f in folders]
         return folders
 
 
+@labelled("read_folder")
 async def read_folder(
-    cp: ConnectionPool, user_id: UUID | str, picture_set_id: UUID | str
+    cp: ConnectionPool,
+    user_id: UUID | str,
+    picture_set_id: UUID | str,
+    cache: TTLCache | None = None,
 ) -> Folder:
     if not isinstance(user_id, UUID):
         user_id = UUID(user_id)
     if not isinstance(picture_set_id, UUID):
         picture_set_id = UUID(picture_set_id)
 
+    key = (user_id, picture_set_id)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        return cached
+
     with cp.connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
         query = SQL(
             """
@@ -53,67 +166,174 @@ async def read_folder(
             GROUP BY ps.id;
             """
         )
-        cursor.execute(query, (str(user_id), str(picture_set_id)))
+        prepared_statements.execute(
+            cursor, "read_folder", query, (str(user_id), str(picture_set_id))
+        )
         if (folder := cursor.fetchone()) is None:
             raise FileNotFoundError(f"Folder {picture_set_id} not found")
-        return Folder.model_validate(folder)
+        folder = Folder.model_validate(folder)
+
+    if cache is not None:
+        cache.set(key, folder)
+    return folder
 
 
+@labelled("create_folder")
 async def create_folder(
     cp: ConnectionPool,
-    connection_string: str,
+    storage: BlobStorage,
     user_id: UUID | str,
     label_images: list[bytes],
+    cache: TTLCache | None = None,
+    concurrency: int = 4,
 ):
+    """
+    Creates a folder of files. The picture set is committed first, the files
+    are uploaded with no transaction open, and their rows are inserted in one
+    batch once all of them are stored. If anything fails after the picture set
+    is committed, it is deleted along with the uploaded files.
+    """
     if not isinstance(user_id, UUID):
         user_id = UUID(user_id)
 
+    async_container_client = storage.async_container(user_id)
+    # Sign-up provisions the container in the background: it may not be
+    # there yet on a first upload.
+    await ensure_container(async_container_client)
+
     with cp.connection() as conn, conn.cursor() as cursor:
-        container_client = ContainerClient.from_connection_string(
-            connection_string, container_name=build_container_name(str(user_id))
-        )
-        picture_set_id = await create_picture_set(
-            cursor, container_client, len(label_images), user_id
+        container_client = storage.container(user_id)
+        picture_set_id = await run_in_thread(
+            create_picture_set(cursor, container_client, len(label_images), user_id)
         )
-        picture_ids = await upload_pictures(
-            cursor, str(user_id), label_images, container_client, str(picture_set_id)
+        picture_set_id = UUID(str(picture_set_id))
+        folder_name = picture.get_picture_set_name(cursor, picture_set_id)
+        conn.commit()
+    if isinstance(cp, RequestConnection):
+        # The uploads don't need the connection: hand it back meanwhile.
+        cp.release()
+
+    picture_ids = [uuid4() for _ in label_images]
+    try:
+        await upload_files(
+            async_container_client,
+            picture_set_id,
+            picture_ids,
+            label_images,
+            concurrency,
         )
-        folder = Folder(id=picture_set_id, file_ids=picture_ids)
-        return folder
+        with cp.connection() as conn, conn.cursor() as cursor:
+            with batched_writes(conn, "create_folder"):
+                cursor.executemany(
+                    SQL(
+                        """
+                        INSERT INTO picture (id, picture, picture_set_id, nb_obj)
+                        VALUES (%s, %s, %s, 0)
+                        """
+                    ),
+                    [
+                        (
+                            picture_id,
+                            json.dumps(
+                                picture_metadata(
+                                    folder_name or picture_set_id, picture_id
+                                )
+                            ),
+                            picture_set_id,
+                        )
+                        for picture_id in picture_ids
+                    ],
+                )
+            if cache is not None:
+                cache.invalidate((user_id, picture_set_id), cursor)
+            conn.commit()
+    except BaseException:
+        await discard_folder(cp, storage, user_id, picture_set_id, picture_ids)
+        raise
+    return Folder(id=picture_set_id, file_ids=picture_ids)
+
+
+async def discard_folder(
+    cp: ConnectionPool,
+    storage: BlobStorage,
+    user_id: UUID,
+    folder_id: UUID,
+    file_ids: list[UUID],
+):
+    """
+    Deletes a folder whose creation failed, and the files uploaded to it.
+    Errors are logged, so they don't hide the one that caused the failure.
+    """
+    await delete_files(storage.async_container(user_id), folder_id, file_ids)
+    try:
+        with cp.connection() as conn, conn.cursor() as cursor:
+            conn.rollback()
+            await run_in_thread(
+                delete_picture_set_permanently(
+                    cursor, str(user_id), folder_id, storage.container(user_id)
+                )
+            )
+            conn.commit()
+    except Exception as e:
+        log_error(e)
 
 
+@labelled("delete_folder")
 async def delete_folder(
     cp: ConnectionPool,
-    connection_string: str,
+    storage: BlobStorage,
     user_id: UUID | str,
     folder_id: UUID | str,
+    cache: TTLCache | None = None,
 ):
     if not isinstance(user_id, UUID):
         user_id = UUID(user_id)
     if not isinstance(folder_id, UUID):
         folder_id = UUID(folder_id)
 
-    container_client = ContainerClient.from_connection_string(
-        connection_string, container_name=build_container_name(str(user_id))
-    )
+    container_client = storage.container(user_id)
 
     with cp.connection() as conn, conn.cursor() as cursor:
         try:
-            await delete_picture_set_permanently(
-                cursor, str(user_id), folder_id, container_client
+            await run_in_thread(
+                delete_picture_set_permanently(
+                    cursor, str(user_id), folder_id, container_client
+                )
             )
         except PictureSetNotFoundError:
             raise FileNotFoundError(f"Folder not found with ID: {folder_id}")
 
+        if cache is not None:
+            cache.invalidate((user_id, folder_id), cursor)
         return Folder(id=folder_id)
 
 
 async def read_file(
-    connection_string: str,
+    storage: BlobStorage,
     user_id: UUID | str,
     folder_id: UUID | str,
     file_id: UUID | str,
-):
+    offset: int | None = None,
+    length: int | None = None,
+    if_none_match: str | None = None,
+    if_modified_since: datetime | None = None,
+) -> StorageStreamDownloader:
+    """
+    Starts downloading a file, or the `length` bytes of it from `offset`.
+
+    Args:
+        if_none_match (str | None): If-None-Match header: the ETags of the
+            copies the client already has, or "*". The download only happens
+            if the blob's ETag matches none of them.
+        if_modified_since (datetime | None): The download only happens if
+            the blob changed since then.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist.
+        FileNotModifiedError: If a condition on `etag` or `if_modified_since`
+            failed.
+        RangeNotSatisfiableError: If `offset` is past the end of the file.
+    """
     if not isinstance(user_id, UUID):
         user_id = UUID(user_id)
     if not isinstance(folder_id, UUID):
@@ -121,17 +341,45 @@ async def read_file(
     if not isinstance(file_id, UUID):
         file_id = UUID(file_id)
 
-    container_client = ContainerClient.from_connection_string(
-        connection_string, container_name=build_container_name(str(user_id))
-    )
+    container_client = storage.async_container(user_id)
     blob_name = build_blob_name(str(folder_id), str(file_id))
 
+    # The blob service takes a single ETag: several are compared here first.
+    etags = [t.strip().removeprefix("W/") for t in (if_none_match or "").split(",")]
+    etags = [t for t in etags if t]
+    etag = etags[0] if len(etags) == 1 else None
+    conditions = {}
+    if etag == "*":
+        conditions["match_condition"] = MatchConditions.IfMissing
+    elif etag:
+        conditions["etag"] = etag
+        conditions["match_condition"] = MatchConditions.IfModified
+    if if_modified_since is not None:
+        conditions["if_modified_since"] = if_modified_since
+
     try:
-        blob: bytes = await get_blob(container_client, blob_name)
-        return blob
-    except GetBlobError as e:
-        if "The specified blob does not exist." in str(e):
-            raise FileNotFoundError(
-                f"File {file_id} not found in folder {folder_id}"
+        if len(etags) > 1:
+            properties = await container_client.get_blob_client(
+                blob_name
+            ).get_blob_properties()
+            if etag_matches(if_none_match, properties.etag):
+                raise FileNotModifiedError(
+                    f"File {file_id} not modified", properties.etag
+                )
+        return await container_client.download_blob(
+            blob_name, offset=offset, length=length, **conditions
+        )
+    except ResourceNotFoundError as e:
+        raise FileNotFoundError(
+            f"File {file_id} not found in folder {folder_id}"
+        ) from e
+    except ResourceNotModifiedError as e:
+        raise FileNotModifiedError(
+            f"File {file_id} not modified", etag if etag != "*" else None
+        ) from e
+    except HttpResponseError as e:
+        if e.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            raise RangeNotSatisfiableError(
+                f"Range starting at {offset} not satisfiable for file {file_id}"
             ) from e
         raise
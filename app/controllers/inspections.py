@@ -1,8 +1,14 @@
 import asyncio
+import csv
+import io
+import json
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from itertools import islice
+from typing import Annotated, Any, Literal
 from uuid import UUID
 
-from azure.storage.blob import ContainerClient
-from datastore.blob.azure_storage_api import build_container_name
+from datastore.blob.azure_storage_api import build_blob_name
 from fertiscan import delete_inspection as db_delete_inspection
 from fertiscan import get_full_inspection_json, get_user_analysis_by_verified
 from fertiscan import update_inspection as db_update_inspection
@@ -10,21 +16,38 @@ from fertiscan.db.metadata.inspection import build_inspection_import
 from fertiscan.db.queries.inspection import (
     InspectionNotFoundError as DBInspectionNotFoundError,
 )
+from fertiscan.db.queries.inspection import delete_inspection as delete_inspection_rows
 from fertiscan.db.queries.inspection import new_inspection_with_label_info
+from psycopg import Cursor
+from psycopg.rows import dict_row
+from psycopg.sql import SQL, Identifier
 from psycopg_pool import ConnectionPool
+from pydantic import TypeAdapter
+from pydantic_core import to_json, to_jsonable_python
 
+from app.cache import TTLCache
+from app.db import prepared_statements
+from app.etags import make_etag
 from app.exceptions import InspectionNotFoundError, MissingUserAttributeError, log_error
+from app.instrumentation import labelled, operation
 from app.models.inspections import (
     DeletedInspection,
     Inspection,
+    InspectionBulkResult,
+    InspectionCreate,
     InspectionData,
+    InspectionImportError,
+    InspectionImportProgress,
     InspectionResponse,
     InspectionUpdate,
 )
 from app.models.label_data import LabelData
 from app.models.users import User
+from app.snapshots import read_snapshots, refresh_snapshot
+from app.storage import BlobStorage, delete_blobs, run_in_thread
 
 
+@labelled("read_all_inspections")
 async def read_all_inspections(cp: ConnectionPool, user: User):
     if not user.id:
         raise MissingUserAttributeError("User ID is required for fetching inspections.")
@@ -55,7 +78,55 @@ async def read_all_inspections(cp: ConnectionPool, user: User):
         return inspections
 
 
-async def read_inspection(cp: ConnectionPool, user: User, id: UUID | str):
+def select_inspection_etag(cursor: Cursor, user_id: UUID, id: UUID) -> str:
+    query = SQL(
+        """
+        SELECT COALESCE(updated_at, upload_date)
+        FROM inspection
+        WHERE id = %s AND inspector_id = %s
+        """
+    )
+    prepared_statements.execute(cursor, "inspection_etag", query, (id, user_id))
+    if (row := cursor.fetchone()) is None:
+        raise InspectionNotFoundError(f"Inspection {id} not found")
+    return make_etag(id, row[0])
+
+
+@labelled("read_inspection_etag")
+async def read_inspection_etag(
+    cp: ConnectionPool,
+    user: User,
+    id: UUID | str,
+    cache: TTLCache | None = None,
+) -> str:
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required for fetching inspections.")
+    if not id:
+        raise ValueError("Inspection ID is required for fetching inspection details.")
+    if not isinstance(id, UUID):
+        id = UUID(id)
+
+    if cache is not None and (cached := cache.get((user.id, id))) is not None:
+        return cached[0]
+
+    with cp.connection() as conn, conn.cursor() as cursor:
+        return select_inspection_etag(cursor, user.id, id)
+
+
+@labelled("read_inspection")
+async def read_inspection(
+    cp: ConnectionPool,
+    user: User,
+    id: UUID | str,
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
+) -> tuple[str, InspectionResponse]:
+    """
+    Reads an inspection of a user.
+
+    Returns:
+        tuple: The ETag of the inspection and the inspection it was read with.
+    """
     if not user.id:
         raise MissingUserAttributeError("User ID is required for fetching inspections.")
     if not id:
@@ -63,17 +134,113 @@ async def read_inspection(cp: ConnectionPool, user: User, id: UUID | str):
     if not isinstance(id, UUID):
         id = UUID(id)
 
+    key = (user.id, id)
+    if cache is not None and (cached := cache.get(key)) is not None:
+        return cached
+
     with cp.connection() as conn, conn.cursor() as cursor:
+        if snapshots and (snapshot := read_snapshots(cursor, user.id, [id])):
+            etag, inspection = snapshot[id]
+            if cache is not None:
+                cache.set(key, (etag, inspection))
+            return etag, inspection
+        # Read the version first: if a write lands in between, the etag is
+        # older than the body and the next revalidation simply refetches.
+        etag = select_inspection_etag(cursor, user.id, id)
         try:
-            inspection = await get_full_inspection_json(cursor, id, user.id)
+            with operation("get_full_inspection_json"):
+                inspection = await get_full_inspection_json(cursor, id, user.id)
         except DBInspectionNotFoundError as e:
             log_error(e)
             raise InspectionNotFoundError(f"{e}") from e
-        return InspectionResponse.model_validate_json(inspection)
+        inspection = InspectionResponse.model_validate_json(inspection)
+
+    if cache is not None:
+        cache.set(key, (etag, inspection))
+    return etag, inspection
+
+
+def select_inspection_etags(
+    cursor: Cursor, user_id: UUID, ids: list[UUID]
+) -> dict[UUID, str]:
+    query = SQL(
+        """
+        SELECT id, COALESCE(updated_at, upload_date)
+        FROM inspection
+        WHERE id = ANY(%s) AND inspector_id = %s
+        """
+    )
+    prepared_statements.execute(cursor, "inspection_etags", query, (ids, user_id))
+    return {id: make_etag(id, version) for id, version in cursor.fetchall()}
+
+
+@labelled("read_inspections")
+async def read_inspections(
+    cp: ConnectionPool,
+    user: User,
+    ids: list[UUID | str],
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
+) -> tuple[list[InspectionResponse], list[UUID]]:
+    """
+    Reads several inspections of a user at once.
+
+    Cached inspections are served from the cache. The others are checked for
+    ownership in a single query and then read on the same connection.
+
+    Returns:
+        tuple: The inspections found, in the order requested, and the ids of
+            those that don't exist or belong to someone else.
+    """
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required for fetching inspections.")
+    ids = _unique_ids(ids)
 
+    found: dict[UUID, InspectionResponse] = {}
+    if cache is not None:
+        for id in ids:
+            if (cached := cache.get((user.id, id))) is not None:
+                found[id] = cached[1]
 
+    if missing := [id for id in ids if id not in found]:
+        with cp.connection() as conn, conn.cursor() as cursor:
+            if snapshots:
+                for id, (etag, inspection) in read_snapshots(
+                    cursor, user.id, missing
+                ).items():
+                    found[id] = inspection
+                    if cache is not None:
+                        cache.set((user.id, id), (etag, inspection))
+                missing = [id for id in missing if id not in found]
+            etags = select_inspection_etags(cursor, user.id, missing)
+            for id in missing:
+                if id not in etags:
+                    continue
+                try:
+                    with operation("get_full_inspection_json"):
+                        inspection = await get_full_inspection_json(
+                            cursor, id, user.id
+                        )
+                except DBInspectionNotFoundError as e:
+                    # Deleted since the ownership check.
+                    log_error(e)
+                    continue
+                found[id] = InspectionResponse.model_validate_json(inspection)
+                if cache is not None:
+                    cache.set((user.id, id), (etags[id], found[id]))
+
+    inspections = [found[id] for id in ids if id in found]
+    not_found = [id for id in ids if id not in found]
+    return inspections, not_found
+
+
+@labelled("create_inspection")
 async def create_inspection(
-    cp: ConnectionPool, user: User, label_data: LabelData | dict
+    cp: ConnectionPool,
+    user: User,
+    label_data: LabelData | dict,
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
 ):
     if not user.id:
         raise MissingUserAttributeError("User ID is required for creating inspections.")
@@ -84,16 +251,25 @@ async def create_inspection(
         formatted_analysis = build_inspection_import(
             label_data.model_dump(mode="json"), user.id, label_data.picture_set_id
         )
-        inspection = new_inspection_with_label_info(cursor, user.id, formatted_analysis)
+        inspection = new_inspection_with_label_info(
+            cursor, user.id, formatted_analysis
+        )
         inspection = Inspection.model_validate(inspection)
+        if snapshots and inspection.inspection_id:
+            await refresh_snapshot(cursor, user.id, inspection.inspection_id)
+        if cache is not None and inspection.inspection_id:
+            cache.invalidate((user.id, inspection.inspection_id), cursor)
         return inspection
 
 
+@labelled("update_inspection")
 async def update_inspection(
     cp: ConnectionPool,
     user: User,
     id: str | UUID,
     inspection: InspectionUpdate,
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
 ):
     if not user.id:
         raise MissingUserAttributeError("User ID is required for updating inspections.")
@@ -112,28 +288,499 @@ async def update_inspection(
         except DBInspectionNotFoundError as e:
             log_error(e)
             raise InspectionNotFoundError(f"{e}") from e
+        if snapshots:
+            await refresh_snapshot(cursor, user.id, id)
+        if cache is not None:
+            cache.invalidate((user.id, id), cursor)
         return InspectionResponse.model_validate(result.model_dump())
 
 
+def _unique_ids(ids: list[UUID | str]) -> list[UUID]:
+    return list(dict.fromkeys(id if isinstance(id, UUID) else UUID(id) for id in ids))
+
+
+@labelled("verify_inspections")
+async def verify_inspections(
+    cp: ConnectionPool,
+    user: User,
+    ids: list[UUID | str],
+    verified: bool = True,
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
+) -> list[InspectionBulkResult]:
+    """
+    Sets the verified flag of many inspections in one transaction. Each
+    inspection goes through the datastore's update, which does what
+    verification entails besides the flag, in a savepoint, so one failure
+    doesn't undo the others.
+    """
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required for updating inspections.")
+    ids = _unique_ids(ids)
+
+    results = []
+    with cp.connection() as conn, conn.cursor() as cursor:
+        for id in ids:
+            try:
+                with conn.transaction():
+                    with operation("get_full_inspection_json"):
+                        raw = await get_full_inspection_json(cursor, id, user.id)
+                    document = json.loads(raw)
+                    document["verified"] = verified
+                    inspection_data = InspectionUpdate.model_validate(
+                        document
+                    ).model_dump(mode="json")
+                    await db_update_inspection(cursor, id, user.id, inspection_data)
+                    if snapshots:
+                        await refresh_snapshot(cursor, user.id, id)
+                    if cache is not None:
+                        cache.invalidate((user.id, id), cursor)
+                results.append(InspectionBulkResult(id=id, status="updated"))
+            except DBInspectionNotFoundError:
+                results.append(InspectionBulkResult(id=id, status="not_found"))
+            except Exception as e:
+                log_error(e)
+                results.append(
+                    InspectionBulkResult(id=id, status="failed", detail=str(e))
+                )
+        conn.commit()
+
+    return results
+
+
+@labelled("delete_inspections")
+async def delete_inspections(
+    cp: ConnectionPool,
+    user: User,
+    ids: list[UUID | str],
+    storage: BlobStorage,
+    cache: TTLCache | None = None,
+    folder_cache: TTLCache | None = None,
+) -> list[InspectionBulkResult]:
+    """
+    Deletes many inspections in one transaction. Each deletion runs in a
+    savepoint, so one failure doesn't undo the others.
+
+    Pictures are only deleted from blob storage once the transaction has
+    committed, in batches, and only those of picture sets the deletions
+    removed: a deletion that is rolled back keeps its pictures. The removed
+    picture sets are invalidated in `folder_cache`.
+    """
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required to delete an inspection.")
+    if storage is None:
+        raise ValueError("Blob storage is required to delete inspections.")
+    ids = _unique_ids(ids)
+
+    results = []
+    with cp.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            SQL(
+                """
+                SELECT p.picture_set_id, p.id
+                FROM inspection i
+                JOIN picture p ON p.picture_set_id = i.picture_set_id
+                WHERE i.id = ANY(%s) AND i.inspector_id = %s
+                """
+            ),
+            (ids, user.id),
+        )
+        pictures = cursor.fetchall()
+        for id in ids:
+            try:
+                with conn.transaction():
+                    delete_inspection_rows(cursor, id, user.id)
+                    if cache is not None:
+                        cache.invalidate((user.id, id), cursor)
+                results.append(InspectionBulkResult(id=id, status="deleted"))
+            except DBInspectionNotFoundError:
+                results.append(InspectionBulkResult(id=id, status="not_found"))
+            except Exception as e:
+                log_error(e)
+                results.append(
+                    InspectionBulkResult(id=id, status="failed", detail=str(e))
+                )
+        cursor.execute(
+            SQL("SELECT id FROM picture_set WHERE id = ANY(%s)"),
+            (list({picture_set_id for picture_set_id, _ in pictures}),),
+        )
+        remaining = {row[0] for row in cursor.fetchall()}
+        if folder_cache is not None:
+            for picture_set_id in {ps for ps, _ in pictures} - remaining:
+                folder_cache.invalidate((user.id, picture_set_id), cursor)
+        conn.commit()
+
+    await delete_blobs(
+        storage.async_container(user.id),
+        [
+            build_blob_name(str(picture_set_id), str(picture_id))
+            for picture_set_id, picture_id in pictures
+            if picture_set_id not in remaining
+        ],
+    )
+    return results
+
+
+# Merge-patch leaves that map onto a single column and can be written in
+# place. A patch touching anything else goes through the full graph update.
+# `verified` isn't one of them: verifying does more than set the flag.
+# The columns are checked against the database schema by
+# tests/test_inspections.py::TestColumnMapSchema.
+INSPECTION_COLUMNS = {
+    ("inspection_comment",): "inspection_comment",
+}
+LABEL_COLUMNS = {
+    ("product", "name"): "product_name",
+    ("product", "lot_number"): "lot_number",
+    ("product", "npk"): "npk",
+    ("product", "n"): "n",
+    ("product", "p"): "p",
+    ("product", "k"): "k",
+}
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """Applies an RFC 7386 JSON merge patch to `target` and returns the result."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def merge_patch_paths(patch: dict, prefix: tuple = ()) -> Iterator[tuple]:
+    """Yields the path of every leaf a merge patch sets or removes."""
+    for key, value in patch.items():
+        path = (*prefix, key)
+        if isinstance(value, dict) and value:
+            yield from merge_patch_paths(value, path)
+        else:
+            yield path
+
+
+def _get_path(document: dict, path: tuple) -> Any:
+    for key in path:
+        document = (document or {}).get(key)
+    return document
+
+
+def _assignments(values: dict[str, Any]) -> SQL:
+    return SQL(", ").join(SQL("{} = %s").format(Identifier(c)) for c in values)
+
+
+def update_inspection_columns(
+    cursor: Cursor, user_id: UUID, id: UUID, document: dict, paths: list[tuple]
+):
+    inspection_values = {
+        column: _get_path(document, path)
+        for path, column in INSPECTION_COLUMNS.items()
+        if path in paths
+    }
+    label_values = {
+        column: _get_path(document, path)
+        for path, column in LABEL_COLUMNS.items()
+        if path in paths
+    }
+
+    assignments = SQL(", ").join(
+        [SQL("updated_at = now()")]
+        + ([_assignments(inspection_values)] if inspection_values else [])
+    )
+    query = SQL(
+        """
+        UPDATE inspection SET {}
+        WHERE id = %s AND inspector_id = %s
+        RETURNING label_info_id
+        """
+    ).format(assignments)
+    cursor.execute(query, (*inspection_values.values(), id, user_id))
+    if (row := cursor.fetchone()) is None:
+        raise InspectionNotFoundError(f"Inspection {id} not found")
+
+    if label_values:
+        query = SQL("UPDATE label_information SET {} WHERE id = %s").format(
+            _assignments(label_values)
+        )
+        cursor.execute(query, (*label_values.values(), row[0]))
+
+
+@labelled("patch_inspection")
+async def patch_inspection(
+    cp: ConnectionPool,
+    user: User,
+    id: str | UUID,
+    patch: dict,
+    cache: TTLCache | None = None,
+    snapshots: bool = False,
+):
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required for updating inspections.")
+    if not id:
+        raise ValueError("Inspection ID is required for updating inspection details.")
+    if not patch:
+        raise ValueError("A merge patch is required for updating inspection.")
+    if unknown := set(patch) - set(InspectionUpdate.model_fields):
+        raise ValueError(f"Unknown inspection fields: {', '.join(sorted(unknown))}")
+
+    if not isinstance(id, UUID):
+        id = UUID(id)
+
+    key = (user.id, id)
+    paths = list(merge_patch_paths(patch))
+    in_place = all(p in INSPECTION_COLUMNS or p in LABEL_COLUMNS for p in paths)
+
+    with cp.connection() as conn, conn.cursor() as cursor:
+        # Column updates don't depend on the rest of the document, so a cached
+        # copy is good enough to build the response from.
+        cached = cache.get(key) if cache is not None and in_place else None
+        if cached is not None:
+            current = cached[1].model_dump(mode="json")
+        else:
+            try:
+                with operation("get_full_inspection_json"):
+                    raw = await get_full_inspection_json(cursor, id, user.id)
+                current = json.loads(raw)
+            except DBInspectionNotFoundError as e:
+                log_error(e)
+                raise InspectionNotFoundError(f"{e}") from e
+
+        document = apply_merge_patch(current, patch)
+        for name in patch:
+            field = InspectionUpdate.model_fields[name]
+            TypeAdapter(Annotated[field.annotation, field]).validate_python(
+                document.get(name)
+            )
+
+        if in_place:
+            update_inspection_columns(cursor, user.id, id, document, paths)
+            document = None
+        else:
+            inspection_data = InspectionUpdate.model_validate(document).model_dump(
+                mode="json"
+            )
+            try:
+                result = await db_update_inspection(
+                    cursor, id, user.id, inspection_data
+                )
+            except DBInspectionNotFoundError as e:
+                log_error(e)
+                raise InspectionNotFoundError(f"{e}") from e
+            document = result.model_dump()
+
+        refreshed = await refresh_snapshot(cursor, user.id, id) if snapshots else None
+        if document is None:
+            # The update also bumped updated_at, and `current` may be a cached
+            # copy: the response is the document as it now is.
+            if refreshed is None:
+                with operation("get_full_inspection_json"):
+                    refreshed = await get_full_inspection_json(cursor, id, user.id)
+            document = json.loads(refreshed)
+        if cache is not None:
+            cache.invalidate(key, cursor)
+        return InspectionResponse.model_validate(document)
+
+
+@labelled("delete_inspection")
 async def delete_inspection(
     cp: ConnectionPool,
     user: User,
     id: UUID | str,
-    connection_string: str,
+    storage: BlobStorage,
+    cache: TTLCache | None = None,
+    folder_cache: TTLCache | None = None,
 ):
     if not user.id:
         raise MissingUserAttributeError("User ID is required to delete an inspection.")
     if not id:
         raise ValueError("Inspection ID is required for deletion.")
-    if not connection_string:
-        raise ValueError("Connection string is required for blob storage access.")
+    if storage is None:
+        raise ValueError("Blob storage is required to delete an inspection.")
     if not isinstance(id, UUID):
         id = UUID(id)
 
-    container_client = ContainerClient.from_connection_string(
-        connection_string, container_name=build_container_name(str(user.id))
-    )
+    container_client = storage.container(user.id)
 
     with cp.connection() as conn, conn.cursor() as cursor:
-        deleted = await db_delete_inspection(cursor, id, user.id, container_client)
+        # Deleting an inspection deletes its picture set with it.
+        cursor.execute(
+            SQL("SELECT picture_set_id FROM inspection WHERE id = %s"), (id,)
+        )
+        row = cursor.fetchone()
+        deleted = await run_in_thread(
+            db_delete_inspection(cursor, id, user.id, container_client)
+        )
+        if cache is not None:
+            cache.invalidate((user.id, id), cursor)
+        if folder_cache is not None and row is not None and row[0] is not None:
+            folder_cache.invalidate((user.id, row[0]), cursor)
         return DeletedInspection.model_validate(deleted.model_dump())
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "upload_date",
+    "updated_at",
+    "verified",
+    "picture_set_id",
+    "label_info_id",
+    "product_name",
+    "lot_number",
+    "npk",
+    "inspection_comment",
+]
+
+
+def _csv_line(values: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def export_inspections(
+    cp: ConnectionPool,
+    user_id: UUID,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    verified: bool | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    after: UUID | None = None,
+    itersize: int = 1000,
+) -> Iterator[str]:
+    """
+    Streams a user's inspections as NDJSON or CSV lines, ordered by id.
+
+    Rows are read through a server-side cursor `itersize` at a time, so memory
+    use doesn't grow with the export. An interrupted export resumes by passing
+    the id of the last row received as `after`.
+
+    Args:
+        cp (ConnectionPool): The pool to check the export's connection out of.
+        user_id (UUID): The inspector whose inspections are exported.
+        format (str): "ndjson" or "csv".
+        verified (bool | None): Only export inspections with this status.
+        since (datetime | None): Only export inspections last changed then or
+            later.
+        until (datetime | None): Only export inspections last changed before.
+        after (UUID | None): Resume after the inspection with this id.
+        itersize (int): Number of rows fetched per round-trip.
+    """
+    conditions = [SQL("i.inspector_id = %s")]
+    params: list = [user_id]
+    if verified is not None:
+        conditions.append(SQL("i.verified = %s"))
+        params.append(verified)
+    if since is not None:
+        conditions.append(SQL("COALESCE(i.updated_at, i.upload_date) >= %s"))
+        params.append(since)
+    if until is not None:
+        conditions.append(SQL("COALESCE(i.updated_at, i.upload_date) < %s"))
+        params.append(until)
+    if after is not None:
+        conditions.append(SQL("i.id > %s"))
+        params.append(after)
+
+    query = SQL(
+        """
+        SELECT
+            i.id, i.upload_date, i.updated_at, i.verified, i.picture_set_id,
+            i.label_info_id, li.product_name, li.lot_number, li.npk,
+            i.inspection_comment
+        FROM inspection i
+        JOIN label_information li ON li.id = i.label_info_id
+        WHERE {}
+        ORDER BY i.id
+        """
+    ).format(SQL(" AND ").join(conditions))
+
+    with cp.connection() as conn:
+        with conn.cursor(name="export_inspections", row_factory=dict_row) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            if format == "csv":
+                yield _csv_line(EXPORT_COLUMNS)
+            for row in cursor:
+                if format == "csv":
+                    values = [to_jsonable_python(row[c]) for c in EXPORT_COLUMNS]
+                    yield _csv_line(values)
+                else:
+                    yield to_json(row).decode() + "\n"
+
+
+def _import_record(cursor: Cursor, user_id: UUID, record: InspectionCreate):
+    formatted_analysis = build_inspection_import(
+        record.model_dump(mode="json"), user_id, record.picture_set_id
+    )
+    new_inspection_with_label_info(cursor, user_id, formatted_analysis)
+
+
+def import_inspections(
+    cp: ConnectionPool,
+    user: User,
+    lines: Iterable[str],
+    chunk_size: int = 500,
+) -> Iterator[InspectionImportProgress]:
+    """
+    Imports inspections from JSON lines of `InspectionCreate` records.
+
+    Records are validated and inserted `chunk_size` at a time on a single
+    connection, each chunk in its own transaction. A chunk that fails is rolled
+    back and replayed with a savepoint per record, so only the records at fault
+    are rejected.
+
+    Inspection snapshots are not written: the snapshot backfill has to run
+    after the import, as `python -m app.imports` does.
+
+    Yields:
+        InspectionImportProgress: Running totals after each chunk, with the
+            errors of that chunk by line number.
+    """
+    if not user.id:
+        raise MissingUserAttributeError("User ID is required for creating inspections.")
+
+    progress = InspectionImportProgress()
+    numbered = enumerate(lines, start=1)
+    with cp.connection() as conn, conn.cursor() as cursor:
+        while chunk := list(islice(numbered, chunk_size)):
+            records: list[tuple[int, InspectionCreate]] = []
+            errors: list[InspectionImportError] = []
+            for number, line in chunk:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(
+                        (number, InspectionCreate.model_validate_json(line))
+                    )
+                except ValueError as e:
+                    errors.append(InspectionImportError(line=number, error=str(e)))
+
+            try:
+                with conn.transaction():
+                    for _, record in records:
+                        _import_record(cursor, user.id, record)
+                imported = len(records)
+            except Exception:
+                imported = 0
+                with conn.transaction():
+                    for number, record in records:
+                        try:
+                            with conn.transaction():
+                                _import_record(cursor, user.id, record)
+                            imported += 1
+                        except Exception as e:
+                            errors.append(
+                                InspectionImportError(line=number, error=str(e))
+                            )
+
+            progress = progress.model_copy(
+                update={
+                    "processed": progress.processed + len(chunk),
+                    "imported": progress.imported + imported,
+                    "failed": progress.failed + len(errors),
+                    "errors": sorted(errors, key=lambda e: e.line),
+                }
+            )
+            yield progress
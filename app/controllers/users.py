@@ -1,55 +1,142 @@
-from datastore import UserAlreadyExistsError as DBUserAlreadyExistsError
-from datastore import get_user, new_user
+import asyncio
+from uuid import UUID
+
+from datastore import get_user
+from datastore.blob.azure_storage_api import create_folder as create_storage_folder
+from datastore.db.metadata.picture_set import build_picture_set_metadata
+from datastore.db.queries.picture import new_picture_set
 from datastore.db.queries.user import UserNotFoundError as DBUserNotFoundError
+from datastore.db.queries.user import register_user, set_default_picture_set
 from fastapi.logger import logger
+from psycopg.errors import UniqueViolation
 from psycopg_pool import ConnectionPool
 
+from app.cache import TTLCache
+from app.controllers.files import ensure_container
 from app.exceptions import (
     MissingUserAttributeError,
     UserConflictError,
     UserNotFoundError,
     log_error,
 )
+from app.instrumentation import labelled
 from app.models.users import User
+from app.storage import BlobStorage, run_in_thread
+
+# Name of the folder every user starts with.
+DEFAULT_FOLDER_NAME = "General"
 
 
-async def sign_up(cp: ConnectionPool, user: User, connection_string: str) -> User:
+@labelled("sign_up")
+async def sign_up(
+    cp: ConnectionPool, user: User, cache: TTLCache | None = None
+) -> tuple[User, UUID]:
     """
-    Registers a new user in the system.
+    Registers a new user in the system, with their default folder.
+
+    The user's storage container, and the folder in it, are not created here:
+    see `provision_storage`.
 
     Args:
         cp (ConnectionPool): The connection pool to manage database connections.
         user (User): The User instance containing the user's details.
-        connection_string (str): The database connection string for setup.
+        cache (TTLCache | None): Username cache whose entry for the new user,
+            possibly a cached miss, is invalidated once the user is created.
 
     Raises:
         MissingUserAttributeError: Raised if the username is not provided.
         UserConflictError: Raised if a user with the same username already exists.
 
     Returns:
-        User: The newly created User object with the assigned database ID.
+        tuple[User, UUID]: The newly created User object with the assigned
+            database ID, and the ID of their default folder.
     """
     if not user.username:
         raise MissingUserAttributeError("Username is required for sign-up.")
 
+    # The unique username is the check: a separate lookup first would race
+    # with concurrent sign-ups.
     try:
         with cp.connection() as conn, conn.cursor() as cursor:
             logger.debug(f"Creating user: {user.username}")
-            user_db = await new_user(cursor, user.username, connection_string)
-    except DBUserAlreadyExistsError as e:
+            user_id = register_user(cursor, user.username)
+            folder_id = new_picture_set(
+                cursor=cursor,
+                picture_set_metadata=build_picture_set_metadata(user_id, 0),
+                user_id=user_id,
+                folder_name=DEFAULT_FOLDER_NAME,
+            )
+            set_default_picture_set(cursor, user_id, folder_id)
+            if cache is not None:
+                cache.invalidate(user.username, cursor)
+    except Exception as e:
+        if not is_unique_violation(e):
+            raise
         log_error(e)
         raise UserConflictError(f"User '{user.username}' already exists.") from e
 
-    return user.model_copy(update={"id": user_db.id})
+    return user.model_copy(update={"id": user_id}), UUID(str(folder_id))
 
 
-async def sign_in(cp: ConnectionPool, user: User) -> User:
+def is_unique_violation(error: BaseException | None) -> bool:
+    """Whether `error` is, or was raised while handling, a unique violation."""
+    while error is not None:
+        if isinstance(error, UniqueViolation):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+async def provision_storage(
+    storage: BlobStorage,
+    user_id: UUID,
+    folder_id: UUID,
+    attempts: int = 5,
+    delay: float = 1.0,
+):
+    """
+    Creates a new user's storage container and their default folder in it,
+    retrying with exponential backoff. Meant to run in the background after
+    sign-up. Uploads also create the container if it is still missing, so
+    giving up is not fatal.
+
+    Args:
+        storage (BlobStorage): The storage account.
+        user_id (UUID): The id of the user.
+        folder_id (UUID): The id of the user's default folder.
+        attempts (int): Maximum number of attempts.
+        delay (float): Seconds to wait after the first failed attempt, doubled
+            after each following one.
+    """
+    container_client = storage.async_container(user_id)
+    for attempt in range(attempts):
+        try:
+            await ensure_container(container_client)
+            if not await run_in_thread(
+                create_storage_folder(
+                    storage.container(user_id), str(folder_id), DEFAULT_FOLDER_NAME
+                )
+            ):
+                raise RuntimeError(f"Default folder {folder_id} not created")
+            return
+        except Exception as e:
+            log_error(e)
+            if attempt + 1 < attempts:
+                await asyncio.sleep(delay * 2**attempt)
+
+
+@labelled("sign_in")
+async def sign_in(
+    cp: ConnectionPool, user: User, cache: TTLCache | None = None
+) -> User:
     """
     Authenticates an existing user in the system.
 
     Args:
         cp (ConnectionPool): The connection pool to manage database connections.
         user (User): The User instance containing the user's details.
+        cache (TTLCache | None): Cache of user ids by username. Unknown
+            usernames are cached as well, as False.
 
     Raises:
         MissingUserAttributeError: Raised if the username is not provided.
@@ -61,12 +148,23 @@ async def sign_in(cp: ConnectionPool, user: User) -> User:
     if not user.username:
         raise MissingUserAttributeError("Username is required for sign-in.")
 
+    if cache is not None:
+        cached = cache.get(user.username)
+        if cached is False:
+            raise UserNotFoundError(f"User '{user.username}' not found.")
+        if cached is not None:
+            return user.model_copy(update={"id": cached})
+
     try:
         with cp.connection() as conn, conn.cursor() as cursor:
             logger.debug(f"Fetching user ID for username: {user.username}")
             user_db = await get_user(cursor, user.username)
     except DBUserNotFoundError as e:
         log_error(e)
+        if cache is not None:
+            cache.set(user.username, False)
         raise UserNotFoundError(f"User '{user.username}' not found.") from e
 
+    if cache is not None:
+        cache.set(user.username, user_db.id)
     return user.model_copy(update={"id": user_db.id})
@@ -0,0 +1,261 @@
+import heapq
+import itertools
+import logging
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+
+from fastapi.logger import logger
+from psycopg import Connection, Cursor, Pipeline, pq
+from psycopg.sql import SQL, Composable
+from psycopg_pool import ConnectionPool
+
+from app.deadlines import Deadline
+from app.exceptions import DeadlineExceededError
+from app.instrumentation import current_operation, query_metrics
+from app.models.monitoring import PreparedStatementStats
+
+# Frontend messages after which the client waits on the server.
+ROUND_TRIP_MESSAGES = {"Sync", "Query", "Flush"}
+
+
+@dataclass
+class RoundTrips:
+    count: int = 0
+
+
+@contextmanager
+def count_round_trips(conn: Connection):
+    """
+    Counts the round-trips made on `conn` inside the block by tracing the
+    frontend/backend protocol with libpq.
+
+    Yields:
+        RoundTrips: Filled in with the count when the block exits.
+    """
+    round_trips = RoundTrips()
+    with tempfile.TemporaryFile("w+") as trace:
+        conn.pgconn.trace(trace.fileno())
+        conn.pgconn.set_trace_flags(pq.Trace.SUPPRESS_TIMESTAMPS)
+        try:
+            yield round_trips
+        finally:
+            conn.pgconn.untrace()
+            trace.seek(0)
+            for line in trace:
+                fields = line.split("\t")
+                if fields[0] == "F" and fields[2].strip() in ROUND_TRIP_MESSAGES:
+                    round_trips.count += 1
+
+
+@contextmanager
+def batched_writes(conn: Connection, operation: str):
+    """
+    Runs the block in libpq pipeline mode, so dependent INSERT/UPDATE
+    statements whose results are not read right away share a round-trip.
+
+    With debug logging enabled, the number of round-trips the block took is
+    logged under `operation`.
+    """
+    pipeline = batched_statements(conn)
+    tracing = logger.isEnabledFor(logging.DEBUG)
+    with count_round_trips(conn) if tracing else nullcontext() as round_trips:
+        with pipeline:
+            yield
+    if round_trips is not None:
+        logger.debug(f"{operation}: {round_trips.count} round-trips")
+
+
+def batched_statements(conn: Connection):
+    """Pipeline mode when libpq supports it, so statements share a round-trip."""
+    return conn.pipeline() if Pipeline.is_supported() else nullcontext()
+
+
+class DeadlineWatchdog:
+    """
+    Cancels the running statement of request connections whose deadline
+    expired, from a single daemon thread shared by all of them. Controllers
+    run statements on the event loop, so expiry has to be watched from a
+    thread that a blocking statement can't hold up.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._leases: list[tuple[float, int, "RequestConnection"]] = []
+        self._order = itertools.count()
+        self._thread: threading.Thread | None = None
+
+    def watch(self, lease: "RequestConnection", expires_at: float):
+        """Cancels `lease` at `expires_at`, on the `time.monotonic` clock."""
+        with self._condition:
+            heapq.heappush(self._leases, (expires_at, next(self._order), lease))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="deadline-watchdog", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                while not self._leases or self._leases[0][0] > now:
+                    timeout = self._leases[0][0] - now if self._leases else None
+                    self._condition.wait(timeout)
+                    now = time.monotonic()
+                _, _, lease = heapq.heappop(self._leases)
+            # A lease released since is no longer checked out: nothing to cancel.
+            lease.cancel()
+
+
+deadline_watchdog = DeadlineWatchdog()
+
+
+class RequestConnection:
+    """
+    Lends a single pooled connection to everything that handles a request.
+
+    It stands in for the pool in `with cp.connection() as conn` blocks: the
+    connection is checked out on first use and handed back to every later
+    block, so all of the request's statements run in one transaction that
+    `release` commits, or rolls back when given the exception that ended the
+    request.
+
+    With a deadline, waiting for the pool is bounded by the time the request
+    has left, and so are the statements of the transaction that follows, by a
+    transaction-local `statement_timeout` set once at checkout. Transactions
+    after a commit rely on the statement in progress being cancelled when the
+    deadline is cancelled or expires: see `DeadlineWatchdog`.
+
+    Args:
+        pool (ConnectionPool): The pool to check the connection out of.
+        deadline (Deadline | None): The deadline of the request.
+    """
+
+    def __init__(self, pool: ConnectionPool, deadline: Deadline | None = None):
+        self.pool = pool
+        self.deadline = deadline
+        self._checkout = None
+        self._conn: Connection | None = None
+
+    @property
+    def checked_out(self) -> bool:
+        return self._conn is not None
+
+    @contextmanager
+    def connection(self):
+        if self._conn is None:
+            self._checkout_connection()
+        yield self._conn
+
+    def _checkout_connection(self):
+        kwargs = {}
+        if self.deadline is not None:
+            if self.deadline.expired:
+                raise DeadlineExceededError("Request deadline exceeded")
+            kwargs["timeout"] = self.deadline.remaining()
+        start = time.perf_counter()
+        self._checkout = self.pool.connection(**kwargs)
+        self._conn = self._checkout.__enter__()
+        query_metrics.observe_pool_wait(
+            current_operation.get(), time.perf_counter() - start
+        )
+        if self.deadline is None:
+            return
+        # The equivalent of SET LOCAL, which takes no parameters. It opens the
+        # transaction, and its BEGIN goes in the same round-trip.
+        with batched_statements(self._conn):
+            self._conn.execute(
+                SQL("SELECT set_config('statement_timeout', %s, true)"),
+                (self.deadline.statement_timeout(),),
+            )
+        self.deadline.on_cancel(self.cancel)
+        deadline_watchdog.watch(self, self.deadline.expires_at)
+
+    def cancel(self):
+        """Asks the server to cancel the statement running on the connection."""
+        if (conn := self._conn) is not None:
+            conn.cancel_safe()
+
+    def release(self, error: BaseException | None = None):
+        if self._checkout is None:
+            return
+        checkout, self._checkout, self._conn = self._checkout, None, None
+        if error is None:
+            checkout.__exit__(None, None, None)
+        else:
+            checkout.__exit__(type(error), error, error.__traceback__)
+
+
+@contextmanager
+def lend_connection(pool: ConnectionPool, deadline: Deadline | None = None):
+    """Yields a `RequestConnection` on `pool` and releases it on exit."""
+    lease = RequestConnection(pool, deadline)
+    try:
+        yield lease
+    except BaseException as e:
+        lease.release(e)
+        raise
+    lease.release()
+
+
+class PreparedStatements:
+    """
+    Executes hot statements as server-side prepared statements and counts how
+    often each one reuses a plan its session already prepared.
+
+    psycopg prepares a statement on a connection the first time it runs with
+    `prepare=True`, and prepares it again once it was dropped: by a rollback,
+    or evicted past the connection's `prepared_max`. Nothing is prepared when
+    the connection's `prepare_threshold` is None.
+
+    psycopg doesn't expose whether an execution prepared the statement: that
+    is read from its prepared statement manager, a private attribute of the
+    version pinned in requirements.txt. Without it, executions are still
+    counted and the statements still prepared, but prepares and reuses are
+    not.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executions: dict[str, int] = defaultdict(int)
+        self._prepares: dict[str, int] = defaultdict(int)
+        self._reuses: dict[str, int] = defaultdict(int)
+
+    def execute(
+        self, cursor: Cursor, name: str, query: Composable | str, params=None
+    ) -> Cursor:
+        # psycopg numbers the statements it prepares on a connection, so a new
+        # number means this execution parsed and planned the statement again.
+        manager = getattr(cursor.connection, "_prepared", None)
+        prepared_idx = getattr(manager, "_prepared_idx", None)
+        cursor.execute(query, params, prepare=True)
+        with self._lock:
+            self._executions[name] += 1
+            if not isinstance(prepared_idx, int):
+                return cursor
+            if manager._prepared_idx != prepared_idx:
+                self._prepares[name] += 1
+            elif cursor.connection.prepare_threshold is not None:
+                self._reuses[name] += 1
+        return cursor
+
+    def stats(self) -> list[PreparedStatementStats]:
+        with self._lock:
+            return [
+                PreparedStatementStats(
+                    name=name,
+                    executions=executions,
+                    prepares=self._prepares[name],
+                    reuses=self._reuses[name],
+                    reuse_ratio=self._reuses[name] / executions,
+                )
+                for name, executions in self._executions.items()
+            ]
+
+
+prepared_statements = PreparedStatements()
@@ -0,0 +1,120 @@
+import asyncio
+import math
+import time
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from app.exceptions import DeadlineExceededError
+
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+class Deadline:
+    """
+    The point in time after which nobody is waiting for a request's result.
+
+    Work bound to the deadline is abandoned once it expires, or as soon as
+    `cancel` is called, e.g. because the client went away.
+
+    Args:
+        timeout (float): Seconds from now until the deadline expires.
+    """
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+        self.cancelled = asyncio.Event()
+        self._callbacks: list[Callable[[], None]] = []
+
+    def remaining(self) -> float:
+        if self.cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def on_cancel(self, callback: Callable[[], None]):
+        self._callbacks.append(callback)
+
+    def cancel(self):
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        for callback in self._callbacks:
+            callback()
+
+    def statement_timeout(self) -> str:
+        """The remaining time as a Postgres `statement_timeout` value."""
+        # 0 would disable the timeout altogether.
+        return f"{max(1, math.ceil(self.remaining() * 1000))}ms"
+
+
+current_deadline: ContextVar[Deadline | None] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+def blob_timeouts() -> dict[str, float]:
+    """
+    Transport timeouts for Azure storage requests made while handling a
+    request, bounded by the request's deadline.
+    """
+    if (deadline := current_deadline.get()) is None:
+        return {}
+    remaining = max(1.0, deadline.remaining())
+    return {"connection_timeout": remaining, "read_timeout": remaining}
+
+
+async def run_until(deadline: Deadline, func: Callable, *args):
+    """
+    Runs a blocking `func` in the threadpool and stops waiting for it once the
+    deadline expires or is cancelled.
+
+    The thread itself can't be interrupted and finishes in the background.
+
+    Raises:
+        DeadlineExceededError: If the deadline passed before `func` returned.
+    """
+    work = asyncio.ensure_future(run_in_threadpool(func, *args))
+    cancelled = asyncio.ensure_future(deadline.cancelled.wait())
+    try:
+        await asyncio.wait(
+            {work, cancelled},
+            timeout=deadline.remaining(),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        cancelled.cancel()
+    if not work.done():
+        work.cancel()
+        raise DeadlineExceededError("Request deadline exceeded")
+    return work.result()
+
+
+@asynccontextmanager
+async def cancel_on_disconnect(
+    request: Request, deadline: Deadline, interval: float = 0.5
+):
+    """
+    Cancels `deadline` if the client disconnects while the block runs.
+
+    The watcher runs on the event loop, so a disconnect is noticed between
+    statements; a statement already blocking the loop is cut short by the
+    deadline watchdog instead.
+    """
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+        deadline.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
@@ -1,15 +1,28 @@
 from http import HTTPStatus
+from typing import Annotated
 
-from fastapi import Depends, File, HTTPException, Request, UploadFile
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi import Depends, File, Header, HTTPException, Request, UploadFile
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBasic,
+    HTTPBasicCredentials,
+    HTTPBearer,
+)
 from psycopg_pool import ConnectionPool
 
+from app.cache import TTLCache
 from app.config import Settings
 from app.controllers.users import sign_in
-from app.exceptions import UserNotFoundError
+from app.db import RequestConnection, lend_connection
+from app.deadlines import Deadline, cancel_on_disconnect, current_deadline
+from app.exceptions import InvalidTokenError, UserNotFoundError
 from app.models.users import User
+from app.ratelimit import retry_after
+from app.storage import BlobStorage
+from app.tokens import TokenSigner
 
-auth = HTTPBasic()
+auth = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
 
 
 def get_settings(request: Request) -> Settings:
@@ -22,7 +35,72 @@ def get_pipeline_settings(request: Request) -> Settings:
 def get_connection_pool(request: Request) -> ConnectionPool:
     return request.app.pool
 
-def authenticate_user(credentials: HTTPBasicCredentials = Depends(auth)):
+
+async def get_deadline(
+    request: Request,
+    x_request_timeout: Annotated[float | None, Header(gt=0)] = None,
+):
+    """
+    Sets the request's deadline from the X-Request-Timeout header, in seconds,
+    or the route's default timeout, capped by `max_request_timeout`.
+
+    The deadline is cancelled if the client disconnects before the response.
+    """
+    settings: Settings = request.app.settings
+    route = request.scope.get("route")
+    timeout = x_request_timeout or settings.route_timeouts.get(
+        getattr(route, "name", None), settings.request_timeout
+    )
+    deadline = Deadline(min(timeout, settings.max_request_timeout))
+    current_deadline.set(deadline)
+    async with cancel_on_disconnect(request, deadline):
+        yield deadline
+
+
+def get_read_pool(request: Request) -> ConnectionPool:
+    """The replica pool when one is configured, for long read-only work."""
+    return request.app.replica_pool or request.app.pool
+
+
+def get_connection(
+    cp: ConnectionPool = Depends(get_connection_pool),
+    deadline: Deadline = Depends(get_deadline),
+):
+    """Lends one primary connection, and transaction, to the whole request."""
+    with lend_connection(cp, deadline) as conn:
+        yield conn
+
+
+def get_inspection_cache(request: Request) -> TTLCache:
+    return request.app.caches["inspections"]
+
+
+def get_folder_cache(request: Request) -> TTLCache:
+    return request.app.caches["folders"]
+
+
+def get_user_cache(request: Request) -> TTLCache:
+    return request.app.caches["users"]
+
+
+def get_blob_storage(request: Request) -> BlobStorage:
+    return request.app.storage
+
+
+def get_token_signer(request: Request) -> TokenSigner | None:
+    return request.app.tokens
+
+
+def use_inspection_snapshots(request: Request) -> bool:
+    return request.app.settings.inspection_snapshots
+
+def authenticate_user(credentials: HTTPBasicCredentials | None = Depends(auth)):
+    if credentials is None:
+        raise HTTPException(
+            status_code=HTTPStatus.UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Basic"},
+        )
     if not credentials.username:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="Missing email address!"
@@ -31,18 +109,103 @@ def authenticate_user(credentials: HTTPBasicCredentials = Depends(auth)):
     return User(username=credentials.username)
 
 
-async def fetch_user(
-    auth_user: User = Depends(authenticate_user),
-    cp: ConnectionPool = Depends(get_connection_pool),
+async def fetch_basic_user(
+    credentials: HTTPBasicCredentials | None = Depends(auth),
+    cp: RequestConnection = Depends(get_connection),
+    cache: TTLCache = Depends(get_user_cache),
 ) -> User:
+    """
+    Resolves the user from Basic credentials only. Tokens are issued from
+    these, so that an unexpired token can't be traded for a fresh one.
+    """
     try:
-        return await sign_in(cp, auth_user)
+        return await sign_in(cp, authenticate_user(credentials), cache)
     except UserNotFoundError:
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED, detail="Invalid username or password"
         )
 
 
+async def fetch_user(
+    token: HTTPAuthorizationCredentials | None = Depends(bearer),
+    credentials: HTTPBasicCredentials | None = Depends(auth),
+    signer: TokenSigner | None = Depends(get_token_signer),
+    cp: RequestConnection = Depends(get_connection),
+    cache: TTLCache = Depends(get_user_cache),
+) -> User:
+    """
+    Resolves the user from a bearer token issued at /login, which only needs
+    its signature checked, or else from Basic credentials.
+    """
+    if token is not None and signer is not None:
+        try:
+            return signer.verify(token.credentials)
+        except InvalidTokenError:
+            raise HTTPException(
+                status_code=HTTPStatus.UNAUTHORIZED,
+                detail="Invalid or expired token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    return await fetch_basic_user(credentials, cp, cache)
+
+
+def release_connection(
+    user: User = Depends(fetch_user),
+    cp: RequestConnection = Depends(get_connection),
+):
+    """
+    Hands back the connection the user lookup checked out, on routes that
+    don't use the database afterwards, rather than leave it idle in
+    transaction through work like the analysis pipeline.
+    """
+    cp.release()
+
+
+def rate_limit(route_class: str):
+    """
+    Builds a dependency that takes a token from the user's budget for
+    `route_class`, and rejects the request with a 429 when it is spent.
+    """
+
+    def dependency(request: Request, user: User = Depends(fetch_user)):
+        wait = request.app.rate_limiter.acquire(user.id, route_class)
+        if wait > 0:
+            raise HTTPException(
+                status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": retry_after(wait)},
+            )
+
+    return dependency
+
+
+def get_read_connection(
+    request: Request,
+    cp: RequestConnection = Depends(get_connection),
+    user: User = Depends(fetch_user),
+    deadline: Deadline = Depends(get_deadline),
+):
+    """
+    Routes safe reads to the replica pool when one is configured, except for
+    users who wrote recently and must read their own writes from the primary.
+    """
+    replica_pool = request.app.replica_pool
+    if replica_pool is None or request.app.recent_writers.get(user.id):
+        yield cp
+        return
+    with lend_connection(replica_pool, deadline) as conn:
+        yield conn
+
+
+def get_write_connection(
+    request: Request,
+    cp: RequestConnection = Depends(get_connection),
+    user: User = Depends(fetch_user),
+) -> RequestConnection:
+    request.app.recent_writers.set(user.id, True)
+    return cp
+
+
 def validate_files(files: list[UploadFile] = File(..., min_length=1)):
     for f in files:
         if f.size == 0:
@@ -0,0 +1,28 @@
+import hashlib
+
+# Responses are user-specific and mutable: let clients keep them, but make them
+# revalidate with If-None-Match before every reuse.
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+# Stored files never change under a given id: clients can keep them for a year
+# without revalidating.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def make_etag(*parts: object) -> str:
+    """Builds a strong entity tag from the given version components."""
+    digest = hashlib.sha256(":".join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Evaluates an If-None-Match header against `etag` using the weak comparison
+    required by RFC 9110.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (c.strip().removeprefix("W/") for c in if_none_match.split(","))
+    return etag.removeprefix("W/") in candidates
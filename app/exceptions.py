@@ -19,6 +19,10 @@ class MissingUserAttributeError(UserError):
     pass
 
 
+class InvalidTokenError(UserError):
+    pass
+
+
 class InspectionError(Exception):
     pass
 
@@ -35,6 +39,21 @@ class FileNotFoundError(FileError):
     pass
 
 
+class FileNotModifiedError(FileError):
+    def __init__(self, message: str = "", etag: str | None = None):
+        super().__init__(message)
+        # The ETag the client's copy matched, if known.
+        self.etag = etag
+
+
+class RangeNotSatisfiableError(FileError):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
 def log_error(error: Exception):
     """Logs the error message and traceback."""
     logger.error(f"Error occurred: {error}")
@@ -0,0 +1,10 @@
+"""
+Bulk import of inspections from a file of JSON lines, one `InspectionCreate`
+record per line, on behalf of an existing user:
+
+    python -m app.imports labels.ndjson --username inspector@example.com
+
+Progress is printed as one JSON object per chunk on stdout. With inspection
+snapshots enabled, the imported inspections are snapshotted afterwards by the
+snapshot backfill.
+"""
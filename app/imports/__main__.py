@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+import sys
+
+from app.config import Settings, create_pool
+from app.controllers.inspections import import_inspections
+from app.controllers.users import sign_in
+from app.models.users import User
+from app.snapshots import backfill
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.imports")
+    parser.add_argument("path", help="file of JSON lines, or - for stdin")
+    parser.add_argument("--username", required=True, help="owner of the imports")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    settings = Settings()
+    failed = 0
+    with create_pool(settings, open=True) as cp:
+        user = asyncio.run(sign_in(cp, User(username=args.username)))
+        source = sys.stdin if args.path == "-" else open(args.path)
+        with source:
+            for progress in import_inspections(cp, user, source, args.chunk_size):
+                print(progress.model_dump_json(), flush=True)
+                failed = progress.failed
+        if settings.inspection_snapshots:
+            with cp.connection() as conn:
+                written = asyncio.run(backfill(conn))
+            print(f"{written} snapshots written", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
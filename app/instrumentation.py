@@ -0,0 +1,163 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.logger import logger
+from psycopg import Cursor
+
+from app.models.monitoring import LatencyHistogram, QueryStats
+
+# Upper bounds, in milliseconds, of the latency histogram buckets. Anything
+# slower lands in a last, unbounded bucket.
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+current_operation: ContextVar[str] = ContextVar("current_operation", default="other")
+
+
+@contextmanager
+def operation(name: str):
+    """Labels the statements executed inside the block with `name`."""
+    token = current_operation.set(name)
+    try:
+        yield
+    finally:
+        current_operation.reset(token)
+
+
+def labelled(name: str):
+    """Labels the statements executed by the decorated coroutine with `name`."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with operation(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Histogram:
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> LatencyHistogram:
+        return LatencyHistogram(
+            buckets_ms=list(self.bounds),
+            counts=list(self.counts),
+            count=self.count,
+            total_ms=self.total,
+        )
+
+
+class QueryMetrics:
+    """
+    Collects statement latencies, row counts and waits for a pooled
+    connection per operation. The operation that checks a request's
+    connection out is charged with its wait.
+
+    Args:
+        slow_query_threshold (float | None): Seconds above which a statement is
+            logged, without its parameters. None disables the log.
+    """
+
+    def __init__(self, slow_query_threshold: float | None = None):
+        self.slow_query_threshold = slow_query_threshold
+        self._lock = threading.Lock()
+        self._latency: dict[str, Histogram] = defaultdict(Histogram)
+        self._rows: dict[str, int] = defaultdict(int)
+        self._pool_waits: dict[str, Histogram] = defaultdict(Histogram)
+        self._pool_wait = Histogram()
+
+    def observe_query(self, operation: str, seconds: float, rows: int):
+        with self._lock:
+            self._latency[operation].observe(seconds * 1000)
+            self._rows[operation] += max(rows, 0)
+
+    def observe_pool_wait(self, operation: str, seconds: float):
+        with self._lock:
+            self._pool_waits[operation].observe(seconds * 1000)
+            self._pool_wait.observe(seconds * 1000)
+
+    def is_slow(self, seconds: float) -> bool:
+        threshold = self.slow_query_threshold
+        return threshold is not None and seconds >= threshold
+
+    def stats(self) -> list[QueryStats]:
+        with self._lock:
+            operations = {**self._latency, **self._pool_waits}
+            return [
+                QueryStats(
+                    operation=operation,
+                    latency=self._latency.get(operation, Histogram()).snapshot(),
+                    rows=self._rows.get(operation, 0),
+                    pool_wait=(
+                        self._pool_waits[operation].snapshot()
+                        if operation in self._pool_waits
+                        else None
+                    ),
+                )
+                for operation in operations
+            ]
+
+    def pool_wait(self) -> LatencyHistogram:
+        """The waits for a pooled connection of every operation."""
+        with self._lock:
+            return self._pool_wait.snapshot()
+
+
+query_metrics = QueryMetrics()
+
+
+class InstrumentedCursor(Cursor):
+    """
+    Cursor that records every statement in `query_metrics` under the current
+    operation, and logs the slow ones with their parameters redacted.
+
+    In pipeline mode the latency only covers queueing the statement.
+    """
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            self._observe(query, len(params) if params else 0, start)
+
+    def executemany(self, query, params_seq, **kwargs):
+        params_seq = list(params_seq)
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            self._observe(query, sum(len(p) for p in params_seq), start)
+
+    def _observe(self, query, redacted: int, start: float):
+        elapsed = time.perf_counter() - start
+        name = current_operation.get()
+        query_metrics.observe_query(name, elapsed, self.rowcount)
+        if query_metrics.is_slow(elapsed):
+            self._log_slow_query(name, query, redacted, elapsed)
+
+    def _log_slow_query(self, name, query, redacted: int, elapsed: float):
+        if isinstance(query, bytes):
+            text = query.decode()
+        else:
+            text = query if isinstance(query, str) else query.as_string(self)
+        logger.warning(
+            f"Slow query in {name}: {elapsed * 1000:.0f} ms, {self.rowcount} rows, "
+            f"{redacted} parameters redacted: {' '.join(text.split())}"
+        )
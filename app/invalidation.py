@@ -0,0 +1,106 @@
+import json
+import threading
+from collections.abc import Callable, Hashable
+from uuid import UUID
+
+import psycopg
+from psycopg import Cursor
+from psycopg.sql import SQL, Identifier
+
+from app.cache import TTLCache
+from app.exceptions import log_error
+
+
+def _encode_key(key: Hashable) -> list[str]:
+    parts = key if isinstance(key, tuple) else (key,)
+    return [str(part) for part in parts]
+
+
+def _decode_key(parts: list[str]) -> Hashable:
+    decoded = []
+    for part in parts:
+        try:
+            decoded.append(UUID(part))
+        except ValueError:
+            decoded.append(part)
+    return tuple(decoded) if len(decoded) > 1 else decoded[0]
+
+
+class InvalidationBus:
+    """
+    Propagates cache invalidations to every replica through Postgres
+    LISTEN/NOTIFY.
+
+    Invalidations are published with `pg_notify` on the writer's cursor, so
+    they are only delivered once its transaction commits. Each replica listens
+    on a dedicated autocommit connection and evicts the matching keys from its
+    registered caches, including the replica that published them.
+
+    Args:
+        conninfo (str): Connection string of the database to listen on.
+        channel (str): Name of the notification channel.
+        reconnect_delay (float): Seconds to wait before reconnecting after the
+            listening connection is lost.
+    """
+
+    def __init__(self, conninfo: str, channel: str, reconnect_delay: float = 5.0):
+        self.conninfo = conninfo
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.caches: dict[str, TTLCache] = {}
+        self.subscribers: list[Callable[[str, Hashable], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def register(self, cache: TTLCache):
+        self.caches[cache.name] = cache
+        cache.bus = self
+
+    def subscribe(self, callback: Callable[[str, Hashable], None]):
+        """Calls `callback(cache_name, key)` for every invalidation received."""
+        self.subscribers.append(callback)
+
+    def publish(self, cursor: Cursor, cache_name: str, key: Hashable):
+        payload = json.dumps({"cache": cache_name, "key": _encode_key(key)})
+        cursor.execute(SQL("SELECT pg_notify(%s, %s)"), (self.channel, payload))
+
+    def apply(self, payload: str):
+        try:
+            message = json.loads(payload)
+            cache = self.caches.get(message["cache"])
+            key = _decode_key(message["key"])
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            log_error(e)
+            return
+        if cache is not None:
+            cache.invalidate(key)
+        for callback in self.subscribers:
+            callback(message["cache"], key)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._listen, name="cache-invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    conn.execute(SQL("LISTEN {}").format(Identifier(self.channel)))
+                    # Anything published while we were not listening is lost.
+                    for cache in self.caches.values():
+                        cache.clear()
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            self.apply(notify.payload)
+            except psycopg.Error as e:
+                log_error(e)
+                self._stop.wait(self.reconnect_delay)
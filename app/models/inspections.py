@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
 from fertiscan.db.metadata.inspection import DBInspection as DBInspectionMetadata
@@ -64,3 +65,35 @@ class InspectionResponse(Inspection):
 
 class DeletedInspection(DBInspectionMetadata):
     deleted: bool = True
+
+
+class InspectionBatchRequest(BaseModel):
+    ids: list[UUID] = Field(..., min_length=1)
+
+
+class InspectionBatchResponse(BaseModel):
+    inspections: list[InspectionResponse] = []
+    not_found: list[UUID] = []
+
+
+class InspectionBulkVerify(InspectionBatchRequest):
+    verified: bool = True
+
+
+class InspectionBulkResult(BaseModel):
+    id: UUID
+    status: Literal["updated", "deleted", "not_found", "failed"]
+    detail: str | None = None
+
+
+class InspectionImportError(BaseModel):
+    line: int
+    error: str
+
+
+class InspectionImportProgress(BaseModel):
+    processed: int = 0
+    imported: int = 0
+    failed: int = 0
+    # Errors of the last chunk only.
+    errors: list[InspectionImportError] = []
@@ -3,3 +3,42 @@ from pydantic import BaseModel
 
 class HealthStatus(BaseModel):
     status: str = "ok"
+
+
+class CacheStats(BaseModel):
+    name: str
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    hit_ratio: float
+
+
+class PreparedStatementStats(BaseModel):
+    name: str
+    executions: int
+    prepares: int
+    reuses: int
+    reuse_ratio: float
+
+
+class LatencyHistogram(BaseModel):
+    # Upper bounds of the buckets; counts has one more, unbounded, bucket.
+    buckets_ms: list[float]
+    counts: list[int]
+    count: int
+    total_ms: float
+
+
+class QueryStats(BaseModel):
+    operation: str
+    latency: LatencyHistogram
+    rows: int
+    pool_wait: LatencyHistogram | None = None
+
+
+class Metrics(BaseModel):
+    caches: list[CacheStats] = []
+    prepared_statements: list[PreparedStatementStats] = []
+    queries: list[QueryStats] = []
+    pool_wait: LatencyHistogram | None = None
@@ -1,6 +1,14 @@
+from datetime import datetime
+
 from pydantic import UUID4, BaseModel
 
 
 class User(BaseModel):
     id: UUID4 | None = None
     username: str | None = None
+
+
+class LoginResponse(User):
+    token: str | None = None
+    token_type: str = "bearer"
+    expires_at: datetime | None = None
@@ -0,0 +1,176 @@
+"""
+Per-user token buckets that keep one client from starving the others of
+analysis capacity and pool connections.
+
+Each route class has its own budget, given as `(capacity, rate)`: a bucket
+holds at most `capacity` tokens, refills at `rate` tokens per second, and every
+request takes one token. `TokenBucketLimiter` keeps the buckets in process, so
+each replica enforces its own budget; `PostgresRateLimiter` shares them between
+replicas through the database.
+
+The shared buckets live in `rate_limit_bucket`, created by a maintenance
+command run once before `rate_limit_backend` is set to "postgres", and not by
+every replica at startup:
+
+    python -m app.ratelimit create     # create the bucket table
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from psycopg import Connection
+from psycopg.sql import SQL
+from psycopg_pool import ConnectionPool
+
+from app.db import prepared_statements
+
+Limit = tuple[float, float]
+
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets, keyed by user and route class.
+
+    Args:
+        limits (dict[str, Limit]): Capacity and refill rate per route class.
+            Route classes without a limit are not limited.
+        maxsize (int): Maximum number of buckets kept; the least recently used
+            ones are dropped, which only ever refills them.
+    """
+
+    def __init__(self, limits: dict[str, Limit], maxsize: int = 10_000):
+        self.limits = limits
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id: Hashable, route_class: str) -> float:
+        """
+        Takes a token from the user's bucket for `route_class`.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the seconds to wait
+                before a token is available.
+        """
+        if (limit := self.limits.get(route_class)) is None:
+            return 0.0
+        capacity, rate = limit
+        key = (user_id, route_class)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / rate
+
+
+def ensure_rate_limit_table(conn: Connection):
+    conn.execute(
+        SQL(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_bucket (
+                key text PRIMARY KEY,
+                tokens double precision NOT NULL,
+                updated_at timestamptz NOT NULL
+            )
+            """
+        )
+    )
+
+
+def rate_limit_table_exists(conn: Connection) -> bool:
+    row = conn.execute(SQL("SELECT to_regclass('rate_limit_bucket')")).fetchone()
+    return row[0] is not None
+
+
+class PostgresRateLimiter:
+    """
+    Token buckets shared by every replica, stored in `rate_limit_bucket`.
+
+    A token is taken with a single UPSERT that refills the bucket and
+    decrements it only if a token is available. It runs in its own short
+    transaction, so a request that fails later keeps its token spent.
+
+    Args:
+        pool (ConnectionPool): Pool of connections to the primary.
+        limits (dict[str, Limit]): Capacity and refill rate per route class.
+    """
+
+    def __init__(self, pool: ConnectionPool, limits: dict[str, Limit]):
+        self.pool = pool
+        self.limits = limits
+
+    def acquire(self, user_id: Hashable, route_class: str) -> float:
+        """
+        Takes a token from the user's bucket for `route_class`.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the seconds to wait
+                before a token is available.
+        """
+        if (limit := self.limits.get(route_class)) is None:
+            return 0.0
+        capacity, rate = limit
+        params = {
+            "key": f"{user_id}:{route_class}",
+            "capacity": capacity,
+            "rate": rate,
+        }
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            prepared_statements.execute(
+                cursor,
+                "rate_limit_acquire",
+                SQL(
+                    """
+                    INSERT INTO rate_limit_bucket AS b (key, tokens, updated_at)
+                    VALUES (%(key)s, %(capacity)s - 1, clock_timestamp())
+                    ON CONFLICT (key) DO UPDATE SET
+                        tokens = LEAST(
+                            %(capacity)s,
+                            b.tokens + %(rate)s
+                                * EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)
+                        ) - 1,
+                        updated_at = clock_timestamp()
+                    WHERE LEAST(
+                        %(capacity)s,
+                        b.tokens + %(rate)s
+                            * EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)
+                    ) >= 1
+                    RETURNING tokens
+                    """
+                ),
+                params,
+            )
+            if cursor.fetchone() is not None:
+                return 0.0
+            cursor.execute(
+                SQL(
+                    """
+                    SELECT LEAST(
+                        %(capacity)s,
+                        tokens + %(rate)s
+                            * EXTRACT(EPOCH FROM clock_timestamp() - updated_at)
+                    )
+                    FROM rate_limit_bucket
+                    WHERE key = %(key)s
+                    """
+                ),
+                params,
+            )
+            row = cursor.fetchone()
+        tokens = float(row[0]) if row else 0.0
+        return max(1 - tokens, 0.0) / rate
+
+
+def retry_after(wait: float) -> str:
+    """Formats a wait as a Retry-After value, in whole seconds."""
+    return str(max(1, math.ceil(wait)))
@@ -0,0 +1,21 @@
+import argparse
+import sys
+
+from app.config import Settings, create_pool
+from app.ratelimit import ensure_rate_limit_table
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.ratelimit")
+    parser.add_argument("command", choices=["create"])
+    parser.parse_args(argv)
+
+    with create_pool(Settings(), open=True) as cp, cp.connection() as conn:
+        ensure_rate_limit_table(conn)
+        conn.commit()
+        print("rate_limit_bucket table ready")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,34 @@
+import re
+from collections.abc import AsyncIterator
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
 from http import HTTPStatus
-from typing import Annotated
+from typing import Annotated, Literal
 from uuid import UUID
 
-import filetype
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile
-from fastapi.responses import RedirectResponse
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Body,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import RedirectResponse, StreamingResponse
 from psycopg_pool import ConnectionPool
+from pydantic import ValidationError
 
+from app.cache import TTLCache
 from app.config import Settings
 from app.controllers.data_extraction import extract_data
 from app.controllers.files import (
+    DEFAULT_CONTENT_TYPE,
     create_folder,
     delete_folder,
+    guess_content_type,
     read_file,
     read_folder,
     read_folders,
@@ -19,36 +36,83 @@ from app.controllers.files import (
 from app.controllers.inspections import (
     create_inspection,
     delete_inspection,
+    delete_inspections,
+    export_inspections,
+    patch_inspection,
     read_all_inspections,
     read_inspection,
+    read_inspection_etag,
+    read_inspections,
     update_inspection,
+    verify_inspections,
 )
-from app.controllers.users import sign_up
+from app.controllers.users import provision_storage, sign_up
+from app.db import RequestConnection, prepared_statements
+from app.deadlines import Deadline, run_until
 from app.dependencies import (
     authenticate_user,
+    fetch_basic_user,
     fetch_user,
-    get_connection_pool,
+    get_blob_storage,
+    get_connection,
+    get_deadline,
+    get_folder_cache,
+    get_inspection_cache,
+    get_read_connection,
     get_settings,
+    get_token_signer,
     get_pipeline_settings,
+    get_read_pool,
+    get_user_cache,
+    get_write_connection,
+    rate_limit,
+    release_connection,
+    use_inspection_snapshots,
     validate_files,
 )
-from app.exceptions import FileNotFoundError, InspectionNotFoundError, UserConflictError
+from app.etags import (
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    etag_matches,
+    make_etag,
+)
+from app.exceptions import (
+    FileNotFoundError,
+    FileNotModifiedError,
+    InspectionNotFoundError,
+    RangeNotSatisfiableError,
+    UserConflictError,
+)
+from app.instrumentation import query_metrics
 from app.models.files import DeleteFolderResponse, FolderResponse
 from app.models.inspections import (
     DeletedInspection,
+    InspectionBatchRequest,
+    InspectionBatchResponse,
+    InspectionBulkResult,
+    InspectionBulkVerify,
     InspectionCreate,
     InspectionData,
     InspectionResponse,
     InspectionUpdate,
 )
 from app.models.label_data import LabelData
-from app.models.monitoring import HealthStatus
-from app.models.users import User
+from app.models.monitoring import HealthStatus, Metrics
+from app.models.users import LoginResponse, User
+from app.storage import BlobStorage
+from app.tokens import TokenSigner
 from pipeline import Settings as PipelineSettings
 
 router = APIRouter()
 
 
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=HTTPStatus.NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL},
+    )
+
+
 @router.get("/", tags=["Home"])
 async def home(request: Request):
     return RedirectResponse(url=request.app.docs_url)
@@ -59,161 +123,467 @@ async def health_check():
     return HealthStatus()
 
 
-@router.post("/analyze", response_model=LabelData, tags=["Pipeline"])
+@router.get("/metrics", tags=["Monitoring"], response_model=Metrics)
+async def metrics(request: Request):
+    return Metrics(
+        caches=[c.stats() for c in request.app.caches.values()],
+        prepared_statements=prepared_statements.stats(),
+        queries=query_metrics.stats(),
+        pool_wait=query_metrics.pool_wait(),
+    )
+
+
+@router.post(
+    "/analyze",
+    response_model=LabelData,
+    tags=["Pipeline"],
+    dependencies=[Depends(rate_limit("analyze")), Depends(release_connection)],
+)
 async def analyze_document(
     settings: Annotated[PipelineSettings, Depends(get_pipeline_settings)],
     files: Annotated[list[UploadFile], Depends(validate_files)],
+    deadline: Annotated[Deadline, Depends(get_deadline)],
 ):
     label_images = [await f.read() for f in files]
-    return extract_data(label_images, settings)
+    return await run_until(deadline, extract_data, label_images, settings)
 
 
 @router.post("/signup", tags=["Users"], status_code=201, response_model=User)
 async def signup(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_connection)],
     user: Annotated[User, Depends(authenticate_user)],
     settings: Annotated[Settings, Depends(get_settings)],
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
+    cache: Annotated[TTLCache, Depends(get_user_cache)],
+    background_tasks: BackgroundTasks,
 ):
     try:
-        return await sign_up(cp, user, settings.azure_storage_connection_string)
+        user, folder_id = await sign_up(cp, user, cache)
     except UserConflictError:
         raise HTTPException(status_code=HTTPStatus.CONFLICT, detail="User exists!")
+    background_tasks.add_task(
+        provision_storage,
+        storage,
+        user.id,
+        folder_id,
+        settings.storage_provision_attempts,
+    )
+    return user
 
 
-@router.post("/login", tags=["Users"], status_code=200, response_model=User)
-async def login(user: User = Depends(fetch_user)):
-    return user
+@router.post("/login", tags=["Users"], status_code=200, response_model=LoginResponse)
+async def login(
+    user: User = Depends(fetch_basic_user),
+    signer: TokenSigner | None = Depends(get_token_signer),
+):
+    if signer is None:
+        return LoginResponse(**user.model_dump())
+    token, expires_at = signer.issue(user)
+    return LoginResponse(**user.model_dump(), token=token, expires_at=expires_at)
 
 
-@router.get("/inspections", tags=["Inspections"], response_model=list[InspectionData])
+@router.get(
+    "/inspections",
+    tags=["Inspections"],
+    response_model=list[InspectionData],
+    dependencies=[Depends(rate_limit("read"))],
+)
 async def get_inspections(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_read_connection)],
     user: User = Depends(fetch_user),
 ):
     return await read_all_inspections(cp, user)
 
 
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
 @router.get(
-    "/inspections/{id}", tags=["Inspections"], response_model=InspectionResponse
+    "/inspections/export",
+    tags=["Inspections"],
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("read"))],
+)
+async def export_inspections_(
+    cp: Annotated[ConnectionPool, Depends(get_read_pool)],
+    user: Annotated[User, Depends(fetch_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    verified: bool | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    after: UUID | None = None,
+):
+    """
+    Streams all of the user's inspections matching the filters, ordered by id.
+    To resume an interrupted export, pass the id of the last row received as
+    `after`.
+    """
+    rows = export_inspections(
+        cp, user.id, format, verified, since, until, after, settings.export_itersize
+    )
+    return StreamingResponse(
+        rows,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="inspections.{format}"'
+        },
+    )
+
+
+@router.get(
+    "/inspections/{id}",
+    tags=["Inspections"],
+    response_model=InspectionResponse,
+    dependencies=[Depends(rate_limit("read"))],
 )
 async def get_inspection(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    request: Request,
+    response: Response,
+    cp: Annotated[RequestConnection, Depends(get_read_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
     user: Annotated[User, Depends(fetch_user)],
     id: UUID,
 ):
     try:
-        return await read_inspection(cp, user, id)
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            etag = await read_inspection_etag(cp, user, id, cache)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+        etag, inspection = await read_inspection(cp, user, id, cache, snapshots)
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return inspection
     except InspectionNotFoundError:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="Inspection not found"
         )
 
 
+@router.post(
+    "/inspections/batch",
+    tags=["Inspections"],
+    response_model=InspectionBatchResponse,
+    dependencies=[Depends(rate_limit("read"))],
+)
+async def get_inspection_batch(
+    cp: Annotated[RequestConnection, Depends(get_read_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
+    user: Annotated[User, Depends(fetch_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    batch: InspectionBatchRequest,
+):
+    if len(batch.ids) > settings.inspection_batch_max:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.inspection_batch_max} ids per batch",
+        )
+    inspections, not_found = await read_inspections(
+        cp, user, batch.ids, cache, snapshots
+    )
+    return InspectionBatchResponse(inspections=inspections, not_found=not_found)
+
+
+def check_bulk_size(ids: list[UUID], settings: Settings):
+    if len(ids) > settings.inspection_bulk_max:
+        raise HTTPException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.inspection_bulk_max} ids per request",
+        )
+
+
+@router.post(
+    "/inspections/bulk-verify",
+    tags=["Inspections"],
+    response_model=list[InspectionBulkResult],
+)
+async def bulk_verify_inspections(
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
+    user: Annotated[User, Depends(fetch_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    bulk: InspectionBulkVerify,
+):
+    check_bulk_size(bulk.ids, settings)
+    return await verify_inspections(
+        cp, user, bulk.ids, bulk.verified, cache, snapshots
+    )
+
+
+@router.post(
+    "/inspections/bulk-delete",
+    tags=["Inspections"],
+    response_model=list[InspectionBulkResult],
+)
+async def bulk_delete_inspections(
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    folder_cache: Annotated[TTLCache, Depends(get_folder_cache)],
+    user: Annotated[User, Depends(fetch_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
+    bulk: InspectionBatchRequest,
+):
+    check_bulk_size(bulk.ids, settings)
+    return await delete_inspections(
+        cp, user, bulk.ids, storage, cache, folder_cache
+    )
+
+
 @router.post("/inspections", tags=["Inspections"], response_model=InspectionResponse)
 async def post_inspection(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
     user: Annotated[User, Depends(fetch_user)],
     data: InspectionCreate,
 ):
-    return await create_inspection(cp, user, data)
+    return await create_inspection(cp, user, data, cache, snapshots)
 
 
 @router.put(
     "/inspections/{id}", tags=["Inspections"], response_model=InspectionResponse
 )
 async def put_inspection(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
     user: Annotated[User, Depends(fetch_user)],
     id: UUID,
     inspection: InspectionUpdate,
 ):
     try:
-        return await update_inspection(cp, user, id, inspection)
+        return await update_inspection(cp, user, id, inspection, cache, snapshots)
     except InspectionNotFoundError:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="Inspection not found"
         )
 
 
+@router.patch(
+    "/inspections/{id}", tags=["Inspections"], response_model=InspectionResponse
+)
+async def patch_inspection_(
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    snapshots: Annotated[bool, Depends(use_inspection_snapshots)],
+    user: Annotated[User, Depends(fetch_user)],
+    id: UUID,
+    patch: Annotated[dict, Body(media_type="application/merge-patch+json")],
+):
+    try:
+        return await patch_inspection(cp, user, id, patch, cache, snapshots)
+    except InspectionNotFoundError:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail="Inspection not found"
+        )
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY, detail=str(e))
+
+
 @router.delete(
     "/inspections/{id}", tags=["Inspections"], response_model=DeletedInspection
 )
 async def delete_inspection_(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_inspection_cache)],
+    folder_cache: Annotated[TTLCache, Depends(get_folder_cache)],
     user: Annotated[User, Depends(fetch_user)],
-    settings: Annotated[Settings, Depends(get_settings)],
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
     id: UUID,
 ):
     try:
-        conn_string = settings.azure_storage_connection_string
-        return await delete_inspection(cp, user, id, conn_string)
+        return await delete_inspection(cp, user, id, storage, cache, folder_cache)
     except InspectionNotFoundError:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="Inspection not found"
         )
 
 
-@router.get("/files", tags=["Files"], response_model=list[FolderResponse])
+@router.get(
+    "/files",
+    tags=["Files"],
+    response_model=list[FolderResponse],
+    dependencies=[Depends(rate_limit("read"))],
+)
 async def get_folders(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_read_connection)],
     user: Annotated[User, Depends(fetch_user)],
 ):
     return await read_folders(cp, user.id)
 
 
-@router.get("/files/{folder_id}", tags=["Files"], response_model=FolderResponse)
+@router.get(
+    "/files/{folder_id}",
+    tags=["Files"],
+    response_model=FolderResponse,
+    dependencies=[Depends(rate_limit("read"))],
+)
 async def get_folder(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    request: Request,
+    response: Response,
+    cp: Annotated[RequestConnection, Depends(get_read_connection)],
+    cache: Annotated[TTLCache, Depends(get_folder_cache)],
     user: Annotated[User, Depends(fetch_user)],
     folder_id: UUID,
 ):
     try:
-        return await read_folder(cp, user.id, folder_id)
+        folder = await read_folder(cp, user.id, folder_id, cache)
     except FileNotFoundError:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Folder not found")
-
-
-@router.post("/files", tags=["Files"], response_model=FolderResponse)
+    etag = make_etag(folder.id, folder.name, *(folder.file_ids or []))
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return folder
+
+
+@router.post(
+    "/files",
+    tags=["Files"],
+    response_model=FolderResponse,
+    dependencies=[Depends(rate_limit("upload"))],
+)
 async def create_folder_(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_folder_cache)],
     user: Annotated[User, Depends(fetch_user)],
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
     settings: Annotated[Settings, Depends(get_settings)],
     files: Annotated[list[UploadFile], Depends(validate_files)],
 ):
     label_images = [await f.read() for f in files]
-    conn_string = settings.azure_storage_connection_string
-    return await create_folder(cp, conn_string, user.id, label_images)
+    return await create_folder(
+        cp, storage, user.id, label_images, cache, settings.upload_concurrency
+    )
 
 
 @router.delete(
     "/files/{folder_id}", tags=["Files"], response_model=DeleteFolderResponse
 )
 async def delete_folder_(
-    cp: Annotated[ConnectionPool, Depends(get_connection_pool)],
+    cp: Annotated[RequestConnection, Depends(get_write_connection)],
+    cache: Annotated[TTLCache, Depends(get_folder_cache)],
     user: Annotated[User, Depends(fetch_user)],
-    settings: Annotated[Settings, Depends(get_settings)],
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
     folder_id: UUID,
 ):
-    conn_string = settings.azure_storage_connection_string
     try:
-        return await delete_folder(cp, conn_string, user.id, folder_id)
+        return await delete_folder(cp, storage, user.id, folder_id, cache)
     except FileNotFoundError:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Folder not found")
 
 
-@router.get("/files/{folder_id}/{file_id}", tags=["Files"], response_class=Response)
+BYTE_RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def parse_range(request: Request) -> tuple[int, int | None] | None:
+    """
+    Parses a single `bytes=start-[end]` range into an offset and a length.
+
+    Other ranges, suffix and multiple ranges included, are ignored and the
+    whole file is sent, as are ranges made conditional by If-Range.
+    """
+    header = request.headers.get("Range")
+    if not header or "If-Range" in request.headers:
+        return None
+    if (match := BYTE_RANGE.fullmatch(header.strip())) is None:
+        return None
+    start = int(match[1])
+    if not match[2]:
+        return start, None
+    end = int(match[2])
+    return (start, end - start + 1) if end >= start else None
+
+
+async def prepend(first: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield first
+    async for chunk in chunks:
+        yield chunk
+
+
+@router.get(
+    "/files/{folder_id}/{file_id}",
+    tags=["Files"],
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("read"))],
+)
 async def get_file(
-    settings: Annotated[Settings, Depends(get_settings)],
+    request: Request,
+    storage: Annotated[BlobStorage, Depends(get_blob_storage)],
     user: Annotated[User, Depends(fetch_user)],
     folder_id: UUID,
     file_id: UUID,
 ):
-    conn = settings.azure_storage_connection_string
+    """
+    Streams a file, or the byte range asked for with a 206. The response is
+    conditional on If-None-Match, which takes precedence, or If-Modified-Since.
+    """
+    offset, length = parse_range(request) or (None, None)
+    if_modified_since = None
+    if_none_match = request.headers.get("If-None-Match") or None
+    if if_none_match is None and (since := request.headers.get("If-Modified-Since")):
+        try:
+            if_modified_since = parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            pass
     try:
-        binaries = await read_file(conn, user.id, folder_id, file_id)
-        kind = filetype.guess(binaries)
-        mime_type = kind.mime if kind else "application/octet-stream"
-        return Response(content=binaries, media_type=mime_type)
-        # in the future, the mimetype should be saved upstream and returned here
+        download = await read_file(
+            storage,
+            user.id,
+            folder_id,
+            file_id,
+            offset=offset,
+            length=length,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+        )
     except FileNotFoundError:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="File not found")
+    except FileNotModifiedError as e:
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        if e.etag:
+            headers["ETag"] = e.etag
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    except RangeNotSatisfiableError:
+        raise HTTPException(
+            status_code=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Range not satisfiable",
+        )
+
+    properties = download.properties
+    headers = {
+        "Content-Length": str(download.size),
+        "Accept-Ranges": "bytes",
+        "ETag": properties.etag,
+        "Last-Modified": format_datetime(properties.last_modified, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+    }
+    status_code = HTTPStatus.OK
+    if offset is not None:
+        status_code = HTTPStatus.PARTIAL_CONTENT
+        total = properties.content_range.rpartition("/")[2]
+        end = offset + download.size - 1
+        headers["Content-Range"] = f"bytes {offset}-{end}/{total}"
+
+    chunks = download.chunks()
+    mime_type = properties.content_settings.content_type
+    if offset is None and mime_type in (None, "", DEFAULT_CONTENT_TYPE):
+        # Files uploaded before their type was stored: sniff it from the first
+        # chunk. A range doesn't start with the file's signature.
+        first = await anext(chunks, b"")
+        chunks = prepend(first, chunks)
+        mime_type = guess_content_type(first)
+    return StreamingResponse(
+        chunks,
+        status_code=status_code,
+        media_type=mime_type or DEFAULT_CONTENT_TYPE,
+        headers=headers,
+    )
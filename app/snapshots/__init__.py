@@ -0,0 +1,168 @@
+"""
+Precomputed inspection documents.
+
+`get_full_inspection_json` assembles an inspection from many normalized tables.
+The backend keeps the result in `inspection_snapshot`, refreshed in the same
+transaction as every write, so a read is a single-row fetch. A snapshot is only
+used while its version matches the inspection's, so a write that bypassed the
+backend falls back to the normalized read instead of serving stale data.
+
+Maintenance commands:
+
+    python -m app.snapshots create     # create the snapshot table
+    python -m app.snapshots backfill   # snapshot missing or stale inspections
+    python -m app.snapshots check      # compare snapshots to the normalized data
+
+The table references the datastore's `inspection` table, so it is created by
+the `create` command, run once before `inspection_snapshots` is enabled, and
+not by the app at startup.
+"""
+
+from uuid import UUID
+
+from fertiscan import get_full_inspection_json
+from psycopg import Connection, Cursor
+from psycopg.sql import SQL
+
+from app.etags import make_etag
+from app.models.inspections import InspectionResponse
+
+
+def ensure_snapshot_table(conn: Connection):
+    conn.execute(
+        SQL(
+            """
+            CREATE TABLE IF NOT EXISTS inspection_snapshot (
+                inspection_id uuid PRIMARY KEY
+                    REFERENCES inspection (id) ON DELETE CASCADE,
+                inspector_id uuid NOT NULL,
+                version timestamptz NOT NULL,
+                document jsonb NOT NULL,
+                refreshed_at timestamptz NOT NULL DEFAULT now()
+            )
+            """
+        )
+    )
+
+
+def snapshot_table_exists(conn: Connection) -> bool:
+    row = conn.execute(SQL("SELECT to_regclass('inspection_snapshot')")).fetchone()
+    return row[0] is not None
+
+
+def read_snapshots(
+    cursor: Cursor, user_id: UUID, ids: list[UUID]
+) -> dict[UUID, tuple[str, InspectionResponse]]:
+    """
+    Reads the up-to-date snapshots among `ids`.
+
+    Returns:
+        dict: The etag and inspection of each id with a current snapshot.
+    """
+    query = SQL(
+        """
+        SELECT i.id, COALESCE(i.updated_at, i.upload_date), s.document
+        FROM inspection_snapshot s
+        JOIN inspection i ON i.id = s.inspection_id
+        WHERE s.inspection_id = ANY(%s)
+            AND s.inspector_id = %s
+            AND s.version = COALESCE(i.updated_at, i.upload_date)
+        """
+    )
+    cursor.execute(query, (ids, user_id))
+    return {
+        id: (make_etag(id, version), InspectionResponse.model_validate(document))
+        for id, version, document in cursor.fetchall()
+    }
+
+
+async def refresh_snapshot(cursor: Cursor, user_id: UUID, id: UUID) -> str:
+    """Stores the current document of an inspection as its snapshot and returns it."""
+    document = await get_full_inspection_json(cursor, id, user_id)
+    query = SQL(
+        """
+        INSERT INTO inspection_snapshot (
+            inspection_id, inspector_id, version, document
+        )
+        SELECT id, inspector_id, COALESCE(updated_at, upload_date), %s::jsonb
+        FROM inspection
+        WHERE id = %s AND inspector_id = %s
+        ON CONFLICT (inspection_id) DO UPDATE
+        SET version = EXCLUDED.version,
+            document = EXCLUDED.document,
+            refreshed_at = now()
+        """
+    )
+    cursor.execute(query, (document, id, user_id))
+    return document
+
+
+async def backfill(conn: Connection, batch_size: int = 500) -> int:
+    """
+    Snapshots every inspection without an up-to-date snapshot, committing
+    after each batch.
+
+    Returns:
+        int: The number of snapshots written.
+    """
+    query = SQL(
+        """
+        SELECT i.id, i.inspector_id
+        FROM inspection i
+        LEFT JOIN inspection_snapshot s ON s.inspection_id = i.id
+        WHERE i.id > %s
+            AND (
+                s.inspection_id IS NULL
+                OR s.version <> COALESCE(i.updated_at, i.upload_date)
+            )
+        ORDER BY i.id
+        LIMIT %s
+        """
+    )
+    written = 0
+    after = UUID(int=0)
+    with conn.cursor() as cursor:
+        while True:
+            with conn.transaction():
+                cursor.execute(query, (after, batch_size))
+                batch = cursor.fetchall()
+                for id, inspector_id in batch:
+                    await refresh_snapshot(cursor, inspector_id, id)
+            written += len(batch)
+            if len(batch) < batch_size:
+                return written
+            after = batch[-1][0]
+
+
+async def check(conn: Connection) -> list[tuple[UUID, str]]:
+    """
+    Compares every snapshot with the document built from the normalized
+    tables.
+
+    Returns:
+        list: The id of each inspection whose snapshot is stale or differs,
+            with the reason.
+    """
+    query = SQL(
+        """
+        SELECT
+            s.inspection_id, s.inspector_id, s.document,
+            s.version = COALESCE(i.updated_at, i.upload_date)
+        FROM inspection_snapshot s
+        JOIN inspection i ON i.id = s.inspection_id
+        ORDER BY s.inspection_id
+        """
+    )
+    problems = []
+    with conn.cursor(name="check_snapshots") as snapshots, conn.cursor() as cursor:
+        snapshots.execute(query)
+        for id, inspector_id, document, current in snapshots:
+            if not current:
+                problems.append((id, "stale"))
+                continue
+            expected = InspectionResponse.model_validate_json(
+                await get_full_inspection_json(cursor, id, inspector_id)
+            )
+            if InspectionResponse.model_validate(document) != expected:
+                problems.append((id, "differs"))
+    return problems
@@ -0,0 +1,33 @@
+import argparse
+import asyncio
+import sys
+
+from app.config import Settings, create_pool
+from app.snapshots import backfill, check, ensure_snapshot_table
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.snapshots")
+    parser.add_argument("command", choices=["create", "backfill", "check"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    with create_pool(Settings(), open=True) as cp, cp.connection() as conn:
+        if args.command == "create":
+            ensure_snapshot_table(conn)
+            conn.commit()
+            print("inspection_snapshot table ready")
+            return 0
+        if args.command == "backfill":
+            written = asyncio.run(backfill(conn, args.batch_size))
+            print(f"{written} snapshots written")
+            return 0
+        problems = asyncio.run(check(conn))
+        for id, reason in problems:
+            print(f"{id}\t{reason}")
+        print(f"{len(problems)} inconsistent snapshots")
+        return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
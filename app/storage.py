@@ -0,0 +1,148 @@
+import asyncio
+from collections.abc import Callable, Coroutine
+from typing import Any, TypeVar
+from uuid import UUID
+
+import aiohttp
+import requests
+from azure.core.pipeline import PipelineRequest
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
+from azure.storage.blob import BlobServiceClient, ContainerClient
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+from datastore.blob.azure_storage_api import build_container_name
+from fastapi.logger import logger
+from requests.adapters import HTTPAdapter
+from starlette.concurrency import run_in_threadpool
+
+from app.cache import TTLCache
+from app.deadlines import blob_timeouts
+from app.exceptions import log_error
+
+# Downloads are streamed in chunks of this size, which bounds the memory held
+# by each of them.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+T = TypeVar("T")
+
+# Lifetime of a cached container client, in seconds.
+CLIENT_TTL = 3600.0
+
+# Most blobs the service deletes in one batch request.
+BLOB_BATCH_SIZE = 256
+
+
+def apply_deadline(request: PipelineRequest):
+    """Bounds a storage request's transport timeouts by the current deadline."""
+    for option, timeout in blob_timeouts().items():
+        request.context.options.setdefault(option, timeout)
+
+
+async def run_in_thread(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a datastore coroutine to completion in the threadpool, on an event
+    loop of its own. The datastore's blob functions are coroutines that call
+    the sync storage client, so awaiting them directly blocks the event loop.
+    """
+    return await run_in_threadpool(asyncio.run, coroutine)
+
+
+async def delete_blobs(container_client: AsyncContainerClient, names: list[str]):
+    """
+    Deletes blobs `BLOB_BATCH_SIZE` at a time, one request per batch. Blobs
+    that can't be deleted are logged and left behind.
+    """
+    for start in range(0, len(names), BLOB_BATCH_SIZE):
+        batch = names[start : start + BLOB_BATCH_SIZE]
+        try:
+            responses = await container_client.delete_blobs(
+                *batch, raise_on_any_failure=False
+            )
+            async for response in responses:
+                if response.status_code not in (202, 404):
+                    logger.warning(
+                        f"Blob not deleted ({response.status_code}): "
+                        f"{response.request.url}"
+                    )
+        except Exception as e:
+            log_error(e)
+
+
+class BlobStorage:
+    """
+    Process-wide access to the storage account.
+
+    Container clients are cached and share the service client's transport, so
+    requests reuse its keep-alive connections instead of each building an HTTP
+    pipeline and opening a TLS session.
+
+    Blob operations the app makes itself go through the async clients and
+    don't block the event loop. The datastore's functions take a sync
+    `ContainerClient`, so a sync service client is kept for them.
+
+    Must be created, and closed, on the running event loop.
+
+    Args:
+        connection_string (str): The storage account connection string.
+        pool_size (int): Maximum number of connections kept open to storage,
+            by each of the sync and async clients.
+        max_clients (int): Maximum number of container clients cached, by
+            each of the sync and async clients. Evicting one leaves the shared
+            transport open.
+    """
+
+    def __init__(
+        self, connection_string: str, pool_size: int = 10, max_clients: int = 1024
+    ):
+        options = {
+            "max_single_get_size": DOWNLOAD_CHUNK_SIZE,
+            "max_chunk_get_size": DOWNLOAD_CHUNK_SIZE,
+            "raw_request_hook": apply_deadline,
+        }
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self.service = BlobServiceClient.from_connection_string(
+            connection_string,
+            transport=RequestsTransport(session=self._session, session_owner=False),
+            **options,
+        )
+        self._async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size)
+        )
+        self.async_service = AsyncBlobServiceClient.from_connection_string(
+            connection_string,
+            transport=AioHttpTransport(
+                session=self._async_session, session_owner=False
+            ),
+            **options,
+        )
+        self._containers = TTLCache("containers", max_clients, CLIENT_TTL)
+        self._async_containers = TTLCache("async_containers", max_clients, CLIENT_TTL)
+
+    def _cached(self, clients: TTLCache, user_id: UUID | str, factory: Callable):
+        name = build_container_name(str(user_id))
+        if (client := clients.get(name)) is None:
+            # Racing requests may each build a client: they're interchangeable.
+            client = factory(name)
+            clients.set(name, client)
+        return client
+
+    def container(self, user_id: UUID | str) -> ContainerClient:
+        """The sync client of a user's container, for the datastore."""
+        return self._cached(
+            self._containers, user_id, self.service.get_container_client
+        )
+
+    def async_container(self, user_id: UUID | str) -> AsyncContainerClient:
+        """The async client of a user's container."""
+        return self._cached(
+            self._async_containers, user_id, self.async_service.get_container_client
+        )
+
+    async def close(self):
+        self.service.close()
+        self._session.close()
+        await self.async_service.close()
+        await self._async_session.close()
@@ -1,22 +1,31 @@
+import asyncio
 import base64
+import time
 import unittest
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from io import BytesIO
-from unittest.mock import ANY, Mock, patch
+from unittest.mock import ANY, MagicMock, Mock, patch
 
+from fastapi.security import HTTPBasicCredentials
 from fastapi.testclient import TestClient
 from pipeline import FertilizerInspection
 
+from app.db import lend_connection
 from app.dependencies import (
     authenticate_user,
+    fetch_basic_user,
     fetch_user,
     get_connection_pool,
+    get_read_pool,
     get_settings,
+    release_connection,
 )
 from app.exceptions import (
     FileNotFoundError,
+    FileNotModifiedError,
     InspectionNotFoundError,
+    RangeNotSatisfiableError,
     UserConflictError,
     UserNotFoundError,
 )
@@ -24,6 +33,7 @@ from app.models.files import DeleteFolderResponse, Folder
 from app.models.inspections import DeletedInspection, InspectionData, InspectionResponse
 from app.models.label_data import LabelData
 from app.models.users import User
+from app.tokens import TokenSigner
 from tests import app
 
 
@@ -36,6 +46,15 @@ class TestAPIMonitoring(unittest.TestCase):
         assert response.status_code == 200
         assert response.json() == {"status": "ok"}
 
+    def test_metrics(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        names = [c["name"] for c in response.json()["caches"]]
+        self.assertIn("inspections", names)
+        self.assertIn("prepared_statements", response.json())
+        self.assertIn("queries", response.json())
+        self.assertIn("pool_wait", response.json())
+
 
 class TestAPIPipeline(unittest.TestCase):
     def setUp(self) -> None:
@@ -108,6 +127,31 @@ class TestAPIPipeline(unittest.TestCase):
         response = self.client.post("/analyze", files=files)
         self.assertEqual(response.status_code, 422)
 
+    @patch("app.routes.extract_data")
+    def test_analyze_past_deadline(self, mock_extract_data):
+        mock_extract_data.side_effect = lambda *_: time.sleep(0.5)
+        files = [("files", ("file1.txt", b"Sample content", "text/plain"))]
+        response = self.client.post(
+            "/analyze", files=files, headers={"X-Request-Timeout": "0.05"}
+        )
+        self.assertEqual(response.status_code, 504)
+
+    def test_analyze_rate_limited(self):
+        self.addCleanup(setattr, app, "rate_limiter", app.rate_limiter)
+        app.rate_limiter = Mock(acquire=Mock(return_value=2.5))
+        files = [("files", ("file1.txt", b"Sample content", "text/plain"))]
+        response = self.client.post("/analyze", files=files)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "3")
+        app.rate_limiter.acquire.assert_called_once_with("test-user", "analyze")
+
+    def test_invalid_request_timeout(self):
+        files = [("files", ("file1.txt", b"Sample content", "text/plain"))]
+        response = self.client.post(
+            "/analyze", files=files, headers={"X-Request-Timeout": "0"}
+        )
+        self.assertEqual(response.status_code, 422)
+
     @patch("app.routes.extract_data")
     def test_analyze_empty_file_list(self, mock_extract_data):
         """Test analyze_document with an empty file list"""
@@ -135,13 +179,19 @@ class TestAPIUsers(unittest.TestCase):
         app.dependency_overrides[authenticate_user] = override_dep
         app.dependency_overrides[get_settings] = override_dep
         app.dependency_overrides[fetch_user] = lambda: self.test_user
+        app.dependency_overrides[fetch_basic_user] = lambda: self.test_user
 
+    @patch("app.routes.provision_storage")
     @patch("app.routes.sign_up")
-    def test_signup(self, mock_sign_up):
-        mock_sign_up.return_value = self.test_user
+    def test_signup(self, mock_sign_up, mock_provision_storage):
+        folder_id = uuid.uuid4()
+        mock_sign_up.return_value = (self.test_user, folder_id)
         response = self.client.post("/signup", json={"username": "test_user"})
         self.assertEqual(response.status_code, 201)
         User.model_validate(response.json())
+        mock_provision_storage.assert_called_once_with(
+            ANY, self.test_user.id, folder_id, ANY
+        )
 
     @patch("app.routes.sign_up")
     def test_signup_existing_user(self, mock_sign_up):
@@ -165,10 +215,11 @@ class TestAPIUsers(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 400)
 
+    @patch("app.routes.provision_storage")
     @patch("app.routes.sign_up")
-    def test_signup_authentication_success(self, mock_sign_up):
+    def test_signup_authentication_success(self, mock_sign_up, _):
         del app.dependency_overrides[authenticate_user]
-        mock_sign_up.return_value = self.test_user
+        mock_sign_up.return_value = (self.test_user, uuid.uuid4())
         response = self.client.post(
             "/signup",
             headers={
@@ -185,7 +236,7 @@ class TestAPIUsers(unittest.TestCase):
 
     @patch("app.dependencies.sign_in")
     def test_sign_in_user_not_found(self, mock_sign_in):
-        del app.dependency_overrides[fetch_user]
+        del app.dependency_overrides[fetch_basic_user]
         mock_sign_in.side_effect = UserNotFoundError()
         response = self.client.post("/login")
         # if the user is not found, the response should be NOT AUTHORIZED
@@ -193,7 +244,7 @@ class TestAPIUsers(unittest.TestCase):
 
     def test_sign_in_bad_authentication(self):
         del app.dependency_overrides[authenticate_user]
-        del app.dependency_overrides[fetch_user]
+        del app.dependency_overrides[fetch_basic_user]
         # Test with no authentication
         response = self.client.post("/login")
         self.assertEqual(response.status_code, 401)
@@ -210,7 +261,7 @@ class TestAPIUsers(unittest.TestCase):
     @patch("app.dependencies.sign_in")
     def test_sign_in_authentication_success(self, mock_sign_in):
         del app.dependency_overrides[authenticate_user]
-        del app.dependency_overrides[fetch_user]
+        del app.dependency_overrides[fetch_basic_user]
         mock_sign_in.return_value = self.test_user
         response = self.client.post("/login")
         response = self.client.post(
@@ -221,6 +272,64 @@ class TestAPIUsers(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+    @patch("app.dependencies.sign_in")
+    def test_user_lookup_keeps_its_connection(self, mock_sign_in):
+        async def sign_in(cp, user, cache):
+            with cp.connection():
+                return self.test_user
+
+        mock_sign_in.side_effect = sign_in
+        pool = MagicMock()
+        credentials = HTTPBasicCredentials(username="test_user", password="")
+        with lend_connection(pool) as lease:
+            user = asyncio.run(fetch_basic_user(credentials, lease, None))
+            # The route reuses it rather than check out a second one.
+            self.assertTrue(lease.checked_out)
+            release_connection(user, lease)
+            self.assertFalse(lease.checked_out)
+        self.assertEqual(user, self.test_user)
+        pool.connection.return_value.__exit__.assert_called_once_with(
+            None, None, None
+        )
+
+    @patch("app.routes.read_all_inspections")
+    @patch("app.dependencies.sign_in")
+    def test_sign_in_with_token(self, mock_sign_in, mock_read_all_inspections):
+        del app.dependency_overrides[fetch_user]
+        del app.dependency_overrides[fetch_basic_user]
+        mock_read_all_inspections.return_value = []
+        app.tokens = TokenSigner(["test_key"])
+        self.addCleanup(setattr, app, "tokens", None)
+        mock_sign_in.return_value = self.test_user
+        response = self.client.post(
+            "/login",
+            headers={
+                "Authorization": f"Basic {self.credentials('test_user', 'password')}",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        token = response.json()["token"]
+
+        mock_sign_in.reset_mock()
+        response = self.client.get(
+            "/inspections", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        mock_read_all_inspections.assert_called_once_with(ANY, self.test_user)
+        mock_sign_in.assert_not_called()
+
+        response = self.client.get(
+            "/inspections", headers={"Authorization": f"Bearer {token}x"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+        # A token can't be traded for a fresh one without credentials.
+        response = self.client.post(
+            "/login", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.headers["www-authenticate"], "Basic")
+
 
 class TestAPIInspections(unittest.TestCase):
     def setUp(self) -> None:
@@ -347,12 +456,42 @@ class TestAPIInspections(unittest.TestCase):
         response = self.client.get("/inspections")
         self.assertEqual(response.status_code, 401)
 
+    @patch("app.routes.read_inspection_etag")
     @patch("app.routes.read_inspection")
-    def test_get_inspection(self, mock_read_inspection):
-        mock_read_inspection.return_value = self.mock_inspection
+    def test_get_inspection(self, mock_read_inspection, mock_read_inspection_etag):
+        mock_read_inspection.return_value = ('"v1"', self.mock_inspection)
         response = self.client.get(f"/inspections/{uuid.uuid4()}")
         self.assertEqual(response.status_code, 200)
         InspectionResponse.model_validate(response.json())
+        self.assertEqual(response.headers["etag"], '"v1"')
+        self.assertEqual(response.headers["cache-control"], "private, no-cache")
+        mock_read_inspection_etag.assert_not_called()
+
+    @patch("app.routes.read_inspection_etag")
+    @patch("app.routes.read_inspection")
+    def test_get_inspection_not_modified(
+        self, mock_read_inspection, mock_read_inspection_etag
+    ):
+        mock_read_inspection_etag.return_value = '"v1"'
+        response = self.client.get(
+            f"/inspections/{uuid.uuid4()}", headers={"If-None-Match": '"v1"'}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], '"v1"')
+        mock_read_inspection.assert_not_called()
+
+    @patch("app.routes.read_inspection_etag")
+    @patch("app.routes.read_inspection")
+    def test_get_inspection_modified(
+        self, mock_read_inspection, mock_read_inspection_etag
+    ):
+        mock_read_inspection.return_value = ('"v2"', self.mock_inspection)
+        mock_read_inspection_etag.return_value = '"v2"'
+        response = self.client.get(
+            f"/inspections/{uuid.uuid4()}", headers={"If-None-Match": '"v1"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], '"v2"')
 
     @patch("app.routes.read_inspection")
     def test_get_inspection_not_found(self, mock_read_inspection):
@@ -365,6 +504,79 @@ class TestAPIInspections(unittest.TestCase):
         response = self.client.get(f"/inspections/{uuid.uuid4()}")
         self.assertEqual(response.status_code, 401)
 
+    @patch("app.routes.export_inspections")
+    def test_export_inspections_csv(self, mock_export_inspections):
+        app.dependency_overrides[get_read_pool] = lambda: Mock()
+        mock_export_inspections.return_value = iter(["id\r\n", "1\r\n"])
+        after = uuid.uuid4()
+        response = self.client.get(
+            "/inspections/export", params={"format": "csv", "after": str(after)}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/csv"))
+        self.assertEqual(response.text, "id\r\n1\r\n")
+        self.assertEqual(mock_export_inspections.call_args.args[6], after)
+
+    def test_export_inspections_invalid_format(self):
+        response = self.client.get("/inspections/export", params={"format": "xml"})
+        self.assertEqual(response.status_code, 422)
+
+    @patch("app.routes.verify_inspections")
+    def test_bulk_verify_inspections(self, mock_verify_inspections):
+        ids = [uuid.uuid4(), uuid.uuid4()]
+        mock_verify_inspections.return_value = [
+            {"id": ids[0], "status": "updated"},
+            {"id": ids[1], "status": "not_found"},
+        ]
+        response = self.client.post(
+            "/inspections/bulk-verify",
+            json={"ids": [str(id) for id in ids], "verified": False},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[1]["status"], "not_found")
+        self.assertFalse(mock_verify_inspections.call_args.args[3])
+
+    @patch("app.routes.delete_inspections")
+    def test_bulk_delete_inspections(self, mock_delete_inspections):
+        id = uuid.uuid4()
+        mock_delete_inspections.return_value = [{"id": id, "status": "deleted"}]
+        response = self.client.post("/inspections/bulk-delete", json={"ids": [str(id)]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), [{"id": str(id), "status": "deleted", "detail": None}]
+        )
+
+    @patch("app.routes.delete_inspections")
+    def test_bulk_delete_too_many_ids(self, mock_delete_inspections):
+        limit = app.settings.inspection_bulk_max
+        ids = [str(uuid.uuid4()) for _ in range(limit + 1)]
+        response = self.client.post("/inspections/bulk-delete", json={"ids": ids})
+        self.assertEqual(response.status_code, 422)
+        mock_delete_inspections.assert_not_called()
+
+    @patch("app.routes.read_inspections")
+    def test_get_inspection_batch(self, mock_read_inspections):
+        missing = uuid.uuid4()
+        mock_read_inspections.return_value = ([self.mock_inspection], [missing])
+        ids = [str(self.mock_inspection.inspection_id), str(missing)]
+        response = self.client.post("/inspections/batch", json={"ids": ids})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body["inspections"]), 1)
+        self.assertEqual(body["not_found"], [str(missing)])
+
+    @patch("app.routes.read_inspections")
+    def test_get_inspection_batch_too_large(self, mock_read_inspections):
+        limit = app.settings.inspection_batch_max
+        ids = [str(uuid.uuid4()) for _ in range(limit + 1)]
+        response = self.client.post("/inspections/batch", json={"ids": ids})
+        self.assertEqual(response.status_code, 422)
+        mock_read_inspections.assert_not_called()
+
+    def test_get_inspection_batch_empty(self):
+        response = self.client.post("/inspections/batch", json={"ids": []})
+        self.assertEqual(response.status_code, 422)
+
     @patch("app.routes.create_inspection")
     def test_create_inspection(self, mock_create_inspection):
         mock_create_inspection.return_value = self.mock_inspection
@@ -388,6 +600,43 @@ class TestAPIInspections(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 401)
 
+    @patch("app.routes.patch_inspection")
+    def test_patch_inspection(self, mock_patch_inspection):
+        mock_patch_inspection.return_value = self.mock_inspection
+        inspection_id = uuid.uuid4()
+        patch_data = {"product": {"lot_number": "new"}}
+        response = self.client.patch(
+            f"/inspections/{inspection_id}",
+            json=patch_data,
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+        self.assertEqual(response.status_code, 200)
+        InspectionResponse.model_validate(response.json())
+        mock_patch_inspection.assert_called_once_with(
+            ANY,
+            self.test_user,
+            inspection_id,
+            patch_data,
+            ANY,
+            app.settings.inspection_snapshots,
+        )
+
+    @patch("app.routes.patch_inspection")
+    def test_patch_inspection_not_found(self, mock_patch_inspection):
+        mock_patch_inspection.side_effect = InspectionNotFoundError()
+        response = self.client.patch(
+            f"/inspections/{uuid.uuid4()}", json={"verified": True}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @patch("app.routes.patch_inspection")
+    def test_patch_inspection_invalid_data(self, mock_patch_inspection):
+        mock_patch_inspection.side_effect = ValueError("Unknown inspection fields")
+        response = self.client.patch(
+            f"/inspections/{uuid.uuid4()}", json={"unknown": True}
+        )
+        self.assertEqual(response.status_code, 422)
+
     @patch("app.routes.delete_inspection")
     def test_delete_inspection(self, mock_delete_inspection):
         mock_deleted_inspection = DeletedInspection(id=uuid.uuid4())
@@ -511,6 +760,20 @@ class TestAPIFiles(unittest.TestCase):
         self.assertEqual(data["id"], str(folder_id))
         self.assertEqual(set(data["file_ids"]), {str(file_ids[0]), str(file_ids[1])})
 
+    @patch("app.routes.read_folder")
+    def test_get_folder_not_modified(self, mock_read_folder):
+        mock_read_folder.return_value = Folder(
+            id=self.folder_id, owner_id=self.test_user.id, file_ids=[uuid.uuid4()]
+        )
+        response = self.client.get(f"/files/{self.folder_id}")
+        etag = response.headers["etag"]
+
+        response = self.client.get(
+            f"/files/{self.folder_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
     def test_get_folder_unauthenticated(self):
         del app.dependency_overrides[fetch_user]
         response = self.client.get(f"/files/{self.folder_id}")
@@ -562,7 +825,7 @@ class TestAPIFiles(unittest.TestCase):
         self.assertEqual(data["id"], str(self.folder_id))
         self.assertTrue(data["deleted"])
         mock_delete_folder.assert_called_once_with(
-            ANY, "mock_connection_string", self.test_user.id, self.folder_id
+            ANY, ANY, self.test_user.id, self.folder_id, ANY
         )
 
     def test_delete_folder_unauthenticated(self):
@@ -577,15 +840,89 @@ class TestAPIFiles(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(response.json()["detail"], "Folder not found")
 
+    def mock_download(self, content: bytes, total: int, offset: int = 0):
+        async def chunks():
+            yield content[:8]
+            yield content[8:]
+
+        return Mock(
+            size=len(content),
+            chunks=chunks,
+            properties=Mock(
+                etag='"0x8DC"',
+                last_modified=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                content_range=f"bytes {offset}-{offset + len(content) - 1}/{total}",
+                content_settings=Mock(content_type="image/png"),
+            ),
+        )
+
     @patch("app.routes.read_file")
-    async def test_get_file(self, mock_read_file):
-        mock_read_file.return_value = b"fake_image_data"
+    def test_get_file(self, mock_read_file):
+        png = b"\x89PNG\r\n\x1a\n" + b"fake_image_data"
+        mock_read_file.return_value = self.mock_download(png, len(png))
         response = self.client.get(f"/files/{self.folder_id}/{self.file_id}")
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.content, b"fake_image_data")
+        self.assertEqual(response.content, png)
         self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(response.headers["content-length"], str(len(png)))
+        self.assertEqual(response.headers["etag"], '"0x8DC"')
+        self.assertIn("immutable", response.headers["cache-control"])
         mock_read_file.assert_called_once_with(
-            ANY, self.test_user.id, self.folder_id, self.file_id
+            ANY,
+            self.test_user.id,
+            self.folder_id,
+            self.file_id,
+            offset=None,
+            length=None,
+            if_none_match=None,
+            if_modified_since=None,
+        )
+
+    @patch("app.routes.read_file")
+    def test_get_file_sniffs_untyped_file(self, mock_read_file):
+        png = b"\x89PNG\r\n\x1a\n" + b"fake_image_data"
+        download = self.mock_download(png, len(png))
+        download.properties.content_settings.content_type = "application/octet-stream"
+        mock_read_file.return_value = download
+        response = self.client.get(f"/files/{self.folder_id}/{self.file_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, png)
+        self.assertEqual(response.headers["content-type"], "image/png")
+
+    @patch("app.routes.read_file")
+    def test_get_file_range(self, mock_read_file):
+        mock_read_file.return_value = self.mock_download(b"x" * 10, 100, offset=5)
+        response = self.client.get(
+            f"/files/{self.folder_id}/{self.file_id}",
+            headers={"Range": "bytes=5-14"},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers["content-range"], "bytes 5-14/100")
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(mock_read_file.call_args.kwargs["offset"], 5)
+        self.assertEqual(mock_read_file.call_args.kwargs["length"], 10)
+
+    @patch("app.routes.read_file")
+    def test_get_file_range_not_satisfiable(self, mock_read_file):
+        mock_read_file.side_effect = RangeNotSatisfiableError()
+        response = self.client.get(
+            f"/files/{self.folder_id}/{self.file_id}",
+            headers={"Range": "bytes=500-"},
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(mock_read_file.call_args.kwargs["length"], None)
+
+    @patch("app.routes.read_file")
+    def test_get_file_not_modified(self, mock_read_file):
+        mock_read_file.side_effect = FileNotModifiedError(etag='"0x8DC"')
+        response = self.client.get(
+            f"/files/{self.folder_id}/{self.file_id}",
+            headers={"If-None-Match": '"a", W/"0x8DC"'},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], '"0x8DC"')
+        self.assertEqual(
+            mock_read_file.call_args.kwargs["if_none_match"], '"a", W/"0x8DC"'
         )
 
     @patch("app.routes.read_file")
@@ -599,3 +936,46 @@ class TestAPIFiles(unittest.TestCase):
         del app.dependency_overrides[fetch_user]
         response = self.client.get(f"/files/{self.folder_id}/{self.file_id}")
         self.assertEqual(response.status_code, 401)
+
+
+class TestAPIReadReplicaRouting(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = TestClient(app)
+        self.test_user = User(username="test_user", id=uuid.uuid4())
+        self.primary = Mock()
+        self.replica = Mock()
+
+        app.dependency_overrides.clear()
+        app.dependency_overrides[get_connection_pool] = lambda: self.primary
+        app.dependency_overrides[fetch_user] = lambda: self.test_user
+        app.replica_pool = self.replica
+        app.recent_writers.clear()
+
+    def tearDown(self) -> None:
+        app.replica_pool = None
+        app.recent_writers.clear()
+
+    @patch("app.routes.read_folders")
+    def test_reads_go_to_replica(self, mock_read_folders):
+        mock_read_folders.return_value = []
+        response = self.client.get("/files")
+        self.assertEqual(response.status_code, 200)
+        cp, user_id = mock_read_folders.call_args.args
+        self.assertIs(cp.pool, self.replica)
+        self.assertEqual(user_id, self.test_user.id)
+
+    @patch("app.routes.read_folders")
+    @patch("app.routes.delete_folder")
+    def test_reads_stick_to_primary_after_write(
+        self, mock_delete_folder, mock_read_folders
+    ):
+        app.dependency_overrides[get_settings] = lambda: Mock()
+        folder_id = uuid.uuid4()
+        mock_delete_folder.return_value = DeleteFolderResponse(id=folder_id)
+        mock_read_folders.return_value = []
+        self.client.delete(f"/files/{folder_id}")
+
+        self.client.get("/files")
+
+        cp, _ = mock_read_folders.call_args.args
+        self.assertIs(cp.pool, self.primary)
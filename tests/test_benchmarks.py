@@ -0,0 +1,35 @@
+import contextlib
+import io
+import unittest
+from unittest.mock import patch
+
+from app.benchmarks import summarize, time_calls
+from app.benchmarks.__main__ import main
+
+
+class TestBenchmarks(unittest.IsolatedAsyncioTestCase):
+    def test_summarize_in_milliseconds(self):
+        samples = [i / 1000 for i in range(1, 101)]
+        summary = summarize(samples)
+        self.assertAlmostEqual(summary["p50_ms"], 50.5)
+        self.assertAlmostEqual(summary["p99_ms"], 99.01)
+
+    async def test_time_calls(self):
+        calls = []
+
+        async def call():
+            calls.append(True)
+
+        samples = await time_calls(call, 3)
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all(sample >= 0 for sample in samples))
+
+    def test_round_trips_requires_label_data(self):
+        with (
+            patch("app.benchmarks.__main__.write_round_trips") as mock_write,
+            contextlib.redirect_stderr(io.StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            main(["round-trips", "--username", "inspector"])
+        mock_write.assert_not_called()
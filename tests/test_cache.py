@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import patch
+
+from app.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_missing_key_returns_default(self):
+        cache = TTLCache("test")
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.get("missing", "default"), "default")
+        self.assertEqual(cache.misses, 2)
+
+    def test_set_and_get(self):
+        cache = TTLCache("test")
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        self.assertEqual(cache.hits, 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache("test", ttl=10)
+        with patch("app.cache.time.monotonic", return_value=100.0):
+            cache.set("key", "value")
+        with patch("app.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache("test", maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_zero_maxsize_disables_caching(self):
+        cache = TTLCache("test", maxsize=0)
+        cache.set("key", "value")
+        self.assertIsNone(cache.get("key"))
+
+    def test_invalidate_and_clear(self):
+        cache = TTLCache("test")
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("a")
+        cache.invalidate("unknown")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        cache = TTLCache("test", maxsize=10)
+        cache.set("key", "value")
+        cache.get("key")
+        cache.get("key")
+        cache.get("missing")
+        stats = cache.stats()
+        self.assertEqual(stats.name, "test")
+        self.assertEqual(stats.size, 1)
+        self.assertEqual(stats.maxsize, 10)
+        self.assertEqual(stats.hits, 2)
+        self.assertEqual(stats.misses, 1)
+        self.assertAlmostEqual(stats.hit_ratio, 2 / 3)
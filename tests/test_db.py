@@ -0,0 +1,268 @@
+import logging
+import os
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fastapi import HTTPException
+from psycopg import Pipeline
+
+from app.db import (
+    DeadlineWatchdog,
+    PreparedStatements,
+    batched_writes,
+    count_round_trips,
+    lend_connection,
+)
+from app.deadlines import Deadline
+from app.exceptions import DeadlineExceededError
+
+
+class TestCountRoundTrips(unittest.TestCase):
+    def test_counts_sync_points(self):
+        conn = MagicMock()
+
+        def trace(fileno):
+            os.write(
+                fileno,
+                b'F\t54\tParse\t"" "INSERT ..." 0\n'
+                b"F\t4\tSync\n"
+                b"B\t5\tReadyForQuery\tI\n"
+                b'F\t12\tQuery\t"BEGIN"\n'
+                b"F\t4\tFlush\n",
+            )
+
+        conn.pgconn.trace.side_effect = trace
+
+        with count_round_trips(conn) as round_trips:
+            pass
+
+        self.assertEqual(round_trips.count, 3)
+        conn.pgconn.untrace.assert_called_once()
+
+
+class TestBatchedWrites(unittest.TestCase):
+    @patch("app.db.Pipeline.is_supported", return_value=True)
+    def test_uses_pipeline_when_supported(self, _):
+        conn = MagicMock()
+        with batched_writes(conn, "test"):
+            conn.pipeline.return_value.__enter__.assert_called_once()
+        conn.pipeline.return_value.__exit__.assert_called_once()
+        conn.pgconn.trace.assert_not_called()
+
+    @patch("app.db.Pipeline.is_supported", return_value=False)
+    def test_falls_back_without_pipeline_support(self, _):
+        conn = MagicMock()
+        with batched_writes(conn, "test"):
+            pass
+        conn.pipeline.assert_not_called()
+
+    @patch("app.db.logger")
+    @patch("app.db.Pipeline.is_supported", return_value=True)
+    def test_logs_round_trips_in_debug(self, _, mock_logger):
+        mock_logger.isEnabledFor.side_effect = lambda level: level == logging.DEBUG
+        conn = MagicMock()
+        with batched_writes(conn, "create_inspection"):
+            pass
+        conn.pgconn.trace.assert_called_once()
+        mock_logger.debug.assert_called_once_with("create_inspection: 0 round-trips")
+
+
+class TestRequestConnection(unittest.TestCase):
+    def test_connection_is_checked_out_once_and_shared(self):
+        pool = MagicMock()
+        with lend_connection(pool) as lease:
+            with lease.connection() as first, lease.connection() as second:
+                self.assertIs(first, second)
+            with lease.connection() as third:
+                self.assertIs(first, third)
+        pool.connection.assert_called_once()
+        pool.connection.return_value.__exit__.assert_called_once_with(
+            None, None, None
+        )
+
+    def test_released_lease_checks_out_again(self):
+        pool = MagicMock()
+        with lend_connection(pool) as lease:
+            with lease.connection():
+                pass
+            self.assertTrue(lease.checked_out)
+            lease.release()
+            self.assertFalse(lease.checked_out)
+            with lease.connection():
+                pass
+        self.assertEqual(pool.connection.call_count, 2)
+
+    def test_unused_lease_never_checks_out(self):
+        pool = MagicMock()
+        with lend_connection(pool):
+            pass
+        pool.connection.assert_not_called()
+
+    def test_error_is_passed_to_checkout_for_rollback(self):
+        pool = MagicMock()
+        pool.connection.return_value.__exit__.return_value = False
+        error = RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            with lend_connection(pool) as lease:
+                with lease.connection():
+                    raise error
+        exc_type, exc, _ = pool.connection.return_value.__exit__.call_args.args
+        self.assertIs(exc_type, RuntimeError)
+        self.assertIs(exc, error)
+
+    def test_client_error_rolls_back(self):
+        pool = MagicMock()
+        pool.connection.return_value.__exit__.return_value = False
+        with self.assertRaises(HTTPException):
+            with lend_connection(pool) as lease:
+                with lease.connection():
+                    raise HTTPException(status_code=404)
+        exc_type, _, _ = pool.connection.return_value.__exit__.call_args.args
+        self.assertIs(exc_type, HTTPException)
+
+    def test_deadline_bounds_checkout(self):
+        pool = MagicMock()
+        with lend_connection(pool, Deadline(2)) as lease:
+            with lease.connection():
+                pass
+        self.assertLessEqual(pool.connection.call_args.kwargs["timeout"], 2)
+
+    @patch.object(Pipeline, "is_supported", return_value=True)
+    def test_deadline_sets_statement_timeout_once(self, _):
+        pool = MagicMock()
+        conn = pool.connection.return_value.__enter__.return_value
+        with lend_connection(pool, Deadline(2)) as lease:
+            with lease.connection():
+                pass
+            with lease.connection():
+                pass
+        conn.pipeline.assert_called_once()
+        conn.execute.assert_called_once()
+        (timeout,) = conn.execute.call_args.args[1]
+        self.assertTrue(timeout.endswith("ms"))
+
+    def test_no_statement_timeout_without_deadline(self):
+        pool = MagicMock()
+        conn = pool.connection.return_value.__enter__.return_value
+        with lend_connection(pool) as lease:
+            with lease.connection():
+                pass
+        conn.execute.assert_not_called()
+
+    def test_expiring_deadline_cancels_blocked_statement(self):
+        pool = MagicMock()
+        conn = pool.connection.return_value.__enter__.return_value
+        with lend_connection(pool, Deadline(0.05)) as lease:
+            with lease.connection():
+                # Blocks the thread like a statement run on the event loop.
+                time.sleep(0.2)
+        conn.cancel_safe.assert_called_once()
+
+    def test_released_lease_is_not_cancelled(self):
+        pool = MagicMock()
+        conn = pool.connection.return_value.__enter__.return_value
+        with lend_connection(pool, Deadline(0.05)) as lease:
+            with lease.connection():
+                pass
+        time.sleep(0.1)
+        conn.cancel_safe.assert_not_called()
+
+    def test_expired_deadline_does_not_check_out(self):
+        pool = MagicMock()
+        with self.assertRaises(DeadlineExceededError):
+            with lend_connection(pool, Deadline(0)) as lease:
+                with lease.connection():
+                    pass
+        pool.connection.assert_not_called()
+
+    def test_cancelled_deadline_cancels_statement(self):
+        pool = MagicMock()
+        conn = pool.connection.return_value.__enter__.return_value
+        deadline = Deadline(2)
+        with lend_connection(pool, deadline) as lease:
+            with lease.connection():
+                deadline.cancel()
+        conn.cancel_safe.assert_called_once()
+
+
+class TestDeadlineWatchdog(unittest.TestCase):
+    def test_cancels_leases_in_expiry_order(self):
+        watchdog = DeadlineWatchdog()
+        cancelled = []
+        first, second = MagicMock(), MagicMock()
+        first.cancel.side_effect = lambda: cancelled.append("first")
+        second.cancel.side_effect = lambda: cancelled.append("second")
+        now = time.monotonic()
+        watchdog.watch(second, now + 0.1)
+        watchdog.watch(first, now + 0.05)
+        time.sleep(0.2)
+        self.assertEqual(cancelled, ["first", "second"])
+
+    def test_leaves_unexpired_leases_alone(self):
+        watchdog = DeadlineWatchdog()
+        lease = MagicMock()
+        watchdog.watch(lease, time.monotonic() + 5)
+        time.sleep(0.05)
+        lease.cancel.assert_not_called()
+
+
+class TestPreparedStatements(unittest.TestCase):
+    def setUp(self):
+        self.statements = PreparedStatements()
+
+    def cursor(self, prepare_threshold: int | None = 5):
+        """A cursor whose connection prepares statements like psycopg's."""
+        cursor = MagicMock()
+        cursor.connection.prepare_threshold = prepare_threshold
+        manager = cursor.connection._prepared
+        manager._prepared_idx = 0
+        prepared = set()
+
+        def execute(query, params=None, prepare=None):
+            if prepare_threshold is not None and query not in prepared:
+                prepared.add(query)
+                manager._prepared_idx += 1
+
+        cursor.execute.side_effect = execute
+        cursor.rollback = prepared.clear
+        return cursor
+
+    def test_executes_with_prepare(self):
+        cursor = self.cursor()
+        self.statements.execute(cursor, "lookup", "SELECT %s", (1,))
+        cursor.execute.assert_called_once_with("SELECT %s", (1,), prepare=True)
+
+    def test_counts_actual_prepares(self):
+        first, second = self.cursor(), self.cursor()
+        for _ in range(3):
+            self.statements.execute(first, "lookup", "SELECT 1")
+        self.statements.execute(second, "lookup", "SELECT 1")
+        first.rollback()
+        self.statements.execute(first, "lookup", "SELECT 1")
+
+        (stats,) = self.statements.stats()
+        self.assertEqual(stats.name, "lookup")
+        self.assertEqual(stats.executions, 5)
+        self.assertEqual(stats.prepares, 3)
+        self.assertEqual(stats.reuses, 2)
+        self.assertEqual(stats.reuse_ratio, 0.4)
+
+    def test_nothing_reused_when_preparing_is_disabled(self):
+        cursor = self.cursor(prepare_threshold=None)
+        for _ in range(2):
+            self.statements.execute(cursor, "lookup", "SELECT 1")
+
+        (stats,) = self.statements.stats()
+        self.assertEqual((stats.prepares, stats.reuses), (0, 0))
+
+    def test_only_executions_counted_without_the_prepared_manager(self):
+        cursor = self.cursor()
+        del cursor.connection._prepared
+        for _ in range(2):
+            self.statements.execute(cursor, "lookup", "SELECT 1")
+
+        (stats,) = self.statements.stats()
+        self.assertEqual(stats.executions, 2)
+        self.assertEqual((stats.prepares, stats.reuses), (0, 0))
+        cursor.execute.assert_called_with("SELECT 1", None, prepare=True)
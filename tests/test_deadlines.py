@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from app.deadlines import Deadline, blob_timeouts, current_deadline, run_until
+from app.exceptions import DeadlineExceededError
+
+
+class TestDeadline(unittest.TestCase):
+    def test_remaining_counts_down(self):
+        deadline = Deadline(10)
+        self.assertLessEqual(deadline.remaining(), 10)
+        self.assertGreater(deadline.remaining(), 9)
+        self.assertFalse(deadline.expired)
+        self.assertTrue(Deadline(0).expired)
+
+    def test_cancel_expires_and_runs_callbacks(self):
+        deadline = Deadline(10)
+        calls = []
+        deadline.on_cancel(lambda: calls.append(True))
+        deadline.cancel()
+        deadline.cancel()
+        self.assertTrue(deadline.expired)
+        self.assertEqual(calls, [True])
+
+    def test_statement_timeout_never_disables(self):
+        self.assertEqual(Deadline(2).statement_timeout(), "2000ms")
+        self.assertEqual(Deadline(0).statement_timeout(), "1ms")
+
+    def test_blob_timeouts_follow_current_deadline(self):
+        self.assertEqual(blob_timeouts(), {})
+        token = current_deadline.set(Deadline(5))
+        try:
+            timeouts = blob_timeouts()
+        finally:
+            current_deadline.reset(token)
+        self.assertLessEqual(timeouts["read_timeout"], 5)
+        self.assertEqual(timeouts["connection_timeout"], timeouts["read_timeout"])
+
+
+class TestRunUntil(unittest.IsolatedAsyncioTestCase):
+    async def test_returns_result(self):
+        self.assertEqual(await run_until(Deadline(5), sum, [1, 2]), 3)
+
+    async def test_raises_past_deadline(self):
+        with self.assertRaises(DeadlineExceededError):
+            await run_until(Deadline(0.05), time.sleep, 0.5)
+
+    async def test_raises_when_cancelled(self):
+        deadline = Deadline(5)
+        deadline.cancel()
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceededError):
+            await run_until(deadline, time.sleep, 0.5)
+        self.assertLess(time.monotonic() - start, 0.5)
@@ -0,0 +1,21 @@
+import unittest
+
+from app.etags import etag_matches, make_etag
+
+
+class TestETags(unittest.TestCase):
+    def test_make_etag_is_quoted_and_stable(self):
+        etag = make_etag("a", 1)
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(etag, make_etag("a", 1))
+        self.assertNotEqual(etag, make_etag("a", 2))
+
+    def test_etag_matches(self):
+        etag = make_etag("a")
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(f'"other", {etag}', etag))
+        self.assertTrue(etag_matches(f"W/{etag}", etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches('"other"', etag))
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches("", etag))
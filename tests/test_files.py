@@ -1,18 +1,38 @@
+import asyncio
+import json
 import unittest
 import uuid
 from unittest.mock import AsyncMock, MagicMock, patch
 
-from datastore.blob.azure_storage_api import GetBlobError, build_container_name
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from datastore.blob.azure_storage_api import build_blob_name
 from psycopg_pool import ConnectionPool
 
+from app.cache import TTLCache
 from app.controllers.files import (
     create_folder,
     delete_folder,
+    ensure_container,
+    guess_content_type,
+    picture_metadata,
+    provisioned_containers,
     read_file,
     read_folder,
     read_folders,
+    upload_files,
+)
+from app.db import RequestConnection
+from app.exceptions import (
+    FileNotFoundError,
+    FileNotModifiedError,
+    RangeNotSatisfiableError,
 )
-from app.exceptions import FileNotFoundError
 from app.models.files import Folder
 from datastore.db.queries.picture import PictureSetNotFoundError
 
@@ -119,183 +139,450 @@ class TestReadFolder(unittest.IsolatedAsyncioTestCase):
 
         self.assertIn(f"Folder {picture_set_id} not found", str(context.exception))
 
+    async def test_read_folder_uses_cache(self):
+        mock_cp = MagicMock(spec=ConnectionPool)
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cp.connection.return_value.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        user_id = uuid.uuid4()
+        picture_set_id = uuid.uuid4()
+        mock_cursor.fetchone.return_value = {"id": picture_set_id, "file_ids": []}
+        cache = TTLCache("folders")
+
+        first = await read_folder(mock_cp, user_id, picture_set_id, cache)
+        second = await read_folder(mock_cp, user_id, picture_set_id, cache)
+
+        self.assertIs(first, second)
+        mock_cp.connection.assert_called_once()
+        self.assertEqual(cache.hits, 1)
+
 
 class TestDeleteFolder(unittest.IsolatedAsyncioTestCase):
     @patch("app.controllers.files.delete_picture_set_permanently")
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
-    async def test_delete_folder_success(
-        self, mock_container_client, mock_delete_picture_set
-    ):
+    async def test_delete_folder_success(self, mock_delete_picture_set):
+        storage = MagicMock()
+        mock_container_client = storage.container
         mock_cp = MagicMock(spec=ConnectionPool)
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_cp.connection.return_value.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        mock_container_client.return_value = MagicMock()
         mock_delete_picture_set.return_value = None
 
-        connection_string = "fake_conn_str"
         user_id = uuid.uuid4()
         folder_id = uuid.uuid4()
 
-        folder = await delete_folder(mock_cp, connection_string, user_id, folder_id)
+        folder = await delete_folder(mock_cp, storage, user_id, folder_id)
 
         self.assertIsInstance(folder, Folder)
         self.assertEqual(folder.id, folder_id)
 
-        mock_container_client.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user_id))
-        )
+        mock_container_client.assert_called_once_with(user_id)
         mock_delete_picture_set.assert_called_once_with(
             mock_cursor, str(user_id), folder_id, mock_container_client.return_value
         )
 
     @patch("app.controllers.files.delete_picture_set_permanently")
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
-    async def test_delete_folder_not_found(
-        self, mock_container_client, mock_delete_picture_set
-    ):
+    async def test_delete_folder_invalidates_cache(self, *_):
+        mock_cp = MagicMock(spec=ConnectionPool)
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_cp.connection.return_value.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+
+        user_id = uuid.uuid4()
+        folder_id = uuid.uuid4()
+        cache = TTLCache("folders")
+        cache.set((user_id, folder_id), Folder(id=folder_id))
+
+        await delete_folder(mock_cp, MagicMock(), user_id, folder_id, cache)
+
+        self.assertIsNone(cache.get((user_id, folder_id)))
+
+    @patch("app.controllers.files.delete_picture_set_permanently")
+    async def test_delete_folder_not_found(self, mock_delete_picture_set):
+        storage = MagicMock()
+        mock_container_client = storage.container
         mock_cp = MagicMock(spec=ConnectionPool)
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
         mock_cp.connection.return_value.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        mock_container_client.return_value = MagicMock()
         mock_delete_picture_set.side_effect = PictureSetNotFoundError()
 
-        connection_string = "fake_conn_str"
         user_id = uuid.uuid4()
         folder_id = uuid.uuid4()
 
         with self.assertRaises(FileNotFoundError) as context:
-            await delete_folder(mock_cp, connection_string, user_id, folder_id)
+            await delete_folder(mock_cp, storage, user_id, folder_id)
 
         self.assertIn(f"Folder not found with ID: {folder_id}", str(context.exception))
 
-        mock_container_client.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user_id))
-        )
+        mock_container_client.assert_called_once_with(user_id)
         mock_delete_picture_set.assert_called_once_with(
             mock_cursor, str(user_id), folder_id, mock_container_client.return_value
         )
 
 
+class TestEnsureContainer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        provisioned_containers.clear()
+
+    async def test_creates_missing_container_once(self):
+        container_client = MagicMock(container_name="user-1")
+        container_client.create_container = AsyncMock()
+        await ensure_container(container_client)
+        await ensure_container(container_client)
+        container_client.create_container.assert_called_once()
+
+    async def test_existing_container(self):
+        container_client = MagicMock(container_name="user-2")
+        container_client.create_container = AsyncMock(side_effect=ResourceExistsError)
+        await ensure_container(container_client)
+        await ensure_container(container_client)
+        container_client.create_container.assert_called_once()
+
+
+class TestGuessContentType(unittest.TestCase):
+    def test_guess_content_type(self):
+        png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+        self.assertEqual(guess_content_type(png), "image/png")
+        self.assertEqual(guess_content_type(b"unknown"), "application/octet-stream")
+
+
+class TestUploadFiles(unittest.IsolatedAsyncioTestCase):
+    async def test_uploads_concurrently_within_limit(self):
+        container_client = MagicMock()
+        running = peak = 0
+
+        async def upload_blob(*args, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        container_client.upload_blob = upload_blob
+        folder_id = uuid.uuid4()
+        png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+        files = [png, b"a", b"b", b"c", b"d"]
+
+        await upload_files(
+            container_client, folder_id, [uuid.uuid4() for _ in files], files, 2
+        )
+
+        self.assertEqual(peak, 2)
+
+    async def test_partial_failure_deletes_uploaded_files(self):
+        container_client = MagicMock()
+        container_client.upload_blob = AsyncMock(
+            side_effect=[None, RuntimeError("unavailable"), None]
+        )
+        container_client.delete_blob = AsyncMock()
+        folder_id = uuid.uuid4()
+        file_ids = [uuid.uuid4() for _ in range(3)]
+
+        with self.assertRaises(RuntimeError):
+            await upload_files(
+                container_client, folder_id, file_ids, [b"a", b"b", b"c"]
+            )
+
+        deleted = [call.args[0] for call in container_client.delete_blob.call_args_list]
+        self.assertEqual(
+            deleted,
+            [
+                build_blob_name(str(folder_id), str(file_ids[0])),
+                build_blob_name(str(folder_id), str(file_ids[2])),
+            ],
+        )
+
+    async def test_cancellation_deletes_started_files(self):
+        container_client = MagicMock()
+
+        async def upload_blob(*args, **kwargs):
+            await asyncio.Event().wait()
+
+        container_client.upload_blob = upload_blob
+        container_client.delete_blob = AsyncMock()
+        folder_id = uuid.uuid4()
+        file_ids = [uuid.uuid4() for _ in range(3)]
+
+        task = asyncio.create_task(
+            upload_files(container_client, folder_id, file_ids, [b"a"] * 3, 2)
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        deleted = [call.args[0] for call in container_client.delete_blob.call_args_list]
+        self.assertEqual(
+            deleted,
+            [build_blob_name(str(folder_id), str(file_id)) for file_id in file_ids[:2]],
+        )
+
+
 class TestCreateFolder(unittest.IsolatedAsyncioTestCase):
-    @patch("app.controllers.files.upload_pictures", new_callable=AsyncMock)
+    def setUp(self):
+        self.storage = MagicMock()
+        self.cp = MagicMock(spec=ConnectionPool)
+        self.conn = MagicMock()
+        self.cursor = MagicMock()
+        self.cp.connection.return_value.__enter__.return_value = self.conn
+        self.conn.cursor.return_value.__enter__.return_value = self.cursor
+
+    @patch("app.controllers.files.ensure_container", new_callable=AsyncMock)
+    @patch("app.controllers.files.upload_files", new_callable=AsyncMock)
     @patch("app.controllers.files.create_picture_set", new_callable=AsyncMock)
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
     async def test_create_folder_success(
-        self, mock_container_client, mock_create_picture_set, mock_upload_pictures
+        self, mock_create_picture_set, mock_upload_files, mock_ensure_container
     ):
-        mock_cp = MagicMock(spec=ConnectionPool)
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_cp.connection.return_value.__enter__.return_value = mock_conn
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-
-        mock_container_client.return_value = MagicMock()
+        # The datastore's picture set name query runs for real on the cursor.
         picture_set_id = uuid.uuid4()
-        picture_ids = [uuid.uuid4(), uuid.uuid4()]
         mock_create_picture_set.return_value = picture_set_id
-        mock_upload_pictures.return_value = picture_ids
+        self.cursor.fetchone.return_value = ("Labels",)
+        # The rows are only inserted once every file is stored.
+        mock_upload_files.side_effect = (
+            lambda *args: self.cursor.executemany.assert_not_called()
+        )
 
-        connection_string = "fake_conn_str"
         user_id = uuid.uuid4()
         label_images = [b"image1", b"image2"]
 
-        result = await create_folder(mock_cp, connection_string, user_id, label_images)
+        result = await create_folder(self.cp, self.storage, user_id, label_images)
 
         self.assertIsInstance(result, Folder)
         self.assertEqual(result.id, picture_set_id)
-        self.assertEqual(result.file_ids, picture_ids)
+        self.assertEqual(len(result.file_ids), len(label_images))
         self.assertIsNone(result.metadata)
         self.assertIsNone(result.owner_id)
         self.assertIsNone(result.upload_date)
         self.assertIsNone(result.name)
 
-        mock_container_client.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user_id))
-        )
+        async_container_client = self.storage.async_container.return_value
+        self.storage.container.assert_called_once_with(user_id)
+        mock_ensure_container.assert_called_once_with(async_container_client)
         mock_create_picture_set.assert_called_once_with(
-            mock_cursor, mock_container_client.return_value, len(label_images), user_id
+            self.cursor, self.storage.container.return_value, len(label_images), user_id
         )
-        mock_upload_pictures.assert_called_once_with(
-            mock_cursor,
-            str(user_id),
-            label_images,
-            mock_container_client.return_value,
-            str(picture_set_id),
+        mock_upload_files.assert_called_once_with(
+            async_container_client, picture_set_id, result.file_ids, label_images, 4
+        )
+        self.cursor.executemany.assert_called_once()
+        self.assertEqual(
+            self.cursor.executemany.call_args.args[1],
+            [
+                (
+                    picture_id,
+                    json.dumps(picture_metadata("Labels", picture_id)),
+                    picture_set_id,
+                )
+                for picture_id in result.file_ids
+            ],
         )
+        self.assertEqual(self.conn.commit.call_count, 2)
 
-    @patch("app.controllers.files.upload_pictures", new_callable=AsyncMock)
+    @patch("app.controllers.files.picture")
+    @patch("app.controllers.files.ensure_container", new_callable=AsyncMock)
+    @patch("app.controllers.files.upload_files", new_callable=AsyncMock)
     @patch("app.controllers.files.create_picture_set", new_callable=AsyncMock)
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
     async def test_create_folder_invalid_user_id(
-        self, mock_container_client, mock_create_picture_set, mock_upload_pictures
+        self, mock_create_picture_set, mock_upload_files, _, __
     ):
-        mock_cp = MagicMock(spec=ConnectionPool)
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_cp.connection.return_value.__enter__.return_value = mock_conn
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-
-        mock_container_client.return_value = MagicMock()
         picture_set_id = uuid.uuid4()
-        picture_ids = [uuid.uuid4(), uuid.uuid4()]
         mock_create_picture_set.return_value = picture_set_id
-        mock_upload_pictures.return_value = picture_ids
 
-        connection_string = "fake_conn_str"
         user_id = str(uuid.uuid4())
         label_images = [b"image1", b"image2"]
 
-        result = await create_folder(mock_cp, connection_string, user_id, label_images)
+        result = await create_folder(self.cp, self.storage, user_id, label_images)
 
         self.assertIsInstance(result, Folder)
         self.assertEqual(result.id, picture_set_id)
-        self.assertEqual(result.file_ids, picture_ids)
 
-        mock_container_client.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user_id))
-        )
+        self.storage.container.assert_called_once_with(uuid.UUID(user_id))
         mock_create_picture_set.assert_called_once()
-        mock_upload_pictures.assert_called_once()
+        mock_upload_files.assert_called_once()
+
+    @patch("app.controllers.files.picture")
+    @patch("app.controllers.files.ensure_container", new_callable=AsyncMock)
+    @patch("app.controllers.files.upload_files", new_callable=AsyncMock)
+    @patch("app.controllers.files.create_picture_set", new_callable=AsyncMock)
+    async def test_connection_is_released_during_uploads(
+        self, mock_create_picture_set, mock_upload_files, _, __
+    ):
+        cp = MagicMock(spec=RequestConnection)
+        cp.connection.return_value.__enter__.return_value = self.conn
+        mock_create_picture_set.return_value = uuid.uuid4()
+        mock_upload_files.side_effect = lambda *args: cp.release.assert_called_once()
+
+        await create_folder(cp, self.storage, uuid.uuid4(), [b"image1"])
+
+        mock_upload_files.assert_called_once()
+
+    @patch(
+        "app.controllers.files.delete_picture_set_permanently", new_callable=AsyncMock
+    )
+    @patch("app.controllers.files.picture")
+    @patch("app.controllers.files.ensure_container", new_callable=AsyncMock)
+    @patch("app.controllers.files.upload_files", new_callable=AsyncMock)
+    @patch("app.controllers.files.create_picture_set", new_callable=AsyncMock)
+    async def test_failed_upload_discards_picture_set(
+        self,
+        mock_create_picture_set,
+        mock_upload_files,
+        _,
+        __,
+        mock_delete_picture_set,
+    ):
+        user_id = uuid.uuid4()
+        picture_set_id = uuid.uuid4()
+        mock_create_picture_set.return_value = picture_set_id
+        mock_upload_files.side_effect = RuntimeError("unavailable")
+        self.storage.async_container.return_value.delete_blob = AsyncMock()
+
+        with self.assertRaises(RuntimeError):
+            await create_folder(self.cp, self.storage, user_id, [b"image1"])
+
+        self.cursor.executemany.assert_not_called()
+        mock_delete_picture_set.assert_awaited_once_with(
+            self.cursor,
+            str(user_id),
+            picture_set_id,
+            self.storage.container.return_value,
+        )
+
+    @patch(
+        "app.controllers.files.delete_picture_set_permanently", new_callable=AsyncMock
+    )
+    @patch("app.controllers.files.delete_files", new_callable=AsyncMock)
+    @patch("app.controllers.files.picture")
+    @patch("app.controllers.files.ensure_container", new_callable=AsyncMock)
+    @patch("app.controllers.files.upload_files", new_callable=AsyncMock)
+    @patch("app.controllers.files.create_picture_set", new_callable=AsyncMock)
+    async def test_failed_commit_deletes_uploaded_files(
+        self,
+        mock_create_picture_set,
+        _,
+        __,
+        ___,
+        mock_delete_files,
+        mock_delete_picture_set,
+    ):
+        picture_set_id = uuid.uuid4()
+        mock_create_picture_set.return_value = picture_set_id
+
+        for error in (RuntimeError("connection lost"), asyncio.CancelledError()):
+            mock_delete_files.reset_mock()
+            mock_delete_picture_set.reset_mock()
+            # The picture set commits; the pictures don't.
+            self.conn.commit.side_effect = [None, error, None]
+            with self.assertRaises(type(error)):
+                await create_folder(self.cp, self.storage, uuid.uuid4(), [b"image1"])
+            rows = self.cursor.executemany.call_args.args[1]
+            mock_delete_files.assert_called_once_with(
+                self.storage.async_container.return_value,
+                picture_set_id,
+                [rows[0][0]],
+            )
+            mock_delete_picture_set.assert_awaited_once()
 
 
 class TestReadFile(unittest.IsolatedAsyncioTestCase):
-    @patch("app.controllers.files.get_blob", new_callable=AsyncMock)
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
-    async def test_valid_file_returns_blob(self, mock_container_client, mock_get_blob):
-        expected_blob = b"sample binary data"
-        mock_get_blob.return_value = expected_blob
+    async def test_valid_file_returns_download(self):
+        storage = MagicMock()
+        mock_container_client = storage.async_container
+        mock_container_client.return_value.download_blob = AsyncMock()
+        container_client_instance = mock_container_client.return_value
+        user_id = uuid.uuid4()
+        folder_id = uuid.uuid4()
+        file_id = uuid.uuid4()
+        download = await read_file(storage, user_id, folder_id, file_id)
+        self.assertEqual(download, container_client_instance.download_blob.return_value)
+        mock_container_client.assert_called_once_with(user_id)
+        container_client_instance.download_blob.assert_called_once_with(
+            build_blob_name(str(folder_id), str(file_id)), offset=None, length=None
+        )
+
+    async def test_conditional_range_download(self):
+        storage = MagicMock()
+        mock_container_client = storage.async_container
+        mock_container_client.return_value.download_blob = AsyncMock()
         container_client_instance = mock_container_client.return_value
-        connection_string = "fake_conn_str"
         user_id = uuid.uuid4()
         folder_id = uuid.uuid4()
         file_id = uuid.uuid4()
-        blob = await read_file(connection_string, user_id, folder_id, file_id)
-        self.assertEqual(blob, expected_blob)
-        mock_container_client.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user_id))
+        await read_file(
+            storage,
+            user_id,
+            folder_id,
+            file_id,
+            offset=10,
+            length=5,
+            if_none_match='W/"0x8DC"',
         )
-        mock_get_blob.assert_called_once_with(
-            container_client_instance, f"{folder_id}/{file_id}"
+        container_client_instance.download_blob.assert_called_once_with(
+            build_blob_name(str(folder_id), str(file_id)),
+            offset=10,
+            length=5,
+            etag='"0x8DC"',
+            match_condition=MatchConditions.IfModified,
         )
 
-    @patch("app.controllers.files.get_blob", new_callable=AsyncMock)
-    @patch("app.controllers.files.ContainerClient.from_connection_string")
-    async def test_file_not_found_raises_error(
-        self, mock_container_client, mock_get_blob
-    ):
-        mock_get_blob.side_effect = GetBlobError("The specified blob does not exist.")
-        connection_string = "fake_conn_str"
+    async def test_compares_every_etag(self):
+        storage = MagicMock()
+        container_client = storage.async_container.return_value
+        container_client.download_blob = AsyncMock()
+        get_properties = container_client.get_blob_client.return_value
+        get_properties.get_blob_properties = AsyncMock(
+            return_value=MagicMock(etag='"0x8DC"')
+        )
+        args = (storage, uuid.uuid4(), uuid.uuid4(), uuid.uuid4())
+
+        with self.assertRaises(FileNotModifiedError) as raised:
+            await read_file(*args, if_none_match='"a", W/"0x8DC"')
+        self.assertEqual(raised.exception.etag, '"0x8DC"')
+        container_client.download_blob.assert_not_called()
+
+        await read_file(*args, if_none_match='"a", "b"')
+        self.assertNotIn("etag", container_client.download_blob.call_args.kwargs)
+
+    async def test_not_modified_and_unsatisfiable_range(self):
+        storage = MagicMock()
+        mock_container_client = storage.async_container
+        mock_container_client.return_value.download_blob = AsyncMock()
+        download_blob = mock_container_client.return_value.download_blob
+        args = (storage, uuid.uuid4(), uuid.uuid4(), uuid.uuid4())
+
+        download_blob.side_effect = ResourceNotModifiedError()
+        with self.assertRaises(FileNotModifiedError):
+            await read_file(*args, if_none_match="*")
+        self.assertEqual(
+            download_blob.call_args.kwargs["match_condition"],
+            MatchConditions.IfMissing,
+        )
+
+        download_blob.side_effect = HttpResponseError()
+        download_blob.side_effect.status_code = 416
+        with self.assertRaises(RangeNotSatisfiableError):
+            await read_file(*args, offset=1000)
+
+    async def test_file_not_found_raises_error(self):
+        storage = MagicMock()
+        mock_container_client = storage.async_container
+        mock_container_client.return_value.download_blob = AsyncMock()
+        mock_container_client.return_value.download_blob.side_effect = (
+            ResourceNotFoundError("The specified blob does not exist.")
+        )
         user_id = uuid.uuid4()
         folder_id = uuid.uuid4()
         file_id = uuid.uuid4()
         with self.assertRaises(FileNotFoundError) as context:
-            await read_file(connection_string, user_id, folder_id, file_id)
+            await read_file(storage, user_id, folder_id, file_id)
         self.assertIn(
             f"File {file_id} not found in folder {folder_id}", str(context.exception)
         )
@@ -1,21 +1,38 @@
 import json
+import os
 import unittest
 import uuid
 from datetime import datetime
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from datastore.blob.azure_storage_api import build_container_name
+import psycopg
+from datastore.blob.azure_storage_api import build_blob_name
 from fertiscan.db.queries.inspection import (
     InspectionNotFoundError as DBInspectionNotFoundError,
 )
+from pydantic import ValidationError
 
+from app.cache import TTLCache
+from app.config import Settings
 from app.controllers.inspections import (
+    INSPECTION_COLUMNS,
+    LABEL_COLUMNS,
     create_inspection,
+    apply_merge_patch,
     delete_inspection,
+    delete_inspections,
+    export_inspections,
+    import_inspections,
+    merge_patch_paths,
+    patch_inspection,
     read_all_inspections,
     read_inspection,
+    read_inspection_etag,
+    read_inspections,
     update_inspection,
+    verify_inspections,
 )
+from app.etags import make_etag
 from app.exceptions import InspectionNotFoundError, MissingUserAttributeError
 from app.models.inspections import (
     DeletedInspection,
@@ -180,13 +197,16 @@ class TestRead(unittest.IsolatedAsyncioTestCase):
         }
 
         mock_get_full_inspection_json.return_value = json.dumps(sample_inspection)
+        updated_at = datetime(2024, 1, 1)
+        cursor_mock.fetchone.return_value = (updated_at,)
 
-        inspection = await read_inspection(cp, user, inspection_id)
+        etag, inspection = await read_inspection(cp, user, inspection_id)
 
         mock_get_full_inspection_json.assert_called_once_with(
             cursor_mock, inspection_id, user.id
         )
         self.assertIsInstance(inspection, InspectionResponse)
+        self.assertEqual(etag, make_etag(inspection_id, updated_at))
 
     @patch("app.controllers.inspections.get_full_inspection_json")
     async def test_inspection_not_found_raises_error(
@@ -409,20 +429,16 @@ class TestDeleteFunction(unittest.IsolatedAsyncioTestCase):
         cp = MagicMock()
         user = User(id=None)
         inspection_id = uuid.uuid4()
-        connection_string = "fake_conn_str"
-
         with self.assertRaises(MissingUserAttributeError):
-            await delete_inspection(cp, user, inspection_id, connection_string)
+            await delete_inspection(cp, user, inspection_id, MagicMock())
 
     async def test_missing_inspection_id_raises_error(self):
         cp = MagicMock()
         user = User(id=uuid.uuid4())
-        connection_string = "fake_conn_str"
-
         with self.assertRaises(ValueError):
-            await delete_inspection(cp, user, None, connection_string)
+            await delete_inspection(cp, user, None, MagicMock())
 
-    async def test_missing_connection_string_raises_error(self):
+    async def test_missing_storage_raises_error(self):
         cp = MagicMock()
         user = User(id=uuid.uuid4())
         inspection_id = uuid.uuid4()
@@ -434,16 +450,11 @@ class TestDeleteFunction(unittest.IsolatedAsyncioTestCase):
         cp = MagicMock()
         user = User(id=uuid.uuid4())
         invalid_id = "not-a-uuid"
-        connection_string = "fake_conn_str"
-
         with self.assertRaises(ValueError):
-            await delete_inspection(cp, user, invalid_id, connection_string)
+            await delete_inspection(cp, user, invalid_id, MagicMock())
 
     @patch("app.controllers.inspections.db_delete_inspection")
-    @patch("app.controllers.inspections.ContainerClient")
-    async def test_delete_inspection_success(
-        self, mock_container_client, mock_db_delete_inspection
-    ):
+    async def test_delete_inspection_success(self, mock_db_delete_inspection):
         cp = MagicMock()
         conn_mock = MagicMock()
         cursor_mock = MagicMock()
@@ -452,7 +463,7 @@ class TestDeleteFunction(unittest.IsolatedAsyncioTestCase):
 
         user = User(id=uuid.uuid4())
         inspection_id = uuid.uuid4()
-        connection_string = "fake_conn_str"
+        storage = MagicMock()
 
         mock_deleted_inspection_data = {
             "id": inspection_id,
@@ -462,20 +473,737 @@ class TestDeleteFunction(unittest.IsolatedAsyncioTestCase):
             **mock_deleted_inspection_data
         )
 
-        container_client_instance = (
-            mock_container_client.from_connection_string.return_value
-        )
+        container_client_instance = storage.container.return_value
 
-        deleted_inspection = await delete_inspection(
-            cp, user, inspection_id, connection_string
-        )
+        deleted_inspection = await delete_inspection(cp, user, inspection_id, storage)
 
-        mock_container_client.from_connection_string.assert_called_once_with(
-            connection_string, container_name=build_container_name(str(user.id))
-        )
+        storage.container.assert_called_once_with(user.id)
         mock_db_delete_inspection.assert_called_once_with(
             cursor_mock, inspection_id, user.id, container_client_instance
         )
         self.assertIsInstance(deleted_inspection, DeletedInspection)
         self.assertEqual(deleted_inspection.id, inspection_id)
         self.assertTrue(deleted_inspection.deleted)
+
+
+class TestInspectionCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.cursor_mock = MagicMock()
+        conn_mock = MagicMock()
+        conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = conn_mock
+        self.cache = TTLCache("inspections")
+        self.user = User(id=uuid.uuid4())
+        self.inspection_id = uuid.uuid4()
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_cache_hit_skips_database(self, mock_get_full_inspection_json):
+        cached = MagicMock()
+        self.cache.set((self.user.id, self.inspection_id), ('"v1"', cached))
+
+        etag, inspection = await read_inspection(
+            self.cp, self.user, self.inspection_id, self.cache
+        )
+
+        self.assertEqual(etag, '"v1"')
+        self.assertIs(inspection, cached)
+        self.cp.connection.assert_not_called()
+        mock_get_full_inspection_json.assert_not_called()
+
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_cache_miss_populates_cache(
+        self, mock_get_full_inspection_json, mock_inspection_response
+    ):
+        validated = mock_inspection_response.model_validate_json.return_value
+
+        await read_inspection(self.cp, self.user, self.inspection_id, self.cache)
+        _, inspection = await read_inspection(
+            self.cp, self.user, self.inspection_id, self.cache
+        )
+
+        self.assertIs(inspection, validated)
+        mock_get_full_inspection_json.assert_called_once_with(
+            self.cursor_mock, self.inspection_id, self.user.id
+        )
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    async def test_etag_cache_hit_skips_database(self):
+        self.cache.set((self.user.id, self.inspection_id), ('"v1"', MagicMock()))
+
+        etag = await read_inspection_etag(
+            self.cp, self.user, self.inspection_id, self.cache
+        )
+
+        self.assertEqual(etag, '"v1"')
+        self.cp.connection.assert_not_called()
+
+    async def test_etag_cache_miss_reads_version(self):
+        updated_at = datetime(2024, 1, 1)
+        self.cursor_mock.fetchone.return_value = (updated_at,)
+
+        etag = await read_inspection_etag(
+            self.cp, self.user, self.inspection_id, self.cache
+        )
+
+        self.assertEqual(etag, make_etag(self.inspection_id, updated_at))
+        self.cursor_mock.execute.assert_called_once()
+
+    async def test_etag_not_found(self):
+        self.cursor_mock.fetchone.return_value = None
+
+        with self.assertRaises(InspectionNotFoundError):
+            await read_inspection_etag(self.cp, self.user, self.inspection_id)
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_cache_is_keyed_by_user(self, mock_get_full_inspection_json):
+        self.cache.set((uuid.uuid4(), self.inspection_id), ('"v1"', MagicMock()))
+        mock_get_full_inspection_json.side_effect = DBInspectionNotFoundError()
+
+        with self.assertRaises(InspectionNotFoundError):
+            await read_inspection(self.cp, self.user, self.inspection_id, self.cache)
+
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.db_update_inspection")
+    async def test_update_invalidates_cache(self, *_):
+        self.cache.set((self.user.id, self.inspection_id), MagicMock())
+
+        await update_inspection(
+            self.cp, self.user, self.inspection_id, MagicMock(), self.cache
+        )
+
+        self.assertIsNone(self.cache.get((self.user.id, self.inspection_id)))
+
+    @patch("app.controllers.inspections.db_delete_inspection")
+    async def test_delete_invalidates_cache(self, mock_db_delete_inspection):
+        self.cache.set((self.user.id, self.inspection_id), MagicMock())
+        mock_db_delete_inspection.return_value = DeletedInspection(
+            id=self.inspection_id
+        )
+
+        await delete_inspection(
+            self.cp, self.user, self.inspection_id, MagicMock(), self.cache
+        )
+
+        self.assertIsNone(self.cache.get((self.user.id, self.inspection_id)))
+
+    @patch("app.controllers.inspections.db_delete_inspection")
+    async def test_delete_invalidates_folder(self, mock_db_delete_inspection):
+        folder_cache = TTLCache("folders")
+        picture_set_id = uuid.uuid4()
+        folder_cache.set((self.user.id, picture_set_id), MagicMock())
+        self.cursor_mock.fetchone.return_value = (picture_set_id,)
+        mock_db_delete_inspection.return_value = DeletedInspection(
+            id=self.inspection_id
+        )
+
+        await delete_inspection(
+            self.cp, self.user, self.inspection_id, MagicMock(), None, folder_cache
+        )
+
+        self.assertIsNone(folder_cache.get((self.user.id, picture_set_id)))
+
+
+class TestReadInspections(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.cursor_mock = MagicMock()
+        conn_mock = MagicMock()
+        conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = conn_mock
+        self.cache = TTLCache("inspections")
+        self.user = User(id=uuid.uuid4())
+        self.ids = [uuid.uuid4() for _ in range(3)]
+
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_reads_owned_inspections_on_one_connection(
+        self, mock_get_full_inspection_json, mock_inspection_response
+    ):
+        owned = self.ids[:2]
+        self.cursor_mock.fetchall.return_value = [
+            (id, datetime(2024, 1, 1)) for id in owned
+        ]
+
+        inspections, not_found = await read_inspections(
+            self.cp, self.user, [*self.ids, self.ids[0]], self.cache
+        )
+
+        self.cp.connection.assert_called_once()
+        self.cursor_mock.execute.assert_called_once()
+        self.assertEqual(self.cursor_mock.execute.call_args.args[1][0], self.ids)
+        self.assertEqual(mock_get_full_inspection_json.call_count, 2)
+        self.assertEqual(len(inspections), 2)
+        self.assertEqual(not_found, [self.ids[2]])
+        self.assertIsNotNone(self.cache.get((self.user.id, owned[0])))
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_cached_inspections_skip_database(
+        self, mock_get_full_inspection_json
+    ):
+        cached = [MagicMock() for _ in self.ids]
+        for id, inspection in zip(self.ids, cached):
+            self.cache.set((self.user.id, id), ('"v1"', inspection))
+
+        inspections, not_found = await read_inspections(
+            self.cp, self.user, self.ids, self.cache
+        )
+
+        self.assertEqual(inspections, cached)
+        self.assertEqual(not_found, [])
+        self.cp.connection.assert_not_called()
+        mock_get_full_inspection_json.assert_not_called()
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_inspection_deleted_after_check_is_not_found(
+        self, mock_get_full_inspection_json
+    ):
+        self.cursor_mock.fetchall.return_value = [(self.ids[0], datetime.now())]
+        mock_get_full_inspection_json.side_effect = DBInspectionNotFoundError()
+
+        inspections, not_found = await read_inspections(
+            self.cp, self.user, self.ids[:1]
+        )
+
+        self.assertEqual(inspections, [])
+        self.assertEqual(not_found, self.ids[:1])
+
+    async def test_missing_user_id(self):
+        with self.assertRaises(MissingUserAttributeError):
+            await read_inspections(self.cp, User(), self.ids)
+
+
+class TestBulkOperations(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.conn_mock = MagicMock()
+        self.cursor_mock = MagicMock()
+        self.conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.conn_mock.transaction.return_value.__exit__.return_value = False
+        self.cp.connection.return_value.__enter__.return_value = self.conn_mock
+        self.cache = TTLCache("inspections")
+        self.user = User(id=uuid.uuid4())
+        self.ids = [uuid.uuid4() for _ in range(3)]
+
+    @patch("app.controllers.inspections.InspectionUpdate")
+    @patch("app.controllers.inspections.db_update_inspection")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_verify_goes_through_the_datastore_update(
+        self,
+        mock_get_full_inspection_json,
+        mock_db_update_inspection,
+        mock_inspection_update,
+    ):
+        mock_get_full_inspection_json.side_effect = [
+            json.dumps({"verified": False}),
+            DBInspectionNotFoundError(),
+            json.dumps({"verified": False}),
+        ]
+        mock_db_update_inspection.side_effect = [None, RuntimeError("constraint")]
+        self.cache.set((self.user.id, self.ids[0]), MagicMock())
+
+        results = await verify_inspections(
+            self.cp, self.user, self.ids, True, self.cache
+        )
+
+        self.assertEqual(
+            [r.status for r in results], ["updated", "not_found", "failed"]
+        )
+        self.assertEqual(self.conn_mock.transaction.call_count, 3)
+        mock_inspection_update.model_validate.assert_called_with({"verified": True})
+        update = mock_inspection_update.model_validate.return_value
+        self.assertEqual(
+            mock_db_update_inspection.call_args_list[0].args[1:],
+            (self.ids[0], self.user.id, update.model_dump.return_value),
+        )
+        self.assertIsNone(self.cache.get((self.user.id, self.ids[0])))
+        self.conn_mock.commit.assert_called_once()
+
+    @patch("app.controllers.inspections.delete_blobs", new_callable=AsyncMock)
+    @patch("app.controllers.inspections.delete_inspection_rows")
+    async def test_delete_reports_each_id(self, mock_delete_rows, _):
+        mock_delete_rows.side_effect = [
+            {"id": str(self.ids[0])},
+            DBInspectionNotFoundError(),
+            RuntimeError("constraint"),
+        ]
+
+        results = await delete_inspections(
+            self.cp, self.user, self.ids, MagicMock(), self.cache
+        )
+
+        self.assertEqual(self.conn_mock.transaction.call_count, 3)
+        self.assertEqual(
+            [r.status for r in results], ["deleted", "not_found", "failed"]
+        )
+        self.assertEqual(results[2].detail, "constraint")
+
+    @patch("app.controllers.inspections.delete_blobs", new_callable=AsyncMock)
+    @patch("app.controllers.inspections.delete_inspection_rows")
+    async def test_delete_removes_pictures_after_commit(self, _, mock_delete_blobs):
+        storage = MagicMock()
+        removed, kept = uuid.uuid4(), uuid.uuid4()
+        pictures = [
+            (removed, uuid.uuid4()),
+            (removed, uuid.uuid4()),
+            (kept, uuid.uuid4()),
+        ]
+        self.cursor_mock.fetchall.side_effect = [pictures, [(kept,)]]
+        mock_delete_blobs.side_effect = (
+            lambda *args: self.conn_mock.commit.assert_called_once()
+        )
+        folder_cache = TTLCache("folders")
+        folder_cache.set((self.user.id, removed), MagicMock())
+        folder_cache.set((self.user.id, kept), MagicMock())
+
+        await delete_inspections(
+            self.cp, self.user, self.ids, storage, None, folder_cache
+        )
+
+        mock_delete_blobs.assert_awaited_once_with(
+            storage.async_container.return_value,
+            [build_blob_name(str(ps), str(p)) for ps, p in pictures[:2]],
+        )
+        storage.async_container.assert_called_once_with(self.user.id)
+        self.assertIsNone(folder_cache.get((self.user.id, removed)))
+        self.assertIsNotNone(folder_cache.get((self.user.id, kept)))
+
+    async def test_delete_requires_storage(self):
+        with self.assertRaises(ValueError):
+            await delete_inspections(self.cp, self.user, self.ids, None)
+
+
+class TestInspectionSnapshots(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.cursor_mock = MagicMock()
+        conn_mock = MagicMock()
+        conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = conn_mock
+        self.cache = TTLCache("inspections")
+        self.user = User(id=uuid.uuid4())
+        self.inspection_id = uuid.uuid4()
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    @patch("app.controllers.inspections.read_snapshots")
+    async def test_read_uses_snapshot(
+        self, mock_read_snapshots, mock_get_full_inspection_json
+    ):
+        snapshot = MagicMock()
+        mock_read_snapshots.return_value = {self.inspection_id: ('"v1"', snapshot)}
+
+        etag, inspection = await read_inspection(
+            self.cp, self.user, self.inspection_id, self.cache, True
+        )
+
+        self.assertEqual(etag, '"v1"')
+        self.assertIs(inspection, snapshot)
+        mock_get_full_inspection_json.assert_not_called()
+        self.assertEqual(
+            self.cache.get((self.user.id, self.inspection_id)), ('"v1"', snapshot)
+        )
+
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    @patch("app.controllers.inspections.read_snapshots", return_value={})
+    async def test_read_falls_back_without_snapshot(
+        self, _, mock_get_full_inspection_json, mock_inspection_response
+    ):
+        _, inspection = await read_inspection(
+            self.cp, self.user, self.inspection_id, None, True
+        )
+
+        mock_get_full_inspection_json.assert_called_once()
+        self.assertIs(
+            inspection, mock_inspection_response.model_validate_json.return_value
+        )
+
+    @patch("app.controllers.inspections.refresh_snapshot")
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.db_update_inspection")
+    async def test_update_refreshes_snapshot(self, _, __, mock_refresh_snapshot):
+        await update_inspection(
+            self.cp, self.user, self.inspection_id, MagicMock(), None, True
+        )
+
+        mock_refresh_snapshot.assert_called_once_with(
+            self.cursor_mock, self.user.id, self.inspection_id
+        )
+
+    @patch("app.controllers.inspections.refresh_snapshot")
+    @patch("app.controllers.inspections.InspectionResponse")
+    @patch("app.controllers.inspections.db_update_inspection")
+    async def test_update_without_snapshots(self, _, __, mock_refresh_snapshot):
+        await update_inspection(self.cp, self.user, self.inspection_id, MagicMock())
+
+        mock_refresh_snapshot.assert_not_called()
+
+    @patch("app.controllers.inspections.refresh_snapshot")
+    @patch("app.controllers.inspections.InspectionUpdate")
+    @patch("app.controllers.inspections.db_update_inspection")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_bulk_verify_refreshes_snapshots(
+        self, mock_get_full_inspection_json, _, __, mock_refresh_snapshot
+    ):
+        mock_get_full_inspection_json.return_value = json.dumps({"verified": True})
+
+        await verify_inspections(
+            self.cp, self.user, [self.inspection_id], False, None, True
+        )
+
+        mock_refresh_snapshot.assert_called_once_with(
+            self.cursor_mock, self.user.id, self.inspection_id
+        )
+
+
+class TestMergePatch(unittest.TestCase):
+    def test_apply_merge_patch(self):
+        target = {"a": 1, "b": {"c": 2, "d": 3}, "e": [1, 2]}
+        patch = {"a": 5, "b": {"c": None, "f": 4}, "e": [3]}
+        self.assertEqual(
+            apply_merge_patch(target, patch),
+            {"a": 5, "b": {"d": 3, "f": 4}, "e": [3]},
+        )
+        self.assertEqual(target["b"], {"c": 2, "d": 3})
+
+    def test_merge_patch_paths(self):
+        patch = {"verified": True, "product": {"lot_number": "A1", "npk": None}}
+        self.assertEqual(
+            list(merge_patch_paths(patch)),
+            [("verified",), ("product", "lot_number"), ("product", "npk")],
+        )
+
+
+class TestPatchFunction(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.cursor_mock = MagicMock()
+        conn_mock = MagicMock()
+        conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = conn_mock
+        self.user = User(id=uuid.uuid4())
+        self.inspection_id = uuid.uuid4()
+        self.current = {
+            "inspection_id": str(self.inspection_id),
+            "inspection_comment": "string",
+            "verified": False,
+            "organizations": [],
+            "product": {
+                "name": "string",
+                "label_id": str(uuid.uuid4()),
+                "registration_numbers": [],
+                "lot_number": "old",
+                "metrics": {
+                    "weight": [],
+                    "volume": {"edited": False},
+                    "density": {"edited": False},
+                },
+                "npk": "10-10-10",
+                "warranty": "string",
+                "n": 0,
+                "p": 0,
+                "k": 0,
+            },
+            "cautions": {"en": [], "fr": []},
+            "instructions": {"en": [], "fr": []},
+            "guaranteed_analysis": {
+                "title": {"en": "string", "fr": "string"},
+                "is_minimal": False,
+                "en": [],
+                "fr": [],
+            },
+            "ingredients": {"en": [], "fr": []},
+            "picture_set_id": str(uuid.uuid4()),
+        }
+
+    async def test_missing_patch_raises_error(self):
+        with self.assertRaises(ValueError):
+            await patch_inspection(self.cp, self.user, self.inspection_id, {})
+
+    async def test_unknown_field_raises_error(self):
+        with self.assertRaises(ValueError):
+            await patch_inspection(
+                self.cp, self.user, self.inspection_id, {"unknown": 1}
+            )
+
+    @patch("app.controllers.inspections.db_update_inspection")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_column_patch_updates_rows_in_place(
+        self, mock_get_full_inspection_json, mock_db_update_inspection
+    ):
+        updated = {**self.current, "product": {**self.current["product"]}}
+        updated["product"]["lot_number"] = "new"
+        mock_get_full_inspection_json.side_effect = [
+            json.dumps(self.current),
+            json.dumps(updated),
+        ]
+        self.cursor_mock.fetchone.return_value = (uuid.uuid4(),)
+
+        inspection = await patch_inspection(
+            self.cp,
+            self.user,
+            self.inspection_id,
+            {"product": {"lot_number": "new"}},
+        )
+
+        mock_db_update_inspection.assert_not_called()
+        self.assertEqual(self.cursor_mock.execute.call_count, 2)
+        self.assertEqual(inspection.product.lot_number, "new")
+        self.assertEqual(inspection.product.npk, "10-10-10")
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_column_patch_uses_cached_document(
+        self, mock_get_full_inspection_json
+    ):
+        cache = TTLCache("inspections")
+        key = (self.user.id, self.inspection_id)
+        cache.set(key, ('"v1"', InspectionResponse.model_validate(self.current)))
+        self.cursor_mock.fetchone.return_value = (uuid.uuid4(),)
+        # Changed since it was cached: the response has to be read back.
+        updated = {**self.current, "verified": True, "inspection_comment": "new"}
+        mock_get_full_inspection_json.return_value = json.dumps(updated)
+
+        inspection = await patch_inspection(
+            self.cp, self.user, self.inspection_id, {"inspection_comment": "new"}, cache
+        )
+
+        mock_get_full_inspection_json.assert_called_once()
+        self.cursor_mock.execute.assert_called_once()
+        self.assertTrue(inspection.verified)
+        self.assertEqual(inspection.inspection_comment, "new")
+        self.assertIsNone(cache.get(key))
+
+    @patch("app.controllers.inspections.refresh_snapshot")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_column_patch_responds_with_refreshed_snapshot(
+        self, mock_get_full_inspection_json, mock_refresh_snapshot
+    ):
+        cache = TTLCache("inspections")
+        key = (self.user.id, self.inspection_id)
+        cache.set(key, ('"v1"', InspectionResponse.model_validate(self.current)))
+        self.cursor_mock.fetchone.return_value = (uuid.uuid4(),)
+        updated = {**self.current, "inspection_comment": "new"}
+        mock_refresh_snapshot.return_value = json.dumps(updated)
+
+        inspection = await patch_inspection(
+            self.cp,
+            self.user,
+            self.inspection_id,
+            {"inspection_comment": "new"},
+            cache,
+            True,
+        )
+
+        mock_get_full_inspection_json.assert_not_called()
+        self.assertEqual(inspection.inspection_comment, "new")
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_column_patch_inspection_not_found(
+        self, mock_get_full_inspection_json
+    ):
+        mock_get_full_inspection_json.return_value = json.dumps(self.current)
+        self.cursor_mock.fetchone.return_value = None
+
+        with self.assertRaises(InspectionNotFoundError):
+            await patch_inspection(
+                self.cp, self.user, self.inspection_id, {"inspection_comment": "new"}
+            )
+
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_invalid_patch_raises_validation_error(
+        self, mock_get_full_inspection_json
+    ):
+        mock_get_full_inspection_json.return_value = json.dumps(self.current)
+
+        with self.assertRaises(ValidationError):
+            await patch_inspection(
+                self.cp,
+                self.user,
+                self.inspection_id,
+                {"product": {"npk": "invalid"}},
+            )
+        self.cursor_mock.execute.assert_not_called()
+
+    @patch("app.controllers.inspections.db_update_inspection")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_structural_patch_falls_back_to_full_update(
+        self, mock_get_full_inspection_json, mock_db_update_inspection
+    ):
+        mock_get_full_inspection_json.return_value = json.dumps(self.current)
+        patch_data = {"organizations": [{"name": "Org"}]}
+        updated = {**self.current, **patch_data}
+        mock_db_update_inspection.return_value = InspectionResponse.model_validate(
+            updated
+        )
+
+        inspection = await patch_inspection(
+            self.cp, self.user, self.inspection_id, patch_data
+        )
+
+        mock_db_update_inspection.assert_called_once()
+        sent = mock_db_update_inspection.call_args.args[3]
+        self.assertEqual(sent["organizations"][0]["name"], "Org")
+        self.assertEqual(inspection.organizations[0].name, "Org")
+
+    @patch("app.controllers.inspections.db_update_inspection")
+    @patch("app.controllers.inspections.get_full_inspection_json")
+    async def test_verified_patch_goes_through_full_update(
+        self, mock_get_full_inspection_json, mock_db_update_inspection
+    ):
+        mock_get_full_inspection_json.return_value = json.dumps(self.current)
+        mock_db_update_inspection.return_value = InspectionResponse.model_validate(
+            {**self.current, "verified": True}
+        )
+
+        await patch_inspection(
+            self.cp, self.user, self.inspection_id, {"verified": True}
+        )
+
+        mock_db_update_inspection.assert_called_once()
+        self.assertTrue(mock_db_update_inspection.call_args.args[3]["verified"])
+        self.cursor_mock.execute.assert_not_called()
+
+
+class TestExportInspections(unittest.TestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.conn_mock = MagicMock()
+        self.cursor_mock = MagicMock()
+        self.conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = self.conn_mock
+        self.user_id = uuid.uuid4()
+        self.rows = [
+            {
+                "id": uuid.uuid4(),
+                "upload_date": datetime(2024, 1, 1),
+                "updated_at": None,
+                "verified": True,
+                "picture_set_id": uuid.uuid4(),
+                "label_info_id": uuid.uuid4(),
+                "product_name": "Product, A",
+                "lot_number": None,
+                "npk": "10-10-10",
+                "inspection_comment": None,
+            }
+        ]
+        self.cursor_mock.__iter__.return_value = iter(self.rows)
+
+    def test_ndjson_uses_server_side_cursor(self):
+        lines = list(export_inspections(self.cp, self.user_id, itersize=50))
+
+        cursor_kwargs = self.conn_mock.cursor.call_args.kwargs
+        self.assertEqual(cursor_kwargs["name"], "export_inspections")
+        self.assertEqual(self.cursor_mock.itersize, 50)
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row["id"], str(self.rows[0]["id"]))
+        self.assertEqual(row["upload_date"], "2024-01-01T00:00:00")
+
+    def test_csv_has_header_and_quoted_values(self):
+        lines = list(export_inspections(self.cp, self.user_id, "csv"))
+
+        self.assertTrue(lines[0].startswith("id,upload_date,"))
+        self.assertIn('"Product, A"', lines[1])
+        self.assertEqual(len(lines), 2)
+
+    def test_filters_and_resume_token(self):
+        after = uuid.uuid4()
+        since = datetime(2024, 1, 1)
+        list(
+            export_inspections(
+                self.cp, self.user_id, verified=False, since=since, after=after
+            )
+        )
+
+        params = self.cursor_mock.execute.call_args.args[1]
+        self.assertEqual(params, [self.user_id, False, since, after])
+
+
+class TestImportInspections(unittest.TestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.conn_mock = MagicMock()
+        self.conn_mock.cursor.return_value.__enter__.return_value = MagicMock()
+        self.conn_mock.transaction.return_value.__exit__.return_value = False
+        self.cp.connection.return_value.__enter__.return_value = self.conn_mock
+        self.user = User(id=uuid.uuid4())
+
+    def record(self) -> str:
+        return json.dumps({"picture_set_id": str(uuid.uuid4())})
+
+    @patch("app.controllers.inspections.build_inspection_import")
+    @patch("app.controllers.inspections.new_inspection_with_label_info")
+    def test_imports_in_chunks(self, mock_new_inspection, _):
+        lines = [self.record() for _ in range(5)]
+
+        progress = list(import_inspections(self.cp, self.user, lines, chunk_size=2))
+
+        self.assertEqual([p.processed for p in progress], [2, 4, 5])
+        self.assertEqual(progress[-1].imported, 5)
+        self.assertEqual(progress[-1].failed, 0)
+        self.assertEqual(mock_new_inspection.call_count, 5)
+        self.cp.connection.assert_called_once()
+        self.assertEqual(self.conn_mock.transaction.call_count, 3)
+
+    @patch("app.controllers.inspections.build_inspection_import")
+    @patch("app.controllers.inspections.new_inspection_with_label_info")
+    def test_invalid_records_are_reported_by_line(self, mock_new_inspection, _):
+        lines = [self.record(), "not json", "{}", "", self.record()]
+
+        (progress,) = import_inspections(self.cp, self.user, lines)
+
+        self.assertEqual(progress.imported, 2)
+        self.assertEqual(progress.failed, 2)
+        self.assertEqual([e.line for e in progress.errors], [2, 3])
+
+    @patch("app.controllers.inspections.build_inspection_import")
+    @patch("app.controllers.inspections.new_inspection_with_label_info")
+    def test_failed_chunk_is_replayed_record_by_record(self, mock_new_inspection, _):
+        calls = []
+
+        def new_inspection(*args):
+            calls.append(args)
+            # Fails on the second record, in the chunk and again on replay.
+            if len(calls) in (2, 4):
+                raise RuntimeError("duplicate")
+
+        mock_new_inspection.side_effect = new_inspection
+        lines = [self.record() for _ in range(3)]
+
+        (progress,) = import_inspections(self.cp, self.user, lines)
+
+        self.assertEqual(progress.imported, 2)
+        self.assertEqual(progress.failed, 1)
+        self.assertEqual(progress.errors[0].line, 2)
+        self.assertEqual(progress.errors[0].error, "duplicate")
+
+    def test_missing_user_id(self):
+        with self.assertRaises(MissingUserAttributeError):
+            list(import_inspections(self.cp, User(), [self.record()]))
+
+
+@unittest.skipUnless(os.getenv("DB_HOST"), "needs the application database")
+class TestColumnMapSchema(unittest.TestCase):
+    """The columns patches write in place exist in the database schema."""
+
+    def columns(self, conn, table: str) -> set[str]:
+        rows = conn.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+            """,
+            (table,),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def test_columns_exist(self):
+        with psycopg.connect(Settings().db_conn_info) as conn:
+            self.assertLessEqual(
+                set(INSPECTION_COLUMNS.values()) | {"updated_at", "label_info_id"},
+                self.columns(conn, "inspection"),
+            )
+            self.assertLessEqual(
+                set(LABEL_COLUMNS.values()), self.columns(conn, "label_information")
+            )
@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from psycopg import Cursor
+
+from app.instrumentation import (
+    Histogram,
+    InstrumentedCursor,
+    QueryMetrics,
+    current_operation,
+    labelled,
+    operation,
+)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe_fills_buckets(self):
+        histogram = Histogram(bounds=(10, 100))
+        for value in (1, 10, 50, 1000):
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot.buckets_ms, [10, 100])
+        self.assertEqual(snapshot.counts, [2, 1, 1])
+        self.assertEqual(snapshot.count, 4)
+        self.assertEqual(snapshot.total_ms, 1061)
+
+
+class TestOperationLabels(unittest.IsolatedAsyncioTestCase):
+    def test_operation_is_scoped_to_block(self):
+        with operation("outer"):
+            with operation("inner"):
+                self.assertEqual(current_operation.get(), "inner")
+            self.assertEqual(current_operation.get(), "outer")
+        self.assertEqual(current_operation.get(), "other")
+
+    async def test_labelled_coroutine(self):
+        @labelled("read_folders")
+        async def read_folders():
+            return current_operation.get()
+
+        self.assertEqual(await read_folders(), "read_folders")
+        self.assertEqual(current_operation.get(), "other")
+
+
+class TestQueryMetrics(unittest.TestCase):
+    def test_records_per_operation(self):
+        metrics = QueryMetrics()
+        metrics.observe_query("read_folders", 0.002, 3)
+        metrics.observe_query("read_folders", 0.004, 2)
+        metrics.observe_query("sign_in", 0.001, -1)
+
+        stats = {s.operation: s for s in metrics.stats()}
+        self.assertEqual(stats["read_folders"].latency.count, 2)
+        self.assertEqual(stats["read_folders"].rows, 5)
+        self.assertEqual(stats["sign_in"].rows, 0)
+
+    def test_pool_wait_per_operation(self):
+        metrics = QueryMetrics()
+        metrics.observe_pool_wait("sign_in", 0.003)
+        metrics.observe_pool_wait("read_folders", 0.001)
+        metrics.observe_query("read_folders", 0.002, 1)
+
+        stats = {s.operation: s for s in metrics.stats()}
+        self.assertEqual(stats["sign_in"].pool_wait.count, 1)
+        self.assertEqual(stats["sign_in"].latency.count, 0)
+        self.assertEqual(stats["read_folders"].pool_wait.count, 1)
+        self.assertEqual(metrics.pool_wait().count, 2)
+
+    def test_slow_threshold(self):
+        self.assertFalse(QueryMetrics().is_slow(10))
+        metrics = QueryMetrics(slow_query_threshold=0.5)
+        self.assertTrue(metrics.is_slow(0.5))
+        self.assertFalse(metrics.is_slow(0.1))
+
+
+class TestInstrumentedCursor(unittest.TestCase):
+    def setUp(self):
+        self.metrics = QueryMetrics(slow_query_threshold=0.0)
+        patcher = patch("app.instrumentation.query_metrics", self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cursor = InstrumentedCursor(MagicMock())
+
+    @patch.object(Cursor, "execute")
+    @patch("app.instrumentation.logger")
+    def test_execute_is_recorded_and_slow_query_logged(self, mock_logger, _):
+        with operation("read_folder"):
+            self.cursor.execute("SELECT * FROM picture_set WHERE id = %s", ("x",))
+
+        (stats,) = self.metrics.stats()
+        self.assertEqual(stats.operation, "read_folder")
+        self.assertEqual(stats.latency.count, 1)
+        message = mock_logger.warning.call_args.args[0]
+        self.assertIn("read_folder", message)
+        self.assertIn("1 parameters redacted", message)
+        self.assertNotIn("'x'", message)
+
+    @patch.object(Cursor, "execute", side_effect=RuntimeError("boom"))
+    @patch("app.instrumentation.logger")
+    def test_failed_statement_is_recorded(self, *_):
+        with self.assertRaises(RuntimeError):
+            self.cursor.execute("SELECT 1")
+        (stats,) = self.metrics.stats()
+        self.assertEqual(stats.latency.count, 1)
+
+    @patch.object(Cursor, "executemany")
+    @patch("app.instrumentation.logger")
+    def test_executemany_is_recorded(self, mock_logger, _):
+        with operation("create_folder"):
+            self.cursor.executemany(
+                "INSERT INTO picture VALUES (%s, %s)", iter([(1, "a"), (2, "b")])
+            )
+
+        (stats,) = self.metrics.stats()
+        self.assertEqual(stats.operation, "create_folder")
+        self.assertEqual(stats.latency.count, 1)
+        message = mock_logger.warning.call_args.args[0]
+        self.assertIn("4 parameters redacted", message)
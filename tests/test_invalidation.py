@@ -0,0 +1,69 @@
+import json
+import unittest
+import uuid
+from unittest.mock import MagicMock
+
+from app.cache import TTLCache
+from app.invalidation import InvalidationBus
+
+
+class TestInvalidationBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = InvalidationBus("dbname=test", "test_channel")
+        self.cache = TTLCache("inspections")
+        self.bus.register(self.cache)
+        self.key = (uuid.uuid4(), uuid.uuid4())
+
+    def test_register_attaches_bus_to_cache(self):
+        self.assertIs(self.cache.bus, self.bus)
+        self.assertIs(self.bus.caches["inspections"], self.cache)
+
+    def test_publish_notifies_on_cursor(self):
+        cursor = MagicMock()
+        self.bus.publish(cursor, "inspections", self.key)
+
+        cursor.execute.assert_called_once()
+        channel, payload = cursor.execute.call_args.args[1]
+        self.assertEqual(channel, "test_channel")
+        self.assertEqual(
+            json.loads(payload),
+            {"cache": "inspections", "key": [str(k) for k in self.key]},
+        )
+
+    def test_cache_invalidate_with_cursor_publishes(self):
+        cursor = MagicMock()
+        self.cache.set(self.key, "value")
+
+        self.cache.invalidate(self.key, cursor)
+
+        self.assertIsNone(self.cache.get(self.key))
+        cursor.execute.assert_called_once()
+
+    def test_cache_invalidate_without_cursor_stays_local(self):
+        self.cache.set(self.key, "value")
+        self.cache.invalidate(self.key)
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_apply_evicts_published_key(self):
+        cursor = MagicMock()
+        self.bus.publish(cursor, "inspections", self.key)
+        _, payload = cursor.execute.call_args.args[1]
+        self.cache.set(self.key, "value")
+
+        self.bus.apply(payload)
+
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_apply_string_key(self):
+        self.cache.set("user@example.com", "value")
+        self.bus.apply(
+            json.dumps({"cache": "inspections", "key": ["user@example.com"]})
+        )
+        self.assertIsNone(self.cache.get("user@example.com"))
+
+    def test_apply_ignores_unknown_cache_and_bad_payloads(self):
+        self.cache.set(self.key, "value")
+        self.bus.apply(json.dumps({"cache": "unknown", "key": ["a"]}))
+        self.bus.apply("not json")
+        self.bus.apply(json.dumps({"cache": "inspections"}))
+        self.assertEqual(self.cache.get(self.key), "value")
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from app.ratelimit import (
+    PostgresRateLimiter,
+    TokenBucketLimiter,
+    rate_limit_table_exists,
+    retry_after,
+)
+
+
+class TestTokenBucketLimiter(unittest.TestCase):
+    def test_burst_then_refill(self):
+        limiter = TokenBucketLimiter({"analyze": (2, 0.5)})
+        with patch("app.ratelimit.time.monotonic", return_value=100.0):
+            self.assertEqual(limiter.acquire("user", "analyze"), 0)
+            self.assertEqual(limiter.acquire("user", "analyze"), 0)
+            self.assertAlmostEqual(limiter.acquire("user", "analyze"), 2.0)
+        with patch("app.ratelimit.time.monotonic", return_value=102.0):
+            self.assertEqual(limiter.acquire("user", "analyze"), 0)
+
+    def test_budgets_are_per_user_and_route_class(self):
+        limiter = TokenBucketLimiter({"analyze": (1, 1.0), "read": (1, 1.0)})
+        self.assertEqual(limiter.acquire("user", "analyze"), 0)
+        self.assertGreater(limiter.acquire("user", "analyze"), 0)
+        self.assertEqual(limiter.acquire("user", "read"), 0)
+        self.assertEqual(limiter.acquire("other", "analyze"), 0)
+
+    def test_unlimited_route_class(self):
+        limiter = TokenBucketLimiter({})
+        for _ in range(10):
+            self.assertEqual(limiter.acquire("user", "read"), 0)
+
+    def test_retry_after_rounds_up(self):
+        self.assertEqual(retry_after(0.2), "1")
+        self.assertEqual(retry_after(2.5), "3")
+
+
+class TestPostgresRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        conn_mock = MagicMock()
+        self.cursor_mock = MagicMock()
+        conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = conn_mock
+        self.limiter = PostgresRateLimiter(self.cp, {"upload": (5, 0.5)})
+
+    def test_token_taken(self):
+        self.cursor_mock.fetchone.return_value = (3.0,)
+        self.assertEqual(self.limiter.acquire("user", "upload"), 0)
+        self.cursor_mock.execute.assert_called_once()
+        params = self.cursor_mock.execute.call_args.args[1]
+        self.assertEqual(params["key"], "user:upload")
+
+    def test_bucket_empty(self):
+        self.cursor_mock.fetchone.side_effect = [None, (0.25,)]
+        self.assertAlmostEqual(self.limiter.acquire("user", "upload"), 1.5)
+        self.assertEqual(self.cursor_mock.execute.call_count, 2)
+
+    def test_rate_limit_table_exists(self):
+        conn = MagicMock()
+        conn.execute.return_value.fetchone.return_value = (None,)
+        self.assertFalse(rate_limit_table_exists(conn))
+        conn.execute.return_value.fetchone.return_value = ("rate_limit_bucket",)
+        self.assertTrue(rate_limit_table_exists(conn))
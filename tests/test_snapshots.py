@@ -0,0 +1,98 @@
+import json
+import unittest
+import uuid
+from datetime import datetime
+from unittest.mock import MagicMock, call, patch
+
+from app.etags import make_etag
+from app.snapshots import (
+    backfill,
+    check,
+    read_snapshots,
+    refresh_snapshot,
+    snapshot_table_exists,
+)
+
+
+class TestSnapshots(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.user_id = uuid.uuid4()
+        self.id = uuid.uuid4()
+
+    @patch("app.snapshots.InspectionResponse")
+    def test_read_snapshots_returns_etag_and_document(self, mock_response):
+        version = datetime(2024, 1, 1)
+        self.cursor.fetchall.return_value = [(self.id, version, {"verified": True})]
+
+        snapshots = read_snapshots(self.cursor, self.user_id, [self.id])
+
+        etag, inspection = snapshots[self.id]
+        self.assertEqual(etag, make_etag(self.id, version))
+        self.assertIs(inspection, mock_response.model_validate.return_value)
+        mock_response.model_validate.assert_called_once_with({"verified": True})
+        self.assertEqual(
+            self.cursor.execute.call_args.args[1], ([self.id], self.user_id)
+        )
+
+    @patch("app.snapshots.get_full_inspection_json")
+    async def test_refresh_snapshot_upserts_document(self, mock_get_full):
+        mock_get_full.return_value = json.dumps({"verified": False})
+
+        await refresh_snapshot(self.cursor, self.user_id, self.id)
+
+        mock_get_full.assert_called_once_with(self.cursor, self.id, self.user_id)
+        self.assertEqual(
+            self.cursor.execute.call_args.args[1],
+            (mock_get_full.return_value, self.id, self.user_id),
+        )
+
+    def test_snapshot_table_exists(self):
+        conn = MagicMock()
+        conn.execute.return_value.fetchone.return_value = (None,)
+        self.assertFalse(snapshot_table_exists(conn))
+        conn.execute.return_value.fetchone.return_value = ("inspection_snapshot",)
+        self.assertTrue(snapshot_table_exists(conn))
+
+    @patch("app.snapshots.refresh_snapshot")
+    async def test_backfill_walks_batches(self, mock_refresh):
+        conn = MagicMock()
+        conn.transaction.return_value.__exit__.return_value = False
+        cursor = conn.cursor.return_value.__enter__.return_value
+        ids = sorted(uuid.uuid4() for _ in range(3))
+        cursor.fetchall.side_effect = [
+            [(ids[0], self.user_id), (ids[1], self.user_id)],
+            [(ids[2], self.user_id)],
+        ]
+
+        written = await backfill(conn, batch_size=2)
+
+        self.assertEqual(written, 3)
+        self.assertEqual(mock_refresh.call_count, 3)
+        mock_refresh.assert_has_calls([call(cursor, self.user_id, ids[2])])
+        self.assertEqual(cursor.execute.call_args.args[1], (ids[1], 2))
+
+    @patch("app.snapshots.InspectionResponse")
+    @patch("app.snapshots.get_full_inspection_json")
+    async def test_check_reports_stale_and_differing(
+        self, mock_get_full, mock_response
+    ):
+        conn = MagicMock()
+        snapshots, cursor = MagicMock(), MagicMock()
+        conn.cursor.return_value.__enter__.side_effect = [snapshots, cursor]
+        stale, differs, same = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        snapshots.__iter__.return_value = iter(
+            [
+                (stale, self.user_id, {}, False),
+                (differs, self.user_id, {"v": 1}, True),
+                (same, self.user_id, {"v": 2}, True),
+            ]
+        )
+        mock_get_full.return_value = "{}"
+        mock_response.model_validate_json.return_value = {"v": 2}
+        mock_response.model_validate.side_effect = lambda document: document
+
+        problems = await check(conn)
+
+        self.assertEqual(problems, [(stale, "stale"), (differs, "differs")])
+        self.assertEqual(mock_get_full.call_count, 2)
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+import unittest
+import uuid
+from unittest.mock import AsyncMock, MagicMock
+
+from datastore.blob.azure_storage_api import build_container_name
+
+from app.deadlines import Deadline, current_deadline
+from app.storage import (
+    BLOB_BATCH_SIZE,
+    BlobStorage,
+    apply_deadline,
+    delete_blobs,
+    run_in_thread,
+)
+
+CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=https;AccountName=account;"
+    "AccountKey=a2V5;EndpointSuffix=core.windows.net"
+)
+
+
+class TestBlobStorage(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.storage = BlobStorage(CONNECTION_STRING, pool_size=4)
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+
+    def test_container_clients_are_cached_per_user(self):
+        user_id = uuid.uuid4()
+        client = self.storage.container(user_id)
+        self.assertIs(self.storage.container(str(user_id)), client)
+        self.assertIsNot(self.storage.container(uuid.uuid4()), client)
+        self.assertEqual(client.container_name, build_container_name(str(user_id)))
+
+    def test_async_container_clients_are_cached_per_user(self):
+        user_id = uuid.uuid4()
+        client = self.storage.async_container(user_id)
+        self.assertIs(self.storage.async_container(user_id), client)
+        self.assertIsNot(client, self.storage.container(user_id))
+        self.assertEqual(client.container_name, build_container_name(str(user_id)))
+
+    async def test_client_cache_is_bounded(self):
+        storage = BlobStorage(CONNECTION_STRING, pool_size=4, max_clients=2)
+        try:
+            first = uuid.uuid4()
+            client = storage.container(first)
+            storage.container(uuid.uuid4())
+            storage.container(uuid.uuid4())
+            self.assertIsNot(storage.container(first), client)
+        finally:
+            await storage.close()
+
+    def test_container_clients_share_the_transport(self):
+        first = self.storage.container(uuid.uuid4())
+        second = self.storage.container(uuid.uuid4())
+        self.assertIs(
+            first._pipeline._transport._transport,
+            second._pipeline._transport._transport,
+        )
+
+
+class TestApplyDeadline(unittest.TestCase):
+    def test_without_deadline_leaves_options(self):
+        request = MagicMock()
+        request.context.options = {}
+        apply_deadline(request)
+        self.assertEqual(request.context.options, {})
+
+    def test_bounds_timeouts_by_current_deadline(self):
+        request = MagicMock()
+        request.context.options = {}
+        token = current_deadline.set(Deadline(5))
+        try:
+            apply_deadline(request)
+        finally:
+            current_deadline.reset(token)
+        self.assertLessEqual(request.context.options["read_timeout"], 5)
+        self.assertLessEqual(request.context.options["connection_timeout"], 5)
+
+
+class TestDeleteBlobs(unittest.IsolatedAsyncioTestCase):
+    async def test_deletes_in_batches(self):
+        async def responses():
+            yield MagicMock(status_code=202)
+
+        container_client = MagicMock()
+        container_client.delete_blobs = AsyncMock(
+            side_effect=lambda *a, **k: responses()
+        )
+        names = [f"folder/{i}" for i in range(BLOB_BATCH_SIZE + 1)]
+
+        await delete_blobs(container_client, names)
+
+        batches = [call.args for call in container_client.delete_blobs.call_args_list]
+        self.assertEqual(batches, [tuple(names[:BLOB_BATCH_SIZE]), (names[-1],)])
+
+    async def test_failed_batch_is_not_raised(self):
+        container_client = MagicMock()
+        container_client.delete_blobs = AsyncMock(side_effect=RuntimeError("down"))
+
+        await delete_blobs(container_client, ["folder/1"])
+
+
+class TestRunInThread(unittest.IsolatedAsyncioTestCase):
+    async def test_blocking_coroutine_leaves_the_loop_free(self):
+        async def blocking():
+            time.sleep(0.1)
+            return threading.current_thread()
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        thread = await run_in_thread(blocking())
+        ticker.cancel()
+
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertGreater(ticks, 3)
@@ -0,0 +1,42 @@
+import unittest
+import uuid
+
+from app.exceptions import InvalidTokenError
+from app.models.users import User
+from app.tokens import TokenSigner
+
+
+class TestTokenSigner(unittest.TestCase):
+    def setUp(self):
+        self.user = User(id=uuid.uuid4(), username="test_user")
+
+    def test_issue_and_verify(self):
+        signer = TokenSigner(["key"])
+        token, expires_at = signer.issue(self.user)
+        self.assertEqual(signer.verify(token), self.user)
+        self.assertGreater(expires_at.timestamp(), 0)
+
+    def test_rotated_keys_still_verify(self):
+        token, _ = TokenSigner(["old"]).issue(self.user)
+        self.assertEqual(TokenSigner(["new", "old"]).verify(token), self.user)
+        with self.assertRaises(InvalidTokenError):
+            TokenSigner(["new"]).verify(token)
+
+    def test_tampered_token(self):
+        signer = TokenSigner(["key"])
+        token, _ = signer.issue(self.user)
+        other, _ = signer.issue(User(id=uuid.uuid4(), username="other"))
+        forged = f"{other.split('.')[0]}.{token.split('.')[1]}"
+        for bad in (forged, "garbage", "", token + "x", "é.é"):
+            with self.assertRaises(InvalidTokenError):
+                signer.verify(bad)
+
+    def test_expired_token(self):
+        signer = TokenSigner(["key"], ttl=-1)
+        token, _ = signer.issue(self.user)
+        with self.assertRaises(InvalidTokenError):
+            signer.verify(token)
+
+    def test_keys_required(self):
+        with self.assertRaises(ValueError):
+            TokenSigner([])
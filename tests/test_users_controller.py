@@ -1,10 +1,12 @@
 import unittest
+from uuid import uuid4
 from unittest.mock import AsyncMock, MagicMock, patch
 
-from datastore import UserAlreadyExistsError as DBUserAlreadyExistsError
 from datastore.db.queries.user import UserNotFoundError as DBUserNotFoundError
+from psycopg.errors import UniqueViolation
 
-from app.controllers.users import sign_in, sign_up
+from app.cache import TTLCache
+from app.controllers.users import provision_storage, sign_in, sign_up
 from app.exceptions import (
     MissingUserAttributeError,
     UserConflictError,
@@ -21,25 +23,40 @@ class TestSignUpSuccess(unittest.IsolatedAsyncioTestCase):
         conn_mock.cursor.return_value.__enter__.return_value = cursor_mock
         cp.connection.return_value.__enter__.return_value = conn_mock
         mock_user = User(username="test_user")
-        mock_new_user = AsyncMock(return_value=MagicMock(id=1))
-        mock_storage_url = "mocked_storage_url"
-
-        with patch("app.controllers.users.new_user", mock_new_user):
-            result = await sign_up(cp, mock_user, mock_storage_url)
+        user_id = uuid4()
+        folder_id = uuid4()
+
+        with (
+            patch(
+                "app.controllers.users.register_user", return_value=user_id
+            ) as mock_register_user,
+            patch(
+                "app.controllers.users.new_picture_set", return_value=folder_id
+            ) as mock_new_picture_set,
+            patch(
+                "app.controllers.users.set_default_picture_set"
+            ) as mock_set_default_picture_set,
+        ):
+            result, result_folder_id = await sign_up(cp, mock_user)
 
         cp.connection.assert_called_once()
-        mock_new_user.assert_awaited_once_with(
-            cursor_mock, "test_user", mock_storage_url
+        mock_register_user.assert_called_once_with(cursor_mock, "test_user")
+        self.assertEqual(
+            mock_new_picture_set.call_args.kwargs["folder_name"], "General"
         )
-        self.assertEqual(result.id, 1)
+        mock_set_default_picture_set.assert_called_once_with(
+            cursor_mock, user_id, folder_id
+        )
+        self.assertEqual(result.id, user_id)
         self.assertEqual(result.username, "test_user")
+        self.assertEqual(result_folder_id, folder_id)
 
     async def test_sign_up_missing_username(self):
         cp = MagicMock()
         mock_user = User(username="")
 
         with self.assertRaises(MissingUserAttributeError):
-            await sign_up(cp, mock_user, "mock_storage_url")
+            await sign_up(cp, mock_user)
 
     async def test_sign_up_user_already_exists(self):
         cp = MagicMock()
@@ -48,11 +65,34 @@ class TestSignUpSuccess(unittest.IsolatedAsyncioTestCase):
         conn_mock.cursor.return_value.__enter__.return_value = cursor_mock
         cp.connection.return_value.__enter__.return_value = conn_mock
         mock_user = User(username="existing_user")
-        mock_new_user = AsyncMock(side_effect=DBUserAlreadyExistsError)
 
-        with patch("app.controllers.users.new_user", mock_new_user):
+        with patch(
+            "app.controllers.users.register_user", side_effect=UniqueViolation()
+        ):
+            with self.assertRaises(UserConflictError):
+                await sign_up(cp, mock_user)
+
+    async def test_sign_up_wrapped_unique_violation(self):
+        cp = MagicMock()
+        mock_user = User(username="existing_user")
+
+        def register_user(cursor, username):
+            try:
+                raise UniqueViolation()
+            except UniqueViolation:
+                raise RuntimeError("Error: user not registered")
+
+        with patch("app.controllers.users.register_user", register_user):
             with self.assertRaises(UserConflictError):
-                await sign_up(cp, mock_user, "mock_storage_url")
+                await sign_up(cp, mock_user)
+
+    async def test_sign_up_other_errors_propagate(self):
+        cp = MagicMock()
+        with patch(
+            "app.controllers.users.register_user", side_effect=RuntimeError("down")
+        ):
+            with self.assertRaises(RuntimeError):
+                await sign_up(cp, User(username="new_user"))
 
     async def test_successful_user_sign_in(self):
         cp = MagicMock()
@@ -90,3 +130,90 @@ class TestSignUpSuccess(unittest.IsolatedAsyncioTestCase):
         with patch("app.controllers.users.get_user", mock_get_user):
             with self.assertRaises(UserNotFoundError):
                 await sign_in(cp, mock_user)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cp = MagicMock()
+        self.conn_mock = MagicMock()
+        self.cursor_mock = MagicMock()
+        self.conn_mock.cursor.return_value.__enter__.return_value = self.cursor_mock
+        self.cp.connection.return_value.__enter__.return_value = self.conn_mock
+        self.cache = TTLCache("users")
+
+    async def test_sign_in_cache_hit_skips_database(self):
+        user_id = uuid4()
+        mock_get_user = AsyncMock(return_value=MagicMock(id=user_id))
+
+        with patch("app.controllers.users.get_user", mock_get_user):
+            first = await sign_in(self.cp, User(username="test_user"), self.cache)
+            second = await sign_in(self.cp, User(username="test_user"), self.cache)
+
+        mock_get_user.assert_awaited_once()
+        self.cp.connection.assert_called_once()
+        self.assertEqual(first.id, user_id)
+        self.assertEqual(second.id, user_id)
+        self.assertEqual(self.cache.hits, 1)
+
+    async def test_sign_in_caches_unknown_users(self):
+        mock_get_user = AsyncMock(side_effect=DBUserNotFoundError)
+
+        with patch("app.controllers.users.get_user", mock_get_user):
+            for _ in range(2):
+                with self.assertRaises(UserNotFoundError):
+                    await sign_in(self.cp, User(username="unknown"), self.cache)
+
+        mock_get_user.assert_awaited_once()
+
+    async def test_sign_up_invalidates_cached_miss(self):
+        self.cache.set("new_user", False)
+
+        with (
+            patch("app.controllers.users.register_user", return_value=uuid4()),
+            patch("app.controllers.users.new_picture_set", return_value=uuid4()),
+            patch("app.controllers.users.set_default_picture_set"),
+        ):
+            await sign_up(self.cp, User(username="new_user"), self.cache)
+
+        self.assertIsNone(self.cache.get("new_user"))
+
+
+class TestProvisionStorage(unittest.IsolatedAsyncioTestCase):
+    @patch("app.controllers.users.create_storage_folder", new_callable=AsyncMock)
+    @patch("app.controllers.users.ensure_container", new_callable=AsyncMock)
+    async def test_retries_until_created(
+        self, mock_ensure_container, mock_create_storage_folder
+    ):
+        mock_ensure_container.side_effect = [Exception("unavailable"), None]
+        mock_create_storage_folder.return_value = True
+        storage = MagicMock()
+        user_id = uuid4()
+        folder_id = uuid4()
+
+        await provision_storage(storage, user_id, folder_id, attempts=3, delay=0)
+
+        self.assertEqual(mock_ensure_container.call_count, 2)
+        storage.async_container.assert_called_with(user_id)
+        mock_ensure_container.assert_called_with(storage.async_container.return_value)
+        mock_create_storage_folder.assert_awaited_once_with(
+            storage.container.return_value, str(folder_id), "General"
+        )
+
+    @patch("app.controllers.users.create_storage_folder", new_callable=AsyncMock)
+    @patch("app.controllers.users.ensure_container", new_callable=AsyncMock)
+    async def test_retries_folder_creation(
+        self, mock_ensure_container, mock_create_storage_folder
+    ):
+        mock_create_storage_folder.side_effect = [False, True]
+
+        await provision_storage(MagicMock(), uuid4(), uuid4(), attempts=3, delay=0)
+
+        self.assertEqual(mock_create_storage_folder.await_count, 2)
+
+    @patch("app.controllers.users.ensure_container", new_callable=AsyncMock)
+    async def test_gives_up_after_attempts(self, mock_ensure_container):
+        mock_ensure_container.side_effect = Exception("unavailable")
+
+        await provision_storage(MagicMock(), uuid4(), uuid4(), attempts=3, delay=0)
+
+        self.assertEqual(mock_ensure_container.call_count, 3)